@@ -5,13 +5,17 @@ import logging
 import numpy as np
 from typing import List, Union, Tuple, Dict, Optional, Sequence
 from rid.utils import list_to_string
+from rid.constants import f_cvt
 from rid.common.mol import get_dihedral_from_resid, get_distance_from_atomid
+from rid.nn.numpy_model import NumpyModel
 from rid.common.plumed.plumed_constant import (
     dihedral_name,
     distance_name,
     dihedral_def_from_atoms,
     distance_def_from_atoms,
     deepfe_def,
+    custom_def,
+    bias_value_def,
     print_def,
     restraint_def,
     upper_def,
@@ -81,6 +85,113 @@ def make_deepfe_bias(
         arg = cv_string
     )
 
+def _linear_expr(weights, variables, bias=None):
+    terms = ["%+.10g*%s" % (ww, var) for ww, var in zip(weights, variables) if ww != 0.]
+    if bias is not None:
+        terms.append("%+.10g" % bias)
+    if len(terms) == 0:
+        return "0"
+    return "".join(terms).lstrip("+")
+
+
+def _make_custom(name, arg_list, func):
+    return custom_def.format(
+        name = name,
+        arg = list_to_string(arg_list, ","),
+        var = list_to_string(["x%d" % ii for ii in range(len(arg_list))], ","),
+        func = func
+    )
+
+
+def make_ann_network(
+        cv_list: List[str],
+        model: NumpyModel,
+        prefix: str
+    ) -> Tuple[List[str], str]:
+    """PLUMED `CUSTOM` actions evaluating the network `model` of CVs `cv_list`, one action per neuron.
+
+    Angles are shifted inside their cos/sin features, the shift of other CVs is folded into
+    `layer_0`. Returns the actions and the label of the network energy.
+
+    The networks are trained on forces w.r.t. the normalized CVs, which `DEEPFE` applies to
+    the CVs as they are. The forces of the `CUSTOM` actions are derivatives w.r.t. the CVs, so
+    networks with CVs scaled by their normalization are refused, as no energy has those forces.
+    """
+    assert len(cv_list) == model.cv_dim, "Make sure `cv_list` matches the input of the network."
+    scaled = [cv_name for cv_name, scale in zip(cv_list, model.input_scale) if scale != 1.]
+    if len(scaled) > 0:
+        raise RuntimeError(
+            "ANN bias cannot reproduce the forces of a network with scaled CVs %s, "
+            "use the deepfe bias format." % list_to_string(scaled, ","))
+    content_list = []
+    cos_list, sin_list, dist_list = [], [], []
+    for idx, cv_name in enumerate(cv_list):
+        if not model.angular_mask[idx]:
+            dist_list.append(cv_name)
+            continue
+        angle = "x0"
+        if model.input_shift[idx] != 0.:
+            angle = "x0%+.10g" % -model.input_shift[idx]
+        for trig, trig_list in [("cos", cos_list), ("sin", sin_list)]:
+            name = "%s_%s%d" % (prefix, trig, idx)
+            content_list.append(_make_custom(name, [cv_name], "%s(%s)" % (trig, angle)))
+            trig_list.append(name)
+    layer = cos_list + sin_list + dist_list
+    matrix_0, bias_0 = model.folded_layer_0()
+    for ii, (matrix, bias, timestep) in enumerate(zip(model.matrices, model.biases, model.timesteps)):
+        if ii == 0:
+            matrix, bias = matrix_0, bias_0
+        variables = ["x%d" % jj for jj in range(len(layer))]
+        next_layer = []
+        for jj in range(matrix.shape[1]):
+            func = "tanh(%s)" % _linear_expr(matrix[:, jj], variables, bias[jj])
+            if timestep is not None:
+                func = "x%d%+.10g*%s" % (jj, timestep[jj], func)
+            name = "%s_l%d_%d" % (prefix, ii, jj)
+            content_list.append(_make_custom(name, layer, func))
+            next_layer.append(name)
+        layer = next_layer
+    energy_name = "%s_energy" % prefix
+    content_list.append(_make_custom(
+        energy_name, layer, _linear_expr(model.energy_matrix[:, 0], ["x%d" % jj for jj in range(len(layer))])))
+    return content_list, energy_name
+
+
+def make_ann_bias(
+        cv_list: List[str],
+        model_list: List[str] = ["graph.pb"],
+        label: str = "dpfe"
+    ) -> str:
+    """TensorFlow-free alternative to `make_deepfe_bias`: the networks in `model_list` (frozen `.pb`
+    graphs or `.npz` weights of `rid.nn.numpy_model`) are written out as `CUSTOM` actions and
+    their mean free energy is applied, with the opposite sign, by `BIASVALUE`, whose `bias`
+    component is printed like that of `DEEPFE`.
+
+    No trust levels are applied, as the model deviation is not available to PLUMED. Use a single
+    network distilled from the ensemble with switched targets (see `DistillModel`) to keep them.
+    """
+    if len(model_list) == 0:
+        return ""
+    if len(model_list) > 1:
+        logger.warning("trust levels are not applied by ANN bias of %d models." % len(model_list))
+    content_list = []
+    energy_list = []
+    for idx, model in enumerate(model_list):
+        if str(model).endswith(".npz"):
+            network = NumpyModel.load(model)
+        else:
+            network = NumpyModel.from_graph(model)
+        network_content, energy_name = make_ann_network(cv_list, network, "%s_ann%d" % (label, idx))
+        content_list += network_content
+        energy_list.append(energy_name)
+    # networks give free energies in eV, the bias is minus their mean in kJ/mol
+    variables = ["x%d" % ii for ii in range(len(energy_list))]
+    content_list.append(_make_custom(
+        label + "_energy", energy_list, _linear_expr([-f_cvt / len(energy_list)] * len(energy_list), variables)))
+    content_list.append(bias_value_def.format(name = label, arg = label + "_energy"))
+    return list_to_string(content_list, "\n")
+
+
 def make_print_bias(
         name_list,
         stride,
@@ -319,7 +430,8 @@ def make_deepfe_plumed(
         output: str = "plm.out",
         mode: str = "torsion",
         wall_list: Optional[List[str]] = None,
-        iteration: Optional[str] = None
+        iteration: Optional[str] = None,
+        bias_format: str = "deepfe"
     ):
     content_list = []
     if mode == "torsion":
@@ -340,7 +452,12 @@ def make_deepfe_plumed(
     if wall_list is not None:
         ret = make_wall_list(cv_name_list, wall_list, iteration)
         content_list.append(ret)
-    deepfe_string = make_deepfe_bias(cv_name_list, trust_lvl_1, trust_lvl_2, model_list)
+    if bias_format == "deepfe":
+        deepfe_string = make_deepfe_bias(cv_name_list, trust_lvl_1, trust_lvl_2, model_list)
+    elif bias_format == "ann":
+        deepfe_string = make_ann_bias(cv_name_list, model_list)
+    else:
+        raise RuntimeError("Unknown bias format for making plumed files.")
     content_list.append(deepfe_string)
     content_list.append(make_print_bias(cv_name_list, stride, output, model_list))
     return list_to_string(content_list, split_sign="\n")
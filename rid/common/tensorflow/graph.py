@@ -10,8 +10,13 @@ def load_graph(frozen_graph_filename,
     # We load the protobuf file from the disk and parse it to retrieve the
     # unserialized graph_def
     with tf.gfile.GFile(str(frozen_graph_filename), "rb") as f:
-        graph_def = tf.GraphDef()
-        graph_def.ParseFromString(f.read())
+        return load_graph_def(f.read(), prefix=prefix)
+
+
+def load_graph_def(serialized_graph_def,
+                   prefix='load'):
+    graph_def = tf.GraphDef()
+    graph_def.ParseFromString(serialized_graph_def)
 
     # Then, we can use again a convenient built-in function to import a graph_def into the
     # current default Graph
@@ -24,4 +29,42 @@ def load_graph(frozen_graph_filename,
             op_dict=None,
             producer_op_list=None
         )
-    return graph
\ No newline at end of file
+    return graph
+
+def load_ensemble_graph(serialized_graph_defs,
+                        prefix='load'):
+    # Import all ensemble members into one graph. Members live under
+    # `{prefix}_000`, `{prefix}_001`, ... and share the input placeholders
+    # `{prefix}/inputs` and `{prefix}/drop_out_rate`. `{prefix}/o_energy_all` and
+    # `{prefix}/o_forces_all` stack the outputs of the members along the first axis,
+    # `{prefix}/o_energy` and `{prefix}/o_forces` are their ensemble means, so the graph
+    # can be used wherever a single model graph is expected.
+    graph_defs = []
+    for serialized_graph_def in serialized_graph_defs:
+        graph_def = tf.GraphDef()
+        graph_def.ParseFromString(serialized_graph_def)
+        graph_defs.append(graph_def)
+    assert len(graph_defs) > 0, "No model provided."
+    input_node = [node for node in graph_defs[0].node if node.name == 'inputs'][0]
+    input_shape = [dim.size if dim.size >= 0 else None for dim in input_node.attr["shape"].shape.dim]
+
+    with tf.Graph().as_default() as graph:
+        with tf.name_scope(prefix + '/'):
+            inputs = tf.placeholder(tf.as_dtype(input_node.attr["dtype"].type), input_shape, name='inputs')
+            drop_out_rate = tf.placeholder(tf.float32, name='drop_out_rate')
+        energies, forces = [], []
+        for ii, graph_def in enumerate(graph_defs):
+            energy, force = tf.import_graph_def(
+                graph_def,
+                input_map={'inputs:0': inputs, 'drop_out_rate:0': drop_out_rate},
+                return_elements=['o_energy:0', 'o_forces:0'],
+                name='{}_{:03d}'.format(prefix, ii)
+            )
+            energies.append(energy)
+            forces.append(force)
+        with tf.name_scope(prefix + '/'):
+            o_energy_all = tf.stack(energies, axis=0, name='o_energy_all')
+            o_forces_all = tf.stack(forces, axis=0, name='o_forces_all')
+            tf.reduce_mean(o_energy_all, axis=0, name='o_energy')
+            tf.reduce_mean(o_forces_all, axis=0, name='o_forces')
+    return graph
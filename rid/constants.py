@@ -11,6 +11,7 @@ cluster_selection_index_name = "cls_sel.ndx.npy"
 sel_ndx_name = "sel.ndx.npy"
 cv_init_label = "cv_init_{walker:03d}_{idx:d}.out"
 model_devi_name = "model_devi.txt"
+model_devi_cache_name = "model_devi_cache.npz"
 label_task_pattern = "{:03d}"
 cv_force_out = "cv_forces.out"
 data_new = "data.new.npy"
@@ -53,6 +54,10 @@ lmp_conf_out = "confout.lmp"
 # Tensorflow files
 tf_model_name = "model_{tag}.pb"
 train_log = "log_{tag}"
+train_metrics = "metrics_{tag}.jsonl"
+# tag and training data of the network distilled from the ensemble
+distill_tag = "distill"
+distill_data_name = "data_distill.npy"
 dp_model_name = "dp.pb"
 model_tag_fmt = "{idx:03d}"
 N_grid = 100
@@ -42,6 +42,8 @@ def resubmit_rid(
     for resource_type in resources.keys():
         normalized_resources[resource_type] = normalize_resources(resources[resource_type])
 
+    jdata = load_json(rid_config)
+
     rid_op = prep_rid_op(
         prep_exploration_config = normalized_resources[tasks["prep_exploration_config"]],
         run_exploration_config = normalized_resources[tasks["run_exploration_config"]],
@@ -53,7 +55,10 @@ def resubmit_rid(
         run_train_config = normalized_resources[tasks["run_train_config"]],
         model_devi_config = normalized_resources[tasks["model_devi_config"]],
         workflow_steps_config = normalized_resources[tasks["workflow_steps_config"]],
-        retry_times=None
+        retry_times=None,
+        global_select=jdata["SelectorConfig"].get("global_select", False),
+        ensemble_train=jdata["Train"].get("ensemble_train", False),
+        distill="distill" in jdata["Train"]
     )
 
     if isinstance(confs, str):
@@ -68,8 +73,6 @@ def resubmit_rid(
     else:
         index_file_artifact = upload_artifact(Path(index_file), archive=None)
     
-    jdata = load_json(rid_config)
-    
     inputfiles = []
     if "inputfile" in jdata["ExploreMDConfig"]:
         inputfiles.append(jdata["ExploreMDConfig"]["inputfile"])
@@ -24,12 +24,12 @@ from rid.op.prep_label import PrepLabel, CheckLabelInputs
 from rid.op.run_label import RunLabel
 from rid.op.label_stats import LabelStats
 from rid.superop.selector import Selector
-from rid.op.prep_select import PrepSelect
+from rid.op.prep_select import PrepSelect, PrepSelectGlobal
 from rid.op.run_select import RunSelect
 from rid.superop.data import DataGenerator
 from rid.op.prep_data import CollectData, MergeData
 from rid.superop.blocks import IterBlock, InitBlock
-from rid.op.run_train import TrainModel
+from rid.op.run_train import TrainModel, TrainModels, DistillModel
 from rid.op.run_model_devi import RunModelDevi
 from rid.op.adjust_trust_level import AdjustTrustLevel
 from rid.flow.loop import ReinforcedDynamics
@@ -46,7 +46,10 @@ def prep_rid_op(
     run_train_config,
     model_devi_config,
     workflow_steps_config,
-    retry_times
+    retry_times,
+    global_select = False,
+    ensemble_train = False,
+    distill = False
     ):
 
     exploration_op = Exploration(
@@ -69,11 +72,12 @@ def prep_rid_op(
 
     select_op = Selector(
         "select",
-        PrepSelect,
+        PrepSelectGlobal if global_select else PrepSelect,
         RunSelect,
         prep_select_config,
         run_select_config,
-        retry_times=retry_times)
+        retry_times=retry_times,
+        global_select=global_select)
 
     data_op = DataGenerator(
         "gen-data",
@@ -88,11 +92,13 @@ def prep_rid_op(
         select_op,
         label_op,
         data_op,
-        TrainModel,
+        TrainModels if ensemble_train else TrainModel,
         RunModelDevi,
         run_train_config,
         model_devi_config,
-        retry_times=retry_times
+        retry_times=retry_times,
+        ensemble_train=ensemble_train,
+        distill_op=DistillModel if distill else None
     )
 
     block_op = IterBlock(
@@ -102,12 +108,14 @@ def prep_rid_op(
         label_op,
         data_op,
         AdjustTrustLevel,
-        TrainModel,
+        TrainModels if ensemble_train else TrainModel,
         RunModelDevi,
         workflow_steps_config,
         run_train_config,
         model_devi_config,
-        retry_times=retry_times)
+        retry_times=retry_times,
+        ensemble_train=ensemble_train,
+        distill_op=DistillModel if distill else None)
     
     rid_op = ReinforcedDynamics(
         "reinforced-dynamics",
@@ -138,6 +146,8 @@ def submit_rid(
     for resource_type in resources.keys():
         normalized_resources[resource_type] = normalize_resources(resources[resource_type])
 
+    jdata = load_json(rid_config)
+
     rid_op = prep_rid_op(
         prep_exploration_config = normalized_resources[tasks["prep_exploration_config"]],
         run_exploration_config = normalized_resources[tasks["run_exploration_config"]],
@@ -149,7 +159,10 @@ def submit_rid(
         run_train_config = normalized_resources[tasks["run_train_config"]],
         model_devi_config = normalized_resources[tasks["model_devi_config"]],
         workflow_steps_config = normalized_resources[tasks["workflow_steps_config"]],
-        retry_times=1
+        retry_times=1,
+        global_select=jdata["SelectorConfig"].get("global_select", False),
+        ensemble_train=jdata["Train"].get("ensemble_train", False),
+        distill="distill" in jdata["Train"]
     )
 
     if isinstance(confs, str):
@@ -164,8 +177,6 @@ def submit_rid(
     else:
         index_file_artifact = upload_artifact(Path(index_file), archive=None)
     
-    jdata = load_json(rid_config)
-    
     inputfiles = []
     if "inputfile" in jdata["ExploreMDConfig"]:
         inputfiles.append(jdata["ExploreMDConfig"]["inputfile"])
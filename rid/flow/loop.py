@@ -44,6 +44,8 @@ class ReinforcedDynamicsLoop(Steps):
             "angular_mask": InputParameter(type=Optional[Union[np.ndarray, List]]),
             "weights": InputParameter(type=Optional[Union[np.ndarray, List]]),
             "max_selection": InputParameter(type=int),
+            "cluster_config": InputParameter(type=Dict, value={}),
+            "dedup_radius": InputParameter(type=Optional[float], value=None),
             "numb_cluster_threshold": InputParameter(type=float, value=30),
             "std_threshold": InputParameter(type=float, value=5.0),
             "dt": InputParameter(type=float, value=0.02),
@@ -58,6 +60,7 @@ class ReinforcedDynamicsLoop(Steps):
         }
         self._input_artifacts={
             "models" : InputArtifact(optional=True),
+            "bias_models" : InputArtifact(optional=True),
             "forcefield" : InputArtifact(optional=True),
             "topology" : InputArtifact(optional=True),
             "inputfile": InputArtifact(optional=True),
@@ -169,6 +172,8 @@ def _loop (
             "angular_mask": steps.inputs.parameters["angular_mask"],
             "weights": steps.inputs.parameters["weights"],
             "max_selection": steps.inputs.parameters["max_selection"],
+            "cluster_config": steps.inputs.parameters["cluster_config"],
+            "dedup_radius": steps.inputs.parameters["dedup_radius"],
             "numb_cluster_threshold": steps.inputs.parameters["numb_cluster_threshold"],
             "std_threshold": steps.inputs.parameters["std_threshold"],
             "dt": steps.inputs.parameters["dt"],
@@ -180,6 +185,7 @@ def _loop (
         },
         artifacts={
             "models": steps.inputs.artifacts["models"],
+            "bias_models": steps.inputs.artifacts["bias_models"],
             "forcefield" : steps.inputs.artifacts['forcefield'],
             "topology": steps.inputs.artifacts["topology"],
             "inputfile": steps.inputs.artifacts["inputfile"],
@@ -212,6 +218,8 @@ def _loop (
             "angular_mask": steps.inputs.parameters["angular_mask"],
             "weights": steps.inputs.parameters["weights"],
             "max_selection": steps.inputs.parameters["max_selection"],
+            "cluster_config": steps.inputs.parameters["cluster_config"],
+            "dedup_radius": steps.inputs.parameters["dedup_radius"],
             "numb_cluster_threshold": steps.inputs.parameters["numb_cluster_threshold"],
             "std_threshold": steps.inputs.parameters["std_threshold"],
             "dt": steps.inputs.parameters["dt"],
@@ -234,6 +242,9 @@ def _loop (
         },
         when = "%s < %s" % (recorder_step.outputs.parameters['next_iteration'], steps.inputs.parameters["numb_iters"]),
     )
+    if "bias_models" in block_op.output_artifacts:
+        # networks distilled in the block bias the next exploration
+        next_step.set_artifacts({"bias_models": block_step.outputs.artifacts["bias_models"]})
     steps.add(next_step)    
 
     steps.outputs.artifacts['exploration_trajectory'].from_expression = \
@@ -414,6 +425,8 @@ def _rid(
             "angular_mask": prep_rid.outputs.parameters["angular_mask"],
             "weights": prep_rid.outputs.parameters["weights"],
             "max_selection": prep_rid.outputs.parameters["max_selection"],
+            "cluster_config": prep_rid.outputs.parameters["cluster_config"],
+            "dedup_radius": prep_rid.outputs.parameters["dedup_radius"],
             "std_threshold": prep_rid.outputs.parameters["std_threshold"],
             "dt": prep_rid.outputs.parameters["dt"],
             "output_freq": prep_rid.outputs.parameters["output_freq"],
@@ -461,6 +474,8 @@ def _rid(
             "angular_mask": prep_rid.outputs.parameters["angular_mask"],
             "weights": prep_rid.outputs.parameters["weights"],
             "max_selection": prep_rid.outputs.parameters["max_selection"],
+            "cluster_config": prep_rid.outputs.parameters["cluster_config"],
+            "dedup_radius": prep_rid.outputs.parameters["dedup_radius"],
             "numb_cluster_threshold": prep_rid.outputs.parameters["numb_cluster_threshold"],
             "std_threshold": prep_rid.outputs.parameters["std_threshold"],
             "dt": prep_rid.outputs.parameters["dt"],
@@ -484,6 +499,8 @@ def _rid(
         when = "%s < %s" % (recorder_step.outputs.parameters['next_iteration'], prep_rid.outputs.parameters["numb_iters"]),
         key = "rid-loop",
     )
+    if "bias_models" in init_block_op.output_artifacts:
+        loop_step.set_artifacts({"bias_models": init_block.outputs.artifacts["bias_models"]})
     steps.add(loop_step)
 
     steps.outputs.artifacts['exploration_trajectory'].from_expression = \
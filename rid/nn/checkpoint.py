@@ -0,0 +1,71 @@
+import threading
+try:
+    import tensorflow.compat.v1 as tf
+    tf.disable_v2_behavior()
+except ImportError:
+    import tensorflow as tf
+
+
+class AsyncCheckpointer(object):
+    """Write checkpoints of the training session in a background thread.
+
+    `snapshot` copies the variables out of the training session, which is cheap for networks of
+    the size used here. The copy is written by a separate graph and session in a background
+    thread, so training goes on meanwhile. If snapshots are saved faster than they are written,
+    only the latest pending one is written. Checkpoints keep the variable names of the training
+    graph, so they can be restored by a `tf.train.Saver` of it; no meta graph is written.
+    """
+    def __init__(self, sess, save_path, var_list=None):
+        self.sess = sess
+        self.save_path = save_path
+        self.var_list = var_list if var_list is not None else tf.global_variables()
+        self._specs = [(var.op.name, var.shape, var.dtype.base_dtype) for var in self.var_list]
+        self._pending = None
+        self._closed = False
+        self._error = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def snapshot(self):
+        return self.sess.run(self.var_list)
+
+    def restore(self, values):
+        """Load `values` of `snapshot` back into the training session."""
+        for var, value in zip(self.var_list, values):
+            var.load(value, self.sess)
+
+    def save(self, values):
+        with self._cond:
+            self._pending = values
+            self._cond.notify()
+
+    def close(self):
+        """Wait for the pending checkpoint to be written."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _write_loop(self):
+        try:
+            with tf.Graph().as_default():
+                variables = [tf.get_variable(name, shape, dtype, trainable=False)
+                             for name, shape, dtype in self._specs]
+                inputs = [tf.placeholder(var.dtype.base_dtype, var.shape) for var in variables]
+                assign = tf.group(*[tf.assign(var, value) for var, value in zip(variables, inputs)])
+                saver = tf.train.Saver(variables)
+                with tf.Session() as sess:
+                    while True:
+                        with self._cond:
+                            while self._pending is None and not self._closed:
+                                self._cond.wait()
+                            values, self._pending = self._pending, None
+                        if values is None:
+                            return
+                        sess.run(assign, feed_dict=dict(zip(inputs, values)))
+                        saver.save(sess, self.save_path, write_meta_graph=False)
+        except Exception as err:
+            self._error = err
@@ -0,0 +1,33 @@
+import numpy as np
+from rid.select.model_devi import load_session, test_ef_ensemble, compute_std, model_devi_chunk_size
+from rid.constants import f_cvt
+
+
+def switching(stds, trust_lvl_1, trust_lvl_2):
+    """Switching function of the bias by model deviations `stds`, see `PrepExplore`."""
+    width = max(trust_lvl_2 - trust_lvl_1, 1e-12)
+    ratio = np.clip((np.asarray(stds) - trust_lvl_1) / width, 0., 1.)
+    return 0.5 + 0.5 * np.cos(np.pi * ratio)
+
+
+def distill_data(cvs, models, trust_lvl_1=None, trust_lvl_2=None, chunk_size=None):
+    """Training data `[cvs, forces]` of a student network distilled from the ensemble `models`.
+
+    The forces are the ensemble mean forces at `cvs`, converted to the units of training data
+    (networks are trained in eV, see `Reader`). If trust levels are given, they are scaled
+    by the `switching` function of the ensemble deviation, so that a single student biasing the
+    MD (whose own deviation is zero) still vanishes where the ensemble is not trusted.
+    """
+    cvs = np.asarray(cvs)
+    if chunk_size is None:
+        chunk_size = model_devi_chunk_size
+    sess = load_session(models)
+    forces = np.empty_like(cvs)
+    for start in range(0, len(cvs), chunk_size):
+        chunk = cvs[start:start+chunk_size]
+        members = test_ef_ensemble(sess, chunk)[1]
+        mean = np.mean(members, axis=0)
+        if trust_lvl_1 is not None and trust_lvl_2 is not None:
+            mean *= switching(compute_std(members * f_cvt), trust_lvl_1, trust_lvl_2)[:, None]
+        forces[start:start+chunk_size] = mean * f_cvt
+    return np.concatenate([cvs, forces], axis=1)
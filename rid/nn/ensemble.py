@@ -0,0 +1,353 @@
+import os
+import time
+import sys
+import logging
+try:
+    import tensorflow.compat.v1 as tf
+    tf.disable_v2_behavior()
+except ImportError:
+    import tensorflow as tf
+import numpy as np
+from rid.nn.model import Model, tf_precision, load_weights, split_cvs
+from rid.nn.metrics import TrainMetrics
+
+
+class EnsembleModel(Model):
+    """Train `numb_models` networks of the `Model` architecture in one graph.
+
+    Weights of all members are stacked along a leading model axis and evaluated with batched
+    matmuls. Members have independent initializations and sample their own batches, so training
+    them together is equivalent to training them one by one. Each member is frozen to its own
+    graph with the same nodes as a graph frozen from `Model`. Members can be warm started from
+    the frozen graphs `init_models`, one per member.
+    """
+    def __init__(self, config, sess, numb_models, init_models=None):
+        super().__init__(config, sess)
+        self.numb_models = numb_models
+        if self.init_weights is not None or self.restart:
+            raise RuntimeError("ensemble training does not support restart or init model")
+        if init_models is not None:
+            assert len(init_models) == numb_models
+            self.init_weights = [load_weights(model) for model in init_models]
+        if self.useBN:
+            raise RuntimeError("ensemble training does not support batch normalization")
+        self.best_weights = [None] * numb_models
+
+    def test_error(self, inputs_train):
+        ret = self.sess.run([self.l2_loss, self.rel_error_k],
+                            feed_dict={self.inputs_train: inputs_train,
+                                       self.drop_out_rate: 0.0})
+        error = np.sqrt(ret[0])
+        error2 = np.mean(np.sqrt(ret[1]), axis=(1, 2))
+        return error, error2
+
+    def valid_error(self, reader):
+        data = reader.get_valid_data()
+        l2_sum = np.zeros(self.numb_models)
+        for start in range(0, data.shape[0], reader.valid_chunk_size):
+            chunk = data[start:start+reader.valid_chunk_size]
+            l2 = self.sess.run(self.l2_loss,
+                               feed_dict={self.inputs_train: np.broadcast_to(chunk, (self.numb_models,) + chunk.shape),
+                                          self.drop_out_rate: 0.0})
+            l2_sum += l2 * chunk.shape[0]
+        return np.sqrt(l2_sum / data.shape[0])
+
+    def test_error_mix(self, reader):
+        data_new, data_old = reader.get_data()
+        error_new, error_new2 = self.test_error(
+            np.broadcast_to(data_new, (self.numb_models,) + data_new.shape))
+        error_old, error_old2 = self.test_error(
+            np.broadcast_to(data_old, (self.numb_models,) + data_old.shape))
+        return error_new, error_new2, error_old, error_old2
+
+    def train(self, reader, log_names, metrics_names=None):
+        assert len(log_names) == self.numb_models
+        if metrics_names is None:
+            metrics_names = [None] * self.numb_models
+        metrics = [TrainMetrics(name) for name in metrics_names]
+        loggers = []
+        for log_name in log_names:
+            logger = logging.getLogger(__name__ + "." + os.path.splitext(os.path.basename(log_name))[0])
+            logger.setLevel(level=os.environ.get("LOGLEVEL", "INFO").upper())
+            handler = logging.FileHandler(log_name)
+            formatter = logging.Formatter("%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+            handler.setFormatter(fmt=formatter)
+            logger.addHandler(handler)
+            loggers.append(logger)
+
+        reader.prepare()
+        self.n_input = reader.n_input
+        # every member draws batches from its own pipeline
+        batches, inits, iterator_feed = [], [], {}
+        for _ in range(self.numb_models):
+            batch, init, feed_dict = reader.build_dataset()
+            batches.append(batch)
+            inits.append(init)
+            iterator_feed.update(feed_dict)
+        self.batch = tf.stack(batches, axis=0)
+        self.inputs_train = tf.placeholder_with_default(
+            self.batch, [self.numb_models, None, self.n_input + self.cv_dim], name='inputs')
+        self.drop_out_rate = tf.placeholder_with_default(
+            tf.constant(reader.drop_out_rate, tf.float32), [], name='drop_out_rate')
+        self.build_learning_rate(reader)
+
+        if self.init_weights is not None:
+            avg_input, scl_input = self.initial_statistic(reader, self.init_weights[0])
+        else:
+            avg_input, scl_input = self.compute_statistic(reader)
+        self.energy, self.forces, self.l2_loss, self.rel_error_k = self.build_ensemble_force(
+            self.inputs_train, shift=avg_input, scale=scl_input)
+
+        # members have disjoint weights, the sum of their losses trains them independently
+        trainable_variables = tf.trainable_variables()
+        grads = tf.gradients(tf.reduce_sum(self.l2_loss), trainable_variables)
+        optimizer = tf.train.AdamOptimizer(learning_rate=self.learning_rate)
+        self.train_op = optimizer.apply_gradients(zip(grads, trainable_variables),
+                                                  global_step=self.global_step, name='train_step')
+
+        sample_used = 0
+        epoch_used = 0
+        self.sess.run(tf.global_variables_initializer())
+        self.sess.run(inits, feed_dict=iterator_feed)
+        start_time = time.time()
+        last_time, last_sample = start_time, sample_used
+        # with validation, keep the weights of every member at its best validation error
+        self.best_error = np.full(self.numb_models, np.inf)
+        self.best_epoch = np.zeros(self.numb_models, dtype=int)
+
+        def validate(epoch_used):
+            valid_error = self.valid_error(reader)
+            improved = np.where(valid_error < self.best_error)[0]
+            if len(improved) > 0:
+                weights = self.member_weights()
+                for mm in improved:
+                    self.best_error[mm] = valid_error[mm]
+                    self.best_epoch[mm] = epoch_used
+                    self.best_weights[mm] = weights[mm]
+            for ii, logger in enumerate(loggers):
+                logger.info("epoch: %3u, valid_err: %.4e, best_valid_err: %.4e at epoch %u" % (
+                    epoch_used, valid_error[ii], self.best_error[ii], self.best_epoch[ii]))
+            return valid_error
+
+        def display(epoch_used, train_error=None, valid_error=None):
+            nonlocal last_time, last_sample
+            if reader.use_mix:
+                error, error2, error_old, error_old2 = self.test_error_mix(reader)
+            else:
+                error, error2 = train_error
+            current_lr = self.sess.run(self.lr_value)
+            now = time.time()
+            # samples of all members
+            samples_per_sec = self.numb_models * (sample_used - last_sample) / max(now - last_time, 1e-12)
+            last_time, last_sample = now, sample_used
+            for ii in range(self.numb_models):
+                record = {"epoch": epoch_used, "train_err": error[ii], "train_rel_err": error2[ii]}
+                if reader.use_mix:
+                    record.update({"train_err_old": error_old[ii], "train_rel_err_old": error_old2[ii]})
+                if valid_error is not None:
+                    record["valid_err"] = valid_error[ii]
+                record.update({"lr": current_lr, "wall_time": now - start_time, "samples_per_sec": samples_per_sec})
+                metrics[ii].write(**record)
+            if self.display_in_training:
+                for ii, logger in enumerate(loggers):
+                    if reader.use_mix:
+                        logger.info("epoch: %3u, ab_err_n: %.4e, rel_err_n: %.4e, ab_err_o: %.4e, rel_err_o: %.4e, lr: %.4e"
+                            % (epoch_used, error[ii], error2[ii], error_old[ii], error_old2[ii], current_lr))
+                    else:
+                        logger.info("epoch: %3u, ab_err: %.4e, rel_err: %.4e, lr: %.4e" %
+                            (epoch_used, error[ii], error2[ii], current_lr))
+
+        # as in Model.train, the training errors are those of batches the members train on
+        next_batch, train_error = None, None
+        if not reader.use_mix:
+            next_batch, l2, rel_error = self.sess.run([self.batch, self.l2_loss, self.rel_error_k],
+                                                      feed_dict={self.drop_out_rate: 0.0})
+            train_error = np.sqrt(l2), np.mean(np.sqrt(rel_error), axis=(1, 2))
+        display(epoch_used, train_error)
+        while epoch_used < reader.num_epoch:
+            feed_dict = {self.inputs_train: next_batch} if next_batch is not None else None
+            next_batch = None
+            next_epoch = (sample_used + reader.get_batch_size()) // reader.get_train_size()
+            if not reader.use_mix and next_epoch > epoch_used and next_epoch % self.n_displayepoch == 0:
+                _, l2, rel_error = self.sess.run([self.train_op, self.l2_loss, self.rel_error_k],
+                                                 feed_dict=feed_dict)
+                train_error = np.sqrt(l2), np.mean(np.sqrt(rel_error), axis=(1, 2))
+            else:
+                self.sess.run([self.train_op], feed_dict=feed_dict)
+            sample_used += reader.get_batch_size()
+            if (sample_used // reader.get_train_size()) > epoch_used:
+                epoch_used = sample_used // reader.get_train_size()
+                if epoch_used % self.n_displayepoch == 0:
+                    valid_error = validate(epoch_used) if reader.valid_size > 0 else None
+                    display(epoch_used, train_error, valid_error)
+                    sys.stdout.flush()
+                    # members keep training until all of them run out of patience
+                    if reader.valid_size > 0 and self.patience > 0 and \
+                            np.all(epoch_used - self.best_epoch >= self.patience):
+                        for ii, logger in enumerate(loggers):
+                            logger.info("early stopping at epoch %u, restore the best model of epoch %u" % (
+                                epoch_used, self.best_epoch[ii]))
+                        break
+        end_time = time.time()
+        for mm in metrics:
+            mm.close()
+        for logger in loggers:
+            logger.info("running time: %.3f s" % (end_time-start_time))
+
+    def build_ensemble_force(self,
+                             inputs,
+                             shift,
+                             scale):
+        nm = self.numb_models
+        cvs = inputs[:, :, :self.cv_dim]
+        forces_hat = inputs[:, :, self.cv_dim:]
+        t_shift = tf.get_variable('input_shift',
+                                  [self.cv_dim],
+                                  dtype=tf_precision,
+                                  trainable=False,
+                                  initializer=tf.constant_initializer(shift))
+        t_scale = tf.get_variable('input_scale',
+                                  [self.cv_dim],
+                                  dtype=tf_precision,
+                                  trainable=False,
+                                  initializer=tf.constant_initializer(scale))
+        xx = (cvs - t_shift) * t_scale
+        angles = tf.gather(xx, np.where(self.angular_mask_boolean)[0], axis=2)
+        dists = tf.gather(xx, np.where(self.non_angular_mask_boolean)[0], axis=2)
+        layer = tf.concat([tf.cos(angles), tf.sin(angles), dists], 2)
+        for ii in range(len(self.n_neuron)):
+            with_timestep = self.resnet and ii > 0 and self.n_neuron[ii] == self.n_neuron[ii-1]
+            hidden = self._ensemble_layer(layer, self.n_neuron[ii], name='layer_'+str(ii),
+                                          with_timestep=with_timestep)
+            if with_timestep:
+                layer += hidden
+            else:
+                layer = hidden
+        with tf.variable_scope('energy'):
+            in_size = layer.get_shape().as_list()[-1]
+            w = tf.get_variable('matrix',
+                                [nm, in_size, 1],
+                                tf_precision,
+                                self._initializer('energy/matrix', [nm, in_size, 1], stddev=1.0/np.sqrt(in_size+1)))
+        energy = tf.matmul(layer, w)
+        # members do not share weights, the gradient of the summed energy is the gradient of each member
+        # like `Model.build_force`, forces are derivatives w.r.t. the normalized CVs
+        forces = -tf.gradients(energy, xx)[0]
+        force_dif = forces_hat - forces
+        forces_norm = tf.reduce_sum(forces * forces, axis=2, keepdims=True)
+        forces_dif_norm = tf.reduce_sum(force_dif * force_dif, axis=2, keepdims=True)
+        l2_loss = tf.reduce_mean(forces_dif_norm, axis=(1, 2))
+        rel_error_k = forces_dif_norm / (1E-8 + forces_norm)
+        return energy, forces, l2_loss, rel_error_k
+
+    def _ensemble_layer(self,
+                        inputs,
+                        outputs_size,
+                        name,
+                        stddev=1.0,
+                        bavg=0.0,
+                        with_timestep=False):
+        nm = self.numb_models
+        in_size = inputs.get_shape().as_list()[-1]
+        with tf.variable_scope(name):
+            w = tf.get_variable('matrix',
+                                [nm, in_size, outputs_size],
+                                tf_precision,
+                                self._initializer(name+'/matrix', [nm, in_size, outputs_size],
+                                                  stddev=stddev/np.sqrt(in_size+outputs_size)))
+            b = tf.get_variable('bias',
+                                [nm, 1, outputs_size],
+                                tf_precision,
+                                self._initializer(name+'/bias', [nm, 1, outputs_size], stddev=stddev, mean=bavg))
+            layer_out = tf.nn.tanh(tf.matmul(inputs, w) + b)
+            if with_timestep:
+                timestep = tf.get_variable('timestep',
+                                           [nm, 1, outputs_size],
+                                           tf_precision,
+                                           self._initializer(name+'/timestep', [nm, 1, outputs_size],
+                                                             stddev=0.001, mean=0.1))
+                layer_out = layer_out * timestep
+        return tf.nn.dropout(layer_out, rate=self.drop_out_rate)
+
+    def _initializer(self, name, shape, stddev, mean=0.0):
+        if self.init_weights is None:
+            return tf.random_normal_initializer(stddev=stddev, mean=mean)
+        # like `Model._one_layer`, weights of the initial models fill the leading part of random ones
+        value = np.random.normal(loc=mean, scale=stddev, size=shape)
+        for mm, weights in enumerate(self.init_weights):
+            if name not in weights:
+                continue
+            init = weights[name]
+            if init.ndim == 1:
+                init = init[None, :]
+            value[mm][tuple(slice(0, size) for size in init.shape)] = init
+        return tf.constant_initializer(value)
+
+    def final_weights(self):
+        """Weights to freeze: the best validated weights of each member if any, else the current ones."""
+        weights = self.member_weights()
+        return [best if best is not None else current
+                for best, current in zip(self.best_weights, weights)]
+
+    def member_weights(self):
+        """Trained weights of every member, as dicts keyed by the node names of frozen graphs."""
+        variables = {var.op.name: var for var in tf.global_variables()
+                     if var.op.name.startswith(('layer_', 'energy/', 'input_'))}
+        values = self.sess.run(variables)
+        weights = []
+        for mm in range(self.numb_models):
+            member = {}
+            for name, value in values.items():
+                if name.startswith('input_'):
+                    member[name] = value
+                elif name.endswith('/matrix'):
+                    member[name] = value[mm]
+                else:
+                    member[name] = value[mm, 0]
+            weights.append(member)
+        return weights
+
+
+def member_graph_def(weights, angular_mask):
+    """Graph def of one network with frozen `weights`, laid out like `Model.build_force`."""
+    angular_mask = np.array(angular_mask)
+    cv_dim = len(angular_mask)
+    with tf.Graph().as_default() as graph:
+        inputs = tf.placeholder(tf_precision, [None, 2 * cv_dim], name='inputs')
+        drop_out_rate = tf.placeholder(tf.float32, name='drop_out_rate')
+        cvs = tf.slice(inputs, [0, 0], [-1, cv_dim], name='cvs')
+        t_shift = tf.constant(weights['input_shift'], tf_precision, name='input_shift')
+        t_scale = tf.constant(weights['input_scale'], tf_precision, name='input_scale')
+        cvs = (cvs - t_shift) * t_scale
+        angles, dists = split_cvs(cvs, angular_mask)
+        layer = tf.concat([tf.cos(angles), tf.sin(angles), dists], 1)
+        ii = 0
+        while 'layer_%d/matrix' % ii in weights:
+            with tf.variable_scope('layer_%d' % ii):
+                w = tf.constant(weights['layer_%d/matrix' % ii], tf_precision, name='matrix')
+                b = tf.constant(weights['layer_%d/bias' % ii], tf_precision, name='bias')
+                hidden = tf.nn.tanh(tf.matmul(layer, w) + b)
+                if 'layer_%d/timestep' % ii in weights:
+                    timestep = tf.constant(weights['layer_%d/timestep' % ii], tf_precision, name='timestep')
+                    hidden = hidden * timestep
+            hidden = tf.nn.dropout(hidden, rate=drop_out_rate)
+            if 'layer_%d/timestep' % ii in weights:
+                layer += hidden
+            else:
+                layer = hidden
+            ii += 1
+        with tf.variable_scope('energy'):
+            w = tf.constant(weights['energy/matrix'], tf_precision, name='matrix')
+        energy = tf.identity(tf.matmul(layer, w), name='o_energy')
+        energy_grad = tf.reshape(tf.stack(tf.gradients(energy, cvs)),
+                                 [-1, cv_dim], name='energy_grad')
+        tf.identity(-energy_grad, name='o_forces')
+    return tf.graph_util.extract_sub_graph(graph.as_graph_def(), ['o_energy', 'o_forces'])
+
+
+def freeze_members(model, angular_mask, outputs):
+    """Write each member of the trained `EnsembleModel` to its frozen graph in `outputs`."""
+    for weights, output in zip(model.final_weights(), outputs):
+        graph_def = member_graph_def(weights, angular_mask)
+        with tf.gfile.GFile(str(output), "wb") as f:
+            f.write(graph_def.SerializeToString())
@@ -1,14 +1,17 @@
 import os
 import argparse
 import sys
+import time
 import logging
+import numpy as np
 try:
     import tensorflow.compat.v1 as tf
     tf.disable_v2_behavior()
 except ImportError:
     import tensorflow as tf
-from tensorflow.python.framework import graph_util
+graph_util = tf.graph_util
 from tensorflow.python.framework import ops
+from rid.nn.numpy_model import NumpyModel
 
 
 logging.basicConfig(
@@ -50,19 +53,182 @@ def freeze_model(model_folder,
     # We start a session and restore the graph weights
     with tf.Session() as sess:
         saver.restore(sess, input_checkpoint)
+        _write_frozen(sess, input_graph_def, output_graph, output_node_names)
 
-        # We use a built-in TF helper to export variables to constants
-        output_graph_def = graph_util.convert_variables_to_constants(
-            sess,  # The session is used to retrieve the weights
-            input_graph_def,  # The graph_def is used to retrieve the nodes
-            # The output node names are used to select the usefull nodes
-            output_node_names.split(",")
-        )
 
-        # Finally we serialize and dump the output graph to the filesystem
-        with tf.gfile.GFile(output_graph, "wb") as f:
-            f.write(output_graph_def.SerializeToString())
-        logger.debug("%d ops in the final graph." % len(output_graph_def.node))
+def freeze_graph(sess,
+                 output,
+                 output_node_names="o_energy,o_forces"):
+    """Freeze the graph of the training session `sess` with its current weights to `output`,
+    without writing and re-importing a checkpoint."""
+    _write_frozen(sess, sess.graph.as_graph_def(), str(output), output_node_names)
+
+
+def _write_frozen(sess,
+                  input_graph_def,
+                  output_graph,
+                  output_node_names):
+    # We use a built-in TF helper to export variables to constants
+    output_graph_def = graph_util.convert_variables_to_constants(
+        sess,  # The session is used to retrieve the weights
+        input_graph_def,  # The graph_def is used to retrieve the nodes
+        # The output node names are used to select the usefull nodes
+        output_node_names.split(",")
+    )
+    # inputs of the trainer default to its data pipeline, turn them into plain placeholders
+    # and drop the pipeline
+    for node in output_graph_def.node:
+        if node.op == "PlaceholderWithDefault":
+            node.op = "Placeholder"
+            del node.input[:]
+    output_graph_def = graph_util.extract_sub_graph(
+        output_graph_def, output_node_names.split(","))
+
+    # Finally we serialize and dump the output graph to the filesystem
+    with tf.gfile.GFile(output_graph, "wb") as f:
+        f.write(output_graph_def.SerializeToString())
+    logger.debug("%d ops in the final graph." % len(output_graph_def.node))
+
+
+def optimize_graph_def(graph_def):
+    """Inference graph of the frozen network `graph_def` for biased MD.
+
+    The network is rebuilt from its weights, see `NumpyModel`, keeping the `inputs` and
+    `drop_out_rate` placeholders and the `o_energy` and `o_forces` outputs of frozen graphs:
+
+    - dropout is removed, `drop_out_rate` is kept unused so callers feeding it still work;
+    - the force columns of `inputs` and the loss nodes are dropped;
+    - the input normalization is folded into the bias and the distance rows of `layer_0`
+      (named `layer_0/matrix_folded` and `layer_0/bias_folded`), angles are normalized
+      explicitly only if their shift and scale are not trivial;
+    - forces come from an explicit backward pass instead of `tf.gradients`.
+
+    The weight constants (`layer_*/matrix`, `input_shift`, ...) are kept under their names, so
+    the graph can still warm start training or be read by `NumpyModel`.
+    """
+    placeholder = [node for node in graph_def.node if node.name == 'inputs'][0]
+    tf_precision = tf.as_dtype(placeholder.attr["dtype"].type)
+    model = NumpyModel.from_graph_def(graph_def, dtype=tf_precision.as_numpy_dtype)
+    mask = model.angular_mask
+    cv_dim, angular_dim = model.cv_dim, int(np.sum(mask))
+    dist_dim = cv_dim - angular_dim
+    angular_index, non_angular_index = np.where(mask)[0], np.where(~mask)[0]
+    shift, scale = model.input_shift, model.input_scale
+    angle_shift, angle_scale = shift[angular_index], scale[angular_index]
+    matrix_0, bias_0 = model.folded_layer_0()
+
+    with tf.Graph().as_default() as graph:
+        inputs = tf.placeholder(tf_precision, [None, 2 * cv_dim], name='inputs')
+        tf.placeholder(tf.float32, [], name='drop_out_rate')
+        keep = ['inputs', 'drop_out_rate', 'o_energy', 'o_forces']
+        for name, value in [('input_shift', shift), ('input_scale', scale),
+                            ('angular_index', angular_index.astype(np.int32)),
+                            ('non_angular_index', non_angular_index.astype(np.int32))]:
+            keep.append(tf.constant(value, name=name).op.name)
+        cvs = tf.slice(inputs, [0, 0], [-1, cv_dim], name='cvs')
+        if dist_dim == 0:
+            angles = cvs
+        else:
+            angles = tf.gather(cvs, angular_index, axis=1, name='angles')
+            dists = tf.gather(cvs, non_angular_index, axis=1, name='dists')
+        if np.any(angle_shift != 0) or np.any(angle_scale != 1):
+            angles = (angles - tf.constant(angle_shift)) * tf.constant(angle_scale)
+        cos_angles, sin_angles = tf.cos(angles), tf.sin(angles)
+        features = ([cos_angles, sin_angles] if angular_dim > 0 else []) + ([dists] if dist_dim > 0 else [])
+        layer = features[0] if len(features) == 1 else tf.concat(features, 1)
+        # forward pass, keep tanh outputs for the backward pass
+        weights, acts = [], []
+        for ii in range(len(model.matrices)):
+            with tf.variable_scope('layer_%d' % ii):
+                matrix = tf.constant(model.matrices[ii], name='matrix')
+                bias = tf.constant(model.biases[ii], name='bias')
+                keep += [matrix.op.name, bias.op.name]
+                if ii == 0:
+                    act = tf.tanh(tf.matmul(layer, tf.constant(matrix_0, name='matrix_folded'))
+                                  + tf.constant(bias_0, name='bias_folded'))
+                else:
+                    act = tf.tanh(tf.matmul(layer, matrix) + bias)
+                timestep = None
+                if model.timesteps[ii] is not None:
+                    timestep = tf.constant(model.timesteps[ii], name='timestep')
+                    keep.append(timestep.op.name)
+                    layer = layer + act * timestep
+                else:
+                    layer = act
+            weights.append((matrix, timestep))
+            acts.append(act)
+        with tf.variable_scope('energy'):
+            energy_matrix = tf.constant(model.energy_matrix, name='matrix')
+        tf.identity(tf.matmul(layer, energy_matrix), name='o_energy')
+        # backward pass w.r.t. the normalized CVs, through the unfolded weights
+        grad = tf.constant(model.energy_matrix[:, 0][None, :])
+        for (matrix, timestep), act in zip(weights[::-1], acts[::-1]):
+            if timestep is None:
+                grad = tf.matmul(grad * (1. - act * act), matrix, transpose_b=True)
+            else:
+                grad = grad + tf.matmul(grad * timestep * (1. - act * act), matrix, transpose_b=True)
+        grads = tf.split(grad, [size for size in [angular_dim, angular_dim, dist_dim] if size > 0], axis=1)
+        if angular_dim > 0:
+            grad_angles = cos_angles * grads[1] - sin_angles * grads[0]
+            grads = [grad_angles] + grads[2:]
+        if len(grads) == 1:
+            grad_x = grads[0]
+        else:
+            # back to the order of the CVs
+            order = np.argsort(np.concatenate([angular_index, non_angular_index])).astype(np.int32)
+            grad_x = tf.gather(tf.concat(grads, 1), order, axis=1)
+        tf.negative(grad_x, name='o_forces')
+    return graph_util.extract_sub_graph(graph.as_graph_def(), keep)
+
+
+def _graph_latency(graph_def, cv_dim, repeat):
+    """Seconds per evaluation of `o_energy` and `o_forces` on one frame."""
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        feed_dict = {graph.get_tensor_by_name('inputs:0'): np.random.uniform(-np.pi, np.pi, [1, 2 * cv_dim]),
+                     graph.get_tensor_by_name('drop_out_rate:0'): 0.}
+        outputs = [graph.get_tensor_by_name('o_energy:0'), graph.get_tensor_by_name('o_forces:0')]
+        tf_config = tf.ConfigProto(intra_op_parallelism_threads=1, inter_op_parallelism_threads=1)
+        with tf.Session(graph=graph, config=tf_config) as sess:
+            for _ in range(10):
+                sess.run(outputs, feed_dict=feed_dict)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                sess.run(outputs, feed_dict=feed_dict)
+            return (time.perf_counter() - start) / repeat
+
+
+def optimize_model(frozen_graph_filename,
+                   output=None,
+                   repeat=200):
+    """Write the inference graph of `frozen_graph_filename`, see `optimize_graph_def`, to `output`
+    (in place by default) and report op counts and single-frame latencies before and after.
+
+    Graphs that can not be rebuilt (batch normalization) are left as they are.
+    """
+    if output is None:
+        output = frozen_graph_filename
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(str(frozen_graph_filename), "rb") as f:
+        graph_def.ParseFromString(f.read())
+    try:
+        output_graph_def = optimize_graph_def(graph_def)
+    except NotImplementedError as err:
+        logger.warning(f"{frozen_graph_filename} is not optimized: {err}")
+        output_graph_def = graph_def
+    report = {"ops_before": len(graph_def.node), "ops_after": len(output_graph_def.node)}
+    if repeat > 0:
+        cv_dim = [node for node in graph_def.node if node.name == 'inputs'][0] \
+            .attr["shape"].shape.dim[1].size // 2
+        report["latency_before"] = _graph_latency(graph_def, cv_dim, repeat)
+        report["latency_after"] = _graph_latency(output_graph_def, cv_dim, repeat)
+    with tf.gfile.GFile(str(output), "wb") as f:
+        f.write(output_graph_def.SerializeToString())
+    message = "optimized %s: %d -> %d ops" % (frozen_graph_filename, report["ops_before"], report["ops_after"])
+    if repeat > 0:
+        message += ", %.1f -> %.1f us per frame" % (report["latency_before"] * 1e6, report["latency_after"] * 1e6)
+    logger.info(message)
+    return report
 
 
 if __name__ == '__main__':
@@ -76,6 +242,11 @@ if __name__ == '__main__':
                         help="name of graph, will output to the checkpoint folder")
     parser.add_argument("-n", "--nodes", type=str, default=default_frozen_nodes,
                         help="the frozen nodes, defaults is " + default_frozen_nodes)
+    parser.add_argument("--optimize", action='store_true',
+                        help="optimize the frozen graph for inference, see `optimize_graph_def`")
     args = parser.parse_args()
 
     freeze_model(args.folder, args.output, args.nodes)
+    if args.optimize:
+        checkpoint = tf.train.get_checkpoint_state(args.folder)
+        optimize_model(os.path.join(os.path.dirname(checkpoint.model_checkpoint_path), args.output))
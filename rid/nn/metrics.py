@@ -0,0 +1,36 @@
+import json
+import numpy as np
+
+
+class TrainMetrics(object):
+    """JSON lines stream of training metrics, one record per display epoch.
+
+    Records are flushed as they are written, so the stream can be followed while training.
+    Nothing is written if `filename` is None.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(str(filename), "w") if filename is not None else None
+
+    def write(self, **record):
+        if self._file is None:
+            return
+        record = {key: int(value) if isinstance(value, (int, np.integer)) else float(value)
+                  for key, value in record.items()}
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def load_metrics(filename):
+    """Columns of a metrics stream as arrays keyed by field, NaN where a record misses the field."""
+    with open(str(filename), "r") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    keys = []
+    for record in records:
+        keys += [key for key in record if key not in keys]
+    return {key: np.array([record.get(key, np.nan) for record in records], dtype=float) for key in keys}
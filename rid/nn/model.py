@@ -11,14 +11,40 @@ import numpy as np
 from tensorflow.python.ops import control_flow_ops
 from tensorflow.python.training import moving_averages
 from rid.constants import kbT, beta, N_grid, inverse_f_cvt
+from rid.nn.metrics import TrainMetrics
+from rid.nn.checkpoint import AsyncCheckpointer
 
 tf_precision = tf.float32
 
 
+def load_weights(frozen_graph_filename):
+    """Constant tensors of a frozen graph keyed by node name, read in one pass without a session."""
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(str(frozen_graph_filename), "rb") as f:
+        graph_def.ParseFromString(f.read())
+    return {node.name: tf.make_ndarray(node.attr["value"].tensor)
+            for node in graph_def.node if node.op == "Const"}
+
+
+def split_cvs(cvs, angular_mask):
+    """Angular and non-angular columns of `cvs`, gathered with indices fixed by `angular_mask`.
+
+    The indices are constants named `angular_index` and `non_angular_index` of the graph.
+    """
+    angular_mask = np.asarray(angular_mask)
+    angular_index = tf.constant(np.where(angular_mask == 1)[0], tf.int32, name='angular_index')
+    non_angular_index = tf.constant(np.where(angular_mask == 0)[0], tf.int32, name='non_angular_index')
+    angles = tf.gather(cvs, angular_index, axis=1, name='angles')
+    dists = tf.gather(cvs, non_angular_index, axis=1, name='dists')
+    return angles, dists
+
+
 class Reader(object):
     def __init__(self, config):
         # copy from config
         self.data_path = config.data_path
+        self.data_new_path = config.data_new_path if config.data_new_path is not None else config.data_path
+        self.data_old_path = config.data_old_path if config.data_old_path is not None else config.data_path
         self.num_epoch = config.num_epoch
         self.use_mix = config.use_mix
         self.old_ratio = config.old_ratio
@@ -30,6 +56,18 @@ class Reader(object):
         self.cv_dim = config.cv_dim
         self.drop_out_rate = config.drop_out_rate
         self.angular_mask = config.angular_mask
+        self.valid_ratio = config.valid_ratio
+        self.valid_chunk_size = config.valid_chunk_size
+
+    def _split_valid(self, data):
+        # hold out `valid_ratio` of data for validation, keep at least one frame for training
+        numb_valid = min(int(data.shape[0] * self.valid_ratio), data.shape[0] - 1)
+        if numb_valid <= 0:
+            self.inputs_valid = data[:0]
+            return data
+        ind = np.random.permutation(data.shape[0])
+        self.inputs_valid = data[ind[:numb_valid]]
+        return data[ind[numb_valid:]]
 
     def prepare(self):
         self.n_input = self.cv_dim
@@ -37,11 +75,11 @@ class Reader(object):
         self.index_count_new = 0
         self.index_count_old = 0
         if self.use_mix:
-            tr_data_new = np.load(self.data_path)
+            tr_data_new = np.load(self.data_new_path)
             tr_data_new = np.reshape(tr_data_new, [-1, self.cv_dim * 2])
             tr_data_new[:, self.cv_dim:] *= inverse_f_cvt
-            self.inputs_train_new = tr_data_new[:, :]
-            tr_data_old = np.load(self.data_path)
+            self.inputs_train_new = self._split_valid(tr_data_new)
+            tr_data_old = np.load(self.data_old_path)
             tr_data_old = np.reshape(tr_data_old, [-1, self.cv_dim * 2])
             tr_data_old[:, self.cv_dim:] *= inverse_f_cvt
             self.inputs_train_old = tr_data_old[:, :]
@@ -57,8 +95,11 @@ class Reader(object):
         else:
             tr_data_all = np.load(self.data_path)
             tr_data_all[:, self.cv_dim:] *= inverse_f_cvt
-            self.inputs_train_all = tr_data_all[:, :]
+            self.inputs_train_all = self._split_valid(tr_data_all)
             self.train_size_all = self.inputs_train_all.shape[0]
+            if self.batch_size > self.train_size_all:
+                self.batch_size = self.train_size_all
+        self.valid_size = self.inputs_valid.shape[0]
         # print(np.shape(self.inputs_train))
 
     def _sample_train_all(self):
@@ -114,12 +155,41 @@ class Reader(object):
     def get_batch_size(self):
         return self.batch_size
 
+    def get_valid_data(self):
+        return self.inputs_valid
+
     def get_data(self):
         if self.use_mix:
             return self.inputs_train_new, self.inputs_train_old
         else:
             return self.inputs_train_all
 
+    def build_dataset(self, prefetch=4):
+        """Build the in-graph sampling pipeline equivalent to `sample_train`.
+
+        The data are reshuffled at every epoch and cut into batches, the incomplete last batch of an
+        epoch is dropped. With `use_mix` new and old data are batched separately and concatenated.
+        Returns the batch tensor, the iterator initializer and the feed dict to run it with.
+        """
+        def _batches(data, batch_size, name):
+            data_in = tf.placeholder(tf_precision, data.shape, name=name)
+            dataset = tf.data.Dataset.from_tensor_slices(data_in)
+            dataset = dataset.shuffle(data.shape[0], reshuffle_each_iteration=True)
+            dataset = dataset.batch(batch_size, drop_remainder=True).repeat().prefetch(prefetch)
+            iterator = tf.data.make_initializable_iterator(dataset)
+            return iterator.get_next(), iterator.initializer, {data_in: data}
+
+        if self.use_mix:
+            batch, init, feed_dict = _batches(self.inputs_train_new, self.batch_size_new, 'data_new')
+            if self.batch_size_old > 0:
+                batch_old, init_old, feed_dict_old = _batches(self.inputs_train_old, self.batch_size_old, 'data_old')
+                batch = tf.concat([batch, batch_old], axis=0)
+                init = tf.group(init, init_old)
+                feed_dict.update(feed_dict_old)
+        else:
+            batch, init, feed_dict = _batches(self.inputs_train_all, self.batch_size, 'data_all')
+        return batch, init, feed_dict
+
 
 class Model(object):
     def __init__(self, config, sess):
@@ -137,6 +207,8 @@ class Model(object):
         self.display_in_training = config.display_in_training
         self.restart = config.restart
         self.resnet = config.resnet
+        self.patience = config.patience
+        self.metrics_name = config.metrics_name
         self.graph_file = config.graph_file
         self.cv_dim = int(config.cv_dim)
         self.angular_mask = np.array(config.angular_mask)
@@ -145,9 +217,9 @@ class Model(object):
         self.angular_mask_boolean = (self.angular_mask == 1)
         self.non_angular_mask_boolean = (self.angular_mask == 0)
         if self.graph_file is not None:
-            self.graph = self.load_graph(self.graph_file, 'load')
+            self.init_weights = load_weights(self.graph_file)
         else:
-            self.graph = None
+            self.init_weights = None
 
     def test_error(self, inputs_train):
         ret = self.sess.run([self.l2_loss, self.rel_error_k],
@@ -158,6 +230,19 @@ class Model(object):
         error2 = np.mean(np.sqrt(ret[1]))
         return error, error2
 
+    def valid_error(self, reader):
+        # evaluate the validation set chunk by chunk to bound memory
+        data = reader.get_valid_data()
+        l2_sum = 0.
+        for start in range(0, data.shape[0], reader.valid_chunk_size):
+            chunk = data[start:start+reader.valid_chunk_size]
+            l2 = self.sess.run(self.l2_loss,
+                               feed_dict={self.inputs_train: chunk,
+                                          self.is_training: False,
+                                          self.drop_out_rate: 0.0})
+            l2_sum += l2 * chunk.shape[0]
+        return np.sqrt(l2_sum / data.shape[0])
+
     def test_error_mix(self, reader):
         data_new, data_old = reader.get_data()
         ret = self.sess.run([self.l2_loss, self.rel_error_k],
@@ -184,41 +269,19 @@ class Model(object):
         
         reader.prepare()
         self.n_input = reader.n_input
-        self.inputs_train = tf.placeholder(
-            tf_precision, [None, self.n_input + self.cv_dim], name='inputs')
-        self.is_training = tf.placeholder(tf.bool)
-        self.drop_out_rate = tf.placeholder(tf.float32, name='drop_out_rate')  ### drop out ###
+        # training batches come from the in-graph pipeline, feed `inputs` to evaluate other data
+        self.batch, iterator_init, iterator_feed = reader.build_dataset()
+        self.inputs_train = tf.placeholder_with_default(
+            self.batch, [None, self.n_input + self.cv_dim], name='inputs')
+        self.is_training = tf.placeholder_with_default(True, [])
+        self.drop_out_rate = tf.placeholder_with_default(
+            tf.constant(reader.drop_out_rate, tf.float32), [], name='drop_out_rate')  ### drop out ###
         self._extra_train_ops = []
-        self.global_step = tf.get_variable('global_step', [],
-                                           initializer=tf.constant_initializer(
-                                               1),
-                                           trainable=False, dtype=tf.int32)
-        self.global_epoch = self.global_step * \
-            reader.get_batch_size() // reader.get_train_size()
-        if self.decay_steps_inner == 0:
-            self.learning_rate = tf.train.exponential_decay(self.starter_learning_rate,
-                                                            self.global_epoch,
-                                                            self.decay_steps,
-                                                            self.decay_rate,
-                                                            staircase=True)
-        else:
-            self.global_epoch_inner = self.global_epoch % self.decay_steps
-            self.lr_pref = tf.train.exponential_decay(1.0,
-                                                      self.global_epoch,
-                                                      self.decay_steps,
-                                                      self.decay_rate,
-                                                      staircase=False)
-            self.learning_rate = tf.train.exponential_decay(self.starter_learning_rate,
-                                                            self.global_epoch_inner,
-                                                            self.decay_steps_inner,
-                                                            self.decay_rate,
-                                                            staircase=True)
-            self.learning_rate *= self.lr_pref
-        self.mv_decay = 1.0 - self.learning_rate/self.starter_learning_rate
+        self.build_learning_rate(reader)
 
-        avg_input, scl_input = self.compute_statistic(reader)
+        avg_input, scl_input = self.initial_statistic(reader)
         self.energy, self.l2_loss, self.rel_error_k\
-            = self.build_force(self.inputs_train, suffix="test", reuse=False, shift=avg_input, scale=scl_input, graph=self.graph)
+            = self.build_force(self.inputs_train, suffix="test", reuse=False, shift=avg_input, scale=scl_input, init_weights=self.init_weights)
 
         # train operations
         trainable_variables = tf.trainable_variables()
@@ -237,7 +300,7 @@ class Model(object):
             epoch_used = 0
             self.sess.run(tf.global_variables_initializer())
             print('# start training from scratch')
-        elif self.graph is None:
+        elif self.init_weights is None:
             self.sess.run(tf.global_variables_initializer())
             saver.restore(self.sess, "old_model/model.ckpt")
             print("Model restored.")
@@ -247,54 +310,125 @@ class Model(object):
             sample_used = cur_step * reader.get_batch_size()
             epoch_used = sample_used // reader.get_train_size()
 
+        self.sess.run(iterator_init, feed_dict=iterator_feed)
+        checkpointer = AsyncCheckpointer(self.sess, os.getcwd() + "/" + "model.ckpt")
+        best_values = None
+        metrics = TrainMetrics(self.metrics_name)
         start_time = time.time()
+        last_time, last_sample = start_time, sample_used
 
-        inputs_train = reader.sample_train()
-        if reader.use_mix:
-            error, error2, error_old, error_old2 = self.test_error_mix(reader)
-        else:
-            error, error2 = self.test_error(inputs_train)
-        current_lr = self.sess.run(tf.to_double(self.learning_rate))
-        if self.display_in_training:
+        def display(epoch_used, train_error=None, valid_error=None):
+            nonlocal last_time, last_sample
             if reader.use_mix:
-                logger.info("epoch: %3u, ab_err_n: %.4e, rel_err_n: %.4e, ab_err_o: %.4e, rel_err_o: %.4e, lr: %.4e"
-                      % (epoch_used, error, error2, error_old, error_old2, current_lr))
+                error, error2, error_old, error_old2 = self.test_error_mix(reader)
             else:
-                logger.info("epoch: %3u, ab_err: %.4e, rel_err: %.4e, lr: %.4e" %
-                      (epoch_used, error, error2, current_lr))
-
+                error, error2 = train_error
+            current_lr = self.sess.run(self.lr_value)
+            now = time.time()
+            record = {"epoch": epoch_used, "train_err": error, "train_rel_err": error2}
+            if reader.use_mix:
+                record.update({"train_err_old": error_old, "train_rel_err_old": error_old2})
+            if valid_error is not None:
+                record["valid_err"] = valid_error
+            record.update({"lr": current_lr, "wall_time": now - start_time,
+                           "samples_per_sec": (sample_used - last_sample) / max(now - last_time, 1e-12)})
+            metrics.write(**record)
+            last_time, last_sample = now, sample_used
+            if self.display_in_training:
+                if reader.use_mix:
+                    logger.info("epoch: %3u, ab_err_n: %.4e, rel_err_n: %.4e, ab_err_o: %.4e, rel_err_o: %.4e, lr: %.4e"
+                          % (epoch_used, error, error2, error_old, error_old2, current_lr))
+                else:
+                    logger.info("epoch: %3u, ab_err: %.4e, rel_err: %.4e, lr: %.4e" %
+                          (epoch_used, error, error2, current_lr))
+                if valid_error is not None:
+                    logger.info("epoch: %3u, valid_err: %.4e, best_valid_err: %.4e at epoch %u" % (
+                        epoch_used, valid_error, best_error, best_epoch))
+                sys.stdout.flush()
+
+        best_error = np.inf
+        best_epoch = epoch_used
+        # the training error is that of a batch taken from the pipeline for training, drawing extra
+        # batches for display would skip them. The first display evaluates the first batch, which
+        # the first step then trains on.
+        next_batch, train_error = None, None
+        if not reader.use_mix:
+            next_batch, l2, rel_error = self.sess.run([self.batch, self.l2_loss, self.rel_error_k],
+                                                      feed_dict={self.is_training: False,
+                                                                 self.drop_out_rate: 0.0})
+            train_error = np.sqrt(l2), np.mean(np.sqrt(rel_error))
+        display(epoch_used, train_error)
         while epoch_used < reader.num_epoch:
             # print('# doing training')
-            inputs_train = reader.sample_train()
-            self.sess.run([self.train_op],
-                          feed_dict={self.inputs_train: inputs_train,
-                                     self.is_training: True,
-                                     self.drop_out_rate: reader.drop_out_rate})
+            feed_dict = {self.inputs_train: next_batch} if next_batch is not None else None
+            next_batch = None
+            next_epoch = (sample_used + reader.get_batch_size()) // reader.get_train_size()
+            if not reader.use_mix and next_epoch > epoch_used and next_epoch % self.n_displayepoch == 0:
+                _, l2, rel_error = self.sess.run([self.train_op, self.l2_loss, self.rel_error_k],
+                                                 feed_dict=feed_dict)
+                train_error = np.sqrt(l2), np.mean(np.sqrt(rel_error))
+            else:
+                self.sess.run([self.train_op], feed_dict=feed_dict)
             sample_used += reader.get_batch_size()
             # print(sample_used)
             if (sample_used // reader.get_train_size()) > epoch_used:
                 epoch_used = sample_used // reader.get_train_size()
                 if epoch_used % self.n_displayepoch == 0:
-                    save_path = saver.save(
-                        self.sess, os.getcwd() + "/" + "model.ckpt")
-                    if reader.use_mix:
-                        error, error2, error_old, error_old2 = self.test_error_mix(
-                            reader)
+                    valid_error = None
+                    if reader.valid_size > 0:
+                        # only keep the model with the best validation error, which is frozen at the end
+                        valid_error = self.valid_error(reader)
+                        if valid_error < best_error:
+                            best_error = valid_error
+                            best_epoch = epoch_used
+                            best_values = checkpointer.snapshot()
+                            checkpointer.save(best_values)
                     else:
-                        error, error2 = self.test_error(inputs_train)
-                    current_lr = self.sess.run(
-                        tf.to_double(self.learning_rate))
-                    if self.display_in_training:
-                        if reader.use_mix:
-                            logger.info("epoch: %3u, ab_err_n: %.4e, rel_err_n: %.4e, ab_err_o: %.4e, rel_err_o: %.4e, lr: %.4e"
-                                  % (epoch_used, error, error2, error_old, error_old2, current_lr))
-                        else:
-                            logger.info("epoch: %3u, ab_err: %.4e, rel_err: %.4e, lr: %.4e" % (
-                                epoch_used, error, error2, current_lr))
-                        sys.stdout.flush()
+                        checkpointer.save(checkpointer.snapshot())
+                    display(epoch_used, train_error, valid_error)
+                    if valid_error is not None and self.patience > 0 and epoch_used - best_epoch >= self.patience:
+                        logger.info("early stopping at epoch %u, restore the best model of epoch %u" % (
+                            epoch_used, best_epoch))
+                        break
+        if best_values is not None:
+            checkpointer.restore(best_values)
+        else:
+            # without validation keep the final model, also if training ended before the first display epoch
+            checkpointer.save(checkpointer.snapshot())
+        checkpointer.close()
         end_time = time.time()
+        metrics.close()
         logger.info("running time: %.3f s" % (end_time-start_time))
 
+    def build_learning_rate(self, reader):
+        self.global_step = tf.get_variable('global_step', [],
+                                           initializer=tf.constant_initializer(
+                                               1),
+                                           trainable=False, dtype=tf.int32)
+        self.global_epoch = self.global_step * \
+            reader.get_batch_size() // reader.get_train_size()
+        if self.decay_steps_inner == 0:
+            self.learning_rate = tf.train.exponential_decay(self.starter_learning_rate,
+                                                            self.global_epoch,
+                                                            self.decay_steps,
+                                                            self.decay_rate,
+                                                            staircase=True)
+        else:
+            self.global_epoch_inner = self.global_epoch % self.decay_steps
+            self.lr_pref = tf.train.exponential_decay(1.0,
+                                                      self.global_epoch,
+                                                      self.decay_steps,
+                                                      self.decay_rate,
+                                                      staircase=False)
+            self.learning_rate = tf.train.exponential_decay(self.starter_learning_rate,
+                                                            self.global_epoch_inner,
+                                                            self.decay_steps_inner,
+                                                            self.decay_rate,
+                                                            staircase=True)
+            self.learning_rate *= self.lr_pref
+        self.mv_decay = 1.0 - self.learning_rate/self.starter_learning_rate
+        self.lr_value = tf.to_double(self.learning_rate)
+
     def compute_statistic(self,
                           reader):
         max_scale = 3.
@@ -318,13 +452,23 @@ class Model(object):
         #         ds[ii] = max_scale
         return da, ds
 
+    def initial_statistic(self,
+                          reader,
+                          init_weights=None):
+        # a warm-started model keeps the input normalization it was trained with
+        if init_weights is None:
+            init_weights = self.init_weights
+        if init_weights is not None and 'input_shift' in init_weights:
+            return init_weights['input_shift'], init_weights['input_scale']
+        return self.compute_statistic(reader)
+
     def build_force(self,
                     inputs,
                     suffix,
                     shift=None,
                     scale=None,
                     reuse=None,
-                    graph=None):
+                    init_weights=None):
         cvs = tf.slice(inputs, [0, 0], [-1, self.cv_dim], name='cvs')
         if shift is not None:
             assert(scale is not None)
@@ -342,40 +486,25 @@ class Model(object):
             # t_scale = tf.constant(scale, name='input_scale')
             cvs = (cvs - t_shift) * t_scale
         # angles = tf.slice(cvs, [0, 0], [-1, self.cv_dih_dim], name='angles')
-        angles = tf.boolean_mask(
-                cvs, self.angular_mask_boolean, axis=1, name='angles'
-                )
-        angles = tf.reshape(angles, [-1, self.angular_dim])
-        dists = tf.boolean_mask(
-                cvs, self.non_angular_mask_boolean, axis=1, name='dists'
-                )
-        dists = tf.reshape(dists, [-1, self.non_angular_dim])
+        angles, dists = split_cvs(cvs, self.angular_mask)
         # dists = tf.slice(cvs, [0, self.cv_dih_dim],
         #                  [-1, self.cv_dist_dim], name='dists')
         forces_hat = tf.slice(
             inputs, [0, self.cv_dim], [-1, self.cv_dim], name='forces')
         inputs = tf.concat([tf.cos(angles), tf.sin(angles), dists], 1)
-        if graph is not None:
-            init_t = [graph.get_tensor_by_name('load/layer_0/matrix:0'),
-                      graph.get_tensor_by_name('load/layer_0/bias:0')
-                      ]
-            with tf.Session(graph=self.graph) as g_sess:
-                init = g_sess.run(init_t)
+        if init_weights is not None:
+            init = [init_weights['layer_0/matrix'],
+                    init_weights['layer_0/bias']]
         else:
             init = None
         layer = self._one_layer(
             inputs, self.n_neuron[0], drop_out_rate=self.drop_out_rate, name='layer_0', reuse=reuse, init=init)
         for ii in range(1, len(self.n_neuron)):
-            if graph is not None:
-                init_t = [graph.get_tensor_by_name('load/layer_%s/matrix:0' % str(ii)),
-                          graph.get_tensor_by_name(
-                              'load/layer_%s/bias:0' % str(ii))
-                          ]
+            if init_weights is not None:
+                init = [init_weights['layer_%s/matrix' % str(ii)],
+                        init_weights['layer_%s/bias' % str(ii)]]
                 if self.resnet and self.n_neuron[ii] == self.n_neuron[ii-1]:
-                    init_t += [graph.get_tensor_by_name(
-                        'load/layer_%s/timestep:0' % str(ii))]
-                with tf.Session(graph=self.graph) as g_sess:
-                    init = g_sess.run(init_t)
+                    init += [init_weights['layer_%s/timestep' % str(ii)]]
             else:
                 init = None
             if self.resnet and self.n_neuron[ii] == self.n_neuron[ii-1]:
@@ -384,10 +513,8 @@ class Model(object):
             else:
                 layer = self._one_layer(
                     layer, self.n_neuron[ii], drop_out_rate=self.drop_out_rate, name='layer_'+str(ii), reuse=reuse, with_timestep=False, init=init)
-        if graph is not None:
-            init_t = graph.get_tensor_by_name('load/energy/matrix:0')
-            with tf.Session(graph=self.graph) as g_sess:
-                init = g_sess.run(init_t)
+        if init_weights is not None:
+            init = init_weights['energy/matrix']
         else:
             init = None
         energy_ = self._final_layer(
@@ -0,0 +1,194 @@
+import os
+import sys
+import re
+import argparse
+import logging
+import numpy as np
+
+
+logging.basicConfig(
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+    level=os.environ.get("LOGLEVEL", "INFO").upper(),
+    stream=sys.stdout,
+)
+logger = logging.getLogger(__name__)
+
+
+class NumpyModel(object):
+    """NumPy evaluator of frozen RiD networks built by `Model.build_force`.
+
+    The network maps CVs to `[cos(angles), sin(angles), dists]` after shifting and scaling,
+    feeds them through tanh layers (resnet layers with a `timestep`) and a linear energy
+    layer. `evaluate` returns the energy and the analytic forces (minus the energy gradient
+    w.r.t. the shifted and scaled CVs), i.e. the `o_energy` and `o_forces` outputs of the
+    frozen graph, without importing TensorFlow.
+    """
+    def __init__(self,
+                 angular_mask,
+                 matrices,
+                 biases,
+                 timesteps,
+                 energy_matrix,
+                 input_shift=None,
+                 input_scale=None,
+                 dtype=np.float64):
+        self.dtype = dtype
+        self.angular_mask = np.array(angular_mask, dtype=bool)
+        self.cv_dim = len(self.angular_mask)
+        self.matrices = [np.asarray(ww, dtype=dtype) for ww in matrices]
+        self.biases = [np.asarray(bb, dtype=dtype) for bb in biases]
+        self.timesteps = [None if tt is None else np.asarray(tt, dtype=dtype) for tt in timesteps]
+        self.energy_matrix = np.asarray(energy_matrix, dtype=dtype)
+        if input_shift is None:
+            input_shift = np.zeros(self.cv_dim)
+        if input_scale is None:
+            input_scale = np.ones(self.cv_dim)
+        self.input_shift = np.asarray(input_shift, dtype=dtype)
+        self.input_scale = np.asarray(input_scale, dtype=dtype)
+        assert len(self.matrices) == len(self.biases) == len(self.timesteps)
+        angular_dim = np.sum(self.angular_mask)
+        assert self.matrices[0].shape[0] == self.cv_dim + angular_dim, \
+            "input size of layer_0 does not match the angular mask"
+
+    @classmethod
+    def from_graph(cls, frozen_graph_filename, dtype=np.float64):
+        """Extract weights from a frozen `.pb` graph. Needs TensorFlow."""
+        try:
+            import tensorflow.compat.v1 as tf
+        except ImportError:
+            import tensorflow as tf
+        graph_def = tf.GraphDef()
+        with open(str(frozen_graph_filename), "rb") as f:
+            graph_def.ParseFromString(f.read())
+        return cls.from_graph_def(graph_def, dtype=dtype)
+
+    @classmethod
+    def from_graph_def(cls, graph_def, dtype=np.float64):
+        """Extract weights from the `GraphDef` of a frozen graph. Needs TensorFlow."""
+        try:
+            import tensorflow.compat.v1 as tf
+        except ImportError:
+            import tensorflow as tf
+        consts = {}
+        for node in graph_def.node:
+            if node.op == "Const":
+                consts[node.name] = tf.make_ndarray(node.attr["value"].tensor)
+        if any(name.endswith("_normalization/beta") for name in consts):
+            raise NotImplementedError("Networks with batch normalization are not supported.")
+        if "angles/mask" in consts:
+            # graphs frozen before the CVs were split by gather
+            angular_mask = consts["angles/mask"]
+        else:
+            angular_mask = np.zeros(len(consts["angular_index"]) + len(consts["non_angular_index"]), dtype=bool)
+            angular_mask[consts["angular_index"]] = True
+        numb_layers = len([name for name in consts if re.fullmatch(r"layer_\d+/matrix", name)])
+        matrices, biases, timesteps = [], [], []
+        for ii in range(numb_layers):
+            matrices.append(consts["layer_%d/matrix" % ii])
+            biases.append(consts["layer_%d/bias" % ii])
+            timesteps.append(consts.get("layer_%d/timestep" % ii))
+        return cls(
+            angular_mask=angular_mask,
+            matrices=matrices,
+            biases=biases,
+            timesteps=timesteps,
+            energy_matrix=consts["energy/matrix"],
+            input_shift=consts.get("input_shift"),
+            input_scale=consts.get("input_scale"),
+            dtype=dtype
+        )
+
+    @classmethod
+    def load(cls, filename, dtype=np.float64):
+        with np.load(filename) as data:
+            numb_layers = int(data["numb_layers"])
+            timesteps = []
+            for ii in range(numb_layers):
+                key = "layer_%d/timestep" % ii
+                timesteps.append(data[key] if key in data.files else None)
+            return cls(
+                angular_mask=data["angular_mask"],
+                matrices=[data["layer_%d/matrix" % ii] for ii in range(numb_layers)],
+                biases=[data["layer_%d/bias" % ii] for ii in range(numb_layers)],
+                timesteps=timesteps,
+                energy_matrix=data["energy/matrix"],
+                input_shift=data["input_shift"],
+                input_scale=data["input_scale"],
+                dtype=dtype
+            )
+
+    def save(self, filename):
+        data = {
+            "numb_layers": len(self.matrices),
+            "angular_mask": self.angular_mask,
+            "input_shift": self.input_shift,
+            "input_scale": self.input_scale,
+            "energy/matrix": self.energy_matrix
+        }
+        for ii in range(len(self.matrices)):
+            data["layer_%d/matrix" % ii] = self.matrices[ii]
+            data["layer_%d/bias" % ii] = self.biases[ii]
+            if self.timesteps[ii] is not None:
+                data["layer_%d/timestep" % ii] = self.timesteps[ii]
+        with open(filename, "wb") as f:
+            np.savez(f, **data)
+
+    def folded_layer_0(self):
+        """Matrix and bias of `layer_0` applied to raw distances, i.e. with the shift and scale of
+        non-angular CVs folded in. Rows of angular features are unchanged."""
+        angular_dim = np.sum(self.angular_mask)
+        shift = self.input_shift[~self.angular_mask]
+        scale = self.input_scale[~self.angular_mask]
+        matrix = self.matrices[0].copy()
+        matrix[2*angular_dim:] *= scale[:, None]
+        bias = self.biases[0] - (shift * scale) @ self.matrices[0][2*angular_dim:]
+        return matrix, bias
+
+    def evaluate(self, cvs):
+        """Energies `[n_frames, 1]` and forces `[n_frames, cv_dim]` of CVs `[n_frames, cv_dim]`."""
+        cvs = np.asarray(cvs, dtype=self.dtype)
+        xx = (cvs - self.input_shift) * self.input_scale
+        angles = xx[:, self.angular_mask]
+        hidden = np.concatenate([np.cos(angles), np.sin(angles), xx[:, ~self.angular_mask]], axis=1)
+        # forward pass, keep tanh outputs for the backward pass
+        acts = []
+        for ww, bb, tt in zip(self.matrices, self.biases, self.timesteps):
+            act = np.tanh(hidden @ ww + bb)
+            acts.append(act)
+            if tt is None:
+                hidden = act
+            else:
+                hidden = hidden + act * tt
+        energy = hidden @ self.energy_matrix
+        # backward pass, gradient of energy w.r.t. the layer inputs
+        grad = np.broadcast_to(self.energy_matrix[:, 0], hidden.shape)
+        for ww, tt, act in zip(self.matrices[::-1], self.timesteps[::-1], acts[::-1]):
+            if tt is None:
+                grad = (grad * (1. - act * act)) @ ww.T
+            else:
+                grad = grad + (grad * tt * (1. - act * act)) @ ww.T
+        angular_dim = angles.shape[1]
+        grad_x = np.empty_like(xx)
+        grad_x[:, self.angular_mask] = np.cos(angles) * grad[:, angular_dim:2*angular_dim] \
+            - np.sin(angles) * grad[:, :angular_dim]
+        grad_x[:, ~self.angular_mask] = grad[:, 2*angular_dim:]
+        forces = -grad_x
+        return energy, forces
+
+
+def export_numpy_model(frozen_graph_filename, output):
+    model = NumpyModel.from_graph(frozen_graph_filename)
+    model.save(output)
+    logger.debug("exported %d layers of %s to %s." % (len(model.matrices), frozen_graph_filename, output))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model", type=str, default="frozen_model.pb",
+                        help="frozen graph of the network")
+    parser.add_argument("-o", "--output", type=str, default="frozen_model.npz",
+                        help="output file of network weights")
+    args = parser.parse_args()
+
+    export_numpy_model(args.model, args.output)
@@ -8,6 +8,8 @@ except ImportError:
     import tensorflow as tf
 import numpy as np
 from rid.nn.model import Reader, Model
+from rid.nn.ensemble import EnsembleModel, freeze_members
+from rid.nn.freeze import freeze_graph, optimize_model
 
 
 class Config(object):
@@ -25,6 +27,9 @@ class Config(object):
         self.decay_steps_inner = 0
         self.decay_rate = 0.96
         self.data_path = './'
+        # with use_mix, new and old data are read from these paths, fall back to data_path if None
+        self.data_new_path = None
+        self.data_old_path = None
         self.restart = False
         self.resnet = False
         self.graph_file = None
@@ -32,6 +37,13 @@ class Config(object):
         self.display_in_training = True
         self.drop_out_rate = 0.5
         self.angular_mask = None
+        # fraction of data held out for validation, 0 to disable
+        self.valid_ratio = 0.
+        # stop if the validation error has not improved for `patience` epochs, 0 to disable
+        self.patience = 0
+        self.valid_chunk_size = 10000
+        # JSON lines file of training metrics, see `rid.nn.metrics`
+        self.metrics_name = None
 
 
 def reset_batch_size(config):
@@ -63,6 +75,8 @@ def print_conf(config, nthreads):
     logger.info("# decay_rate        " + str(config.decay_rate))
     logger.info("# resnet            " + str(config.resnet))
     logger.info("# graph_file        " + str(config.graph_file))
+    logger.info("# valid_ratio       " + str(config.valid_ratio))
+    logger.info("# patience          " + str(config.patience))
 
 
 def set_conf(cv_dim,
@@ -81,7 +95,12 @@ def set_conf(cv_dim,
              decay_steps_inner=0,
              drop_out_rate=0.5,
              data_path="./",
-             log_name = "log"):
+             log_name = "log",
+             valid_ratio=0.,
+             patience=0,
+             data_new_path=None,
+             data_old_path=None,
+             metrics_name=None):
     config = Config(cv_dim)
     config.n_neuron = neurons
     config.batch_size = batch_size
@@ -97,7 +116,12 @@ def set_conf(cv_dim,
     config.drop_out_rate = drop_out_rate
     config.angular_mask = angular_mask
     config.data_path = data_path
+    config.data_new_path = data_new_path
+    config.data_old_path = data_old_path
+    config.metrics_name = metrics_name
     config.log_name = log_name
+    config.valid_ratio = valid_ratio
+    config.patience = patience
     return config
 
 
@@ -119,8 +143,17 @@ def train(
         init_model=None,
         drop_out_rate=0.5,
         data_path="./",
-        log_name = "log"
+        log_name = "log",
+        valid_ratio=0.,
+        patience=0,
+        data_new_path=None,
+        data_old_path=None,
+        metrics_name=None,
+        model_name=None,
+        optimize_graph=False
     ):
+    """Train a model, see `Model`. If `model_name` is given, the trained model is frozen to it in process,
+    and optimized for inference by `optimize_model` if `optimize_graph`."""
     config = set_conf(cv_dim,
                       angular_mask=angular_mask,
                       neurons=neurons,
@@ -137,7 +170,12 @@ def train(
                       decay_steps_inner=decay_steps_inner,
                       drop_out_rate = drop_out_rate,
                       data_path = data_path,
-                      log_name = log_name)
+                      log_name = log_name,
+                      valid_ratio = valid_ratio,
+                      patience = patience,
+                      data_new_path = data_new_path,
+                      data_old_path = data_old_path,
+                      metrics_name = metrics_name)
     if init_model is not None:
         if config.restart:
             raise RuntimeError(
@@ -154,6 +192,76 @@ def train(
         reader = Reader(config)
         model = Model(config, sess)
         model.train(reader)
+        if model_name is not None:
+            freeze_graph(sess, model_name)
+    if model_name is not None and optimize_graph:
+        optimize_model(model_name)
+
+
+def train_ensemble(
+        cv_dim,
+        angular_mask,
+        log_names,
+        model_names,
+        neurons=[240, 120, 60, 30],
+        numb_threads=8,
+        resnet=True,
+        use_mix=False,
+        batch_size=128,
+        epoches=12000,
+        lr=0.0008,
+        decay_steps=120,
+        decay_rate=0.96,
+        old_ratio=7.0,
+        decay_steps_inner=0,
+        drop_out_rate=0.5,
+        data_path="./",
+        valid_ratio=0.,
+        patience=0,
+        data_new_path=None,
+        data_old_path=None,
+        init_models=None,
+        metrics_names=None,
+        optimize_graph=False
+    ):
+    """Train `len(model_names)` models in one graph, see `EnsembleModel`, and freeze them to `model_names`.
+    Members are initialized from the frozen graphs `init_models` if given, frozen members are optimized
+    for inference by `optimize_model` if `optimize_graph`."""
+    config = set_conf(cv_dim,
+                      angular_mask=angular_mask,
+                      neurons=neurons,
+                      numb_threads=numb_threads,
+                      resnet=resnet,
+                      use_mix=use_mix,
+                      batch_size=batch_size,
+                      epoches=epoches,
+                      lr=lr,
+                      decay_steps=decay_steps,
+                      decay_rate=decay_rate,
+                      old_ratio=old_ratio,
+                      decay_steps_inner=decay_steps_inner,
+                      drop_out_rate = drop_out_rate,
+                      data_path = data_path,
+                      log_name = log_names[0],
+                      valid_ratio = valid_ratio,
+                      patience = patience,
+                      data_new_path = data_new_path,
+                      data_old_path = data_old_path)
+    reset_batch_size(config)
+    print_conf(config, numb_threads)
+
+    tf.reset_default_graph()
+    tf_config = tf.ConfigProto(intra_op_parallelism_threads=numb_threads,
+                               inter_op_parallelism_threads=2)
+    with tf.Session(config=tf_config) as sess:
+        print("Begin to optimize")
+        reader = Reader(config)
+        model = EnsembleModel(config, sess, len(model_names), init_models=init_models)
+        model.train(reader, log_names, metrics_names)
+        freeze_members(model, angular_mask, model_names)
+    if optimize_graph:
+        for model_name in model_names:
+            optimize_model(model_name)
 
 
 def get_parm():
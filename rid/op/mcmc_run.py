@@ -11,8 +11,7 @@ from dflow.python import (
 )
 from rid.utils import save_txt, set_directory
 from rid.mcmc.walker import Walker, my_hist1d, my_hist2d, my_hist1d_path, my_hist2d_path
-from rid.select.model_devi import test_ef
-from rid.common.tensorflow.graph import load_graph
+from rid.select.model_devi import test_ef, load_session
 try:
     import tensorflow.compat.v1 as tf
     tf.disable_v2_behavior()
@@ -67,7 +66,7 @@ class MCMCRun(OP):
         
             - `fes_fig`: (`Artifact(Path)`)
         """
-        graph = load_graph(op_in["models"])
+        sess = load_session(op_in["models"])
         mcmc_config = op_in["mcmc_config"]
         temperature = mcmc_config["temperature"]
         fd = mcmc_config["cv_dimension"]
@@ -116,7 +115,7 @@ class MCMCRun(OP):
 
         mcmc_2cv_path = None
         with set_directory(task_path):
-            with tf.Session(graph = graph) as sess:        
+            with sess.as_default():
                 walker = Walker(fd, nw, sess, cv_type, cv_lower=cv_lower, cv_upper=cv_upper)
                 for _ in range(10000):
                     pp, ee, ff = walker.sample(test_ef)
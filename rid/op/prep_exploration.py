@@ -24,6 +24,10 @@ class PrepExplore(OP):
     brute force MD sampling without neural network model provided.
 
     With models provided, the bias forces will be the average value of outputs of these models and tuned by a switching function.
+    If `bias_models` (a network distilled from the ensemble by `DistillModel`) are provided, they bias the simulation instead of `models`.
+    With `bias_format = "ann"` in `exploration_config`, the networks are written into the PLUMED input as `CUSTOM` actions
+    instead of being loaded by `DEEPFE`, so the MD engine needs neither TensorFlow nor the DeepFE plugin. Trust levels
+    are not applied then, use it with a distilled network.
     .. math::
     
         F(r) = -\nabla_{r_i} U(r) + \sigma( \me ( s( r))) \nabla_{r_i} A(r)
@@ -47,6 +51,7 @@ class PrepExplore(OP):
         return OPIOSign(
             {
                 "models": Artifact(List[Path], optional=True),
+                "bias_models": Artifact(List[Path], optional=True),
                 "topology": Artifact(Path, optional=True),
                 "conf": Artifact(Path),
                 "cv_file": Artifact(List[Path], optional=True),
@@ -83,6 +88,7 @@ class PrepExplore(OP):
         
             - `models`: (`Artifact(List[Path])`) Optional. Neural network model files (`.pb`) used to bias the simulation. 
                 Run brute force MD simulations if not provided.
+            - `bias_models`: (`Artifact(List[Path])`) Optional. Model files used to bias the simulation instead of `models`.
             - `trust_lvl_1`: (`float`) Trust level 1.
             - `trust_lvl_2`: (`float`) Trust level 2.
             - `topology`: (`Artifact(Path)`) Topology files (.top) for Gromacs simulations.
@@ -107,10 +113,15 @@ class PrepExplore(OP):
             selected_atomid = op_in["cv_config"]["selected_atomid"]
         elif op_in["cv_config"]["mode"] == "custom":
             cv_file = op_in["cv_file"]
-        if op_in["models"] is None:
+        bias_models = op_in["bias_models"] if op_in["bias_models"] is not None else op_in["models"]
+        bias_format = op_in["exploration_config"].get("bias_format", "deepfe")
+        if bias_models is None:
             models = []
+        elif bias_format == "ann":
+            # networks are written into the plumed input, read them here
+            models = [str(model) for model in bias_models]
         else:
-            models = [str(model.name) for model in op_in["models"]]
+            models = [str(model.name) for model in bias_models]
 
         wall_list = None
         if "iterative_walls" in op_in["cv_config"]:
@@ -131,7 +142,8 @@ class PrepExplore(OP):
             plumed_output = plumed_output_name,
             cv_mode = op_in["cv_config"]["mode"],
             wall_list = wall_list,
-            iteration = iteration
+            iteration = iteration,
+            bias_format = bias_format
         )
         cv_dim = gmx_task_builder.get_cv_dim()
         task_path = Path(op_in["task_name"])
@@ -1,5 +1,5 @@
 import os, sys, shutil, logging
-from typing import List, Dict
+from typing import List, Dict, Optional
 from pathlib import Path
 from copy import deepcopy
 from dflow.python import (
@@ -97,6 +97,8 @@ class PrepRiD(OP):
                 "numb_cluster_upper": int,
                 "numb_cluster_lower": int,
                 "max_selection": int,
+                "cluster_config": Dict,
+                "dedup_radius": Optional[float],
                 "numb_cluster_threshold": int,
                 "std_threshold": float,
                 "dt": float,
@@ -147,6 +149,8 @@ class PrepRiD(OP):
             - `numb_cluster_upper`: (`int`) Upper limit of cluster number to make cluster threshold.
             - `numb_cluster_lower`: (`int`) Lower limit of cluster number to make cluster threshold.
             - `max_selection`: (`int`) Max selection number of clusters in Selection steps for each parallel walker.
+            - `cluster_config`: (`Dict`) Options of the clustering algorithm in Selection steps, see `PrepSelect`.
+            - `dedup_radius`: (`Optional[float]`) Selected conformations within this CV distance of labeled data are not labeled again.
             - `numb_cluster_threshold`: (`int`) Used to adjust trust level. When cluster number is grater than this threshold, 
                 trust levels will be increased adaptively.
             - `dt`: (`float`) Time interval of exploration MD simulations. Gromacs `trjconv` commands will need this parameters 
@@ -194,6 +198,14 @@ class PrepRiD(OP):
         
         std_threshold = label_config["std_threshold"]
         
+        cluster_config = {
+            "cluster_mode": selection_config.pop("cluster_mode", "agglomerative"),
+            "numb_landmarks": selection_config.pop("numb_landmarks", 2000),
+            "landmark_mode": selection_config.pop("landmark_mode", "kcenter"),
+            "chunk_size": selection_config.pop("chunk_size", 2000),
+            "center_mode": selection_config.pop("center_mode", "medoid")
+        }
+        
         if "type_map" in selection_config:
             type_map = selection_config["type_map"]
         else:
@@ -218,6 +230,8 @@ class PrepRiD(OP):
                 "numb_cluster_upper": selection_config.pop("numb_cluster_upper"),
                 "numb_cluster_lower": selection_config.pop("numb_cluster_lower"),
                 "max_selection": selection_config.pop("max_selection"),
+                "cluster_config": cluster_config,
+                "dedup_radius": selection_config.pop("dedup_radius", None),
                 "numb_cluster_threshold": selection_config.pop("numb_cluster_threshold"),
                 "std_threshold": std_threshold,
                 "dt": dt,
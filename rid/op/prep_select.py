@@ -6,7 +6,7 @@ from dflow.python import (
     Parameter
 )
 
-from typing import List, Optional, Union
+from typing import List, Optional, Union, Dict
 from pathlib import Path
 from rid.select.cluster import Cluster
 from rid.utils import save_txt, set_directory
@@ -24,11 +24,14 @@ class PrepSelect(OP):
     frames of each clusters for further selection steps.
     RiD-kit employs agglomerative clustering algorithm performed by Scikit-Learn python package. The distance matrix of CVs
     is pre-calculated, which is defined by Euclidean distance in CV space. For each cluster, one representive frame will 
-    be randomly chosen from cluster members.
+    be chosen from cluster members, the medoid by default.
     For periodic collective variables, RiD-kit uses `angular_mask` to identify them and handle their periodic conditions 
     during distance calculation.
     In the first run of RiD iterations, PrepSelect will make a cluster threshold automatically from the initial guess of this value 
     and make cluter numbers of each parallel walker fall into the interval of `[numb_cluster_lower, numb_cluster_upper]`.
+    For long trajectories, `cluster_mode = "landmark"` in `cluster_config` clusters only a subset of landmark frames and assigns 
+    the other frames to their nearest landmarks, which avoids the memory of the full distance matrix. `cluster_mode = "kcenter"`
+    skips clustering and picks frames spread evenly in CV space by k-center greedy (farthest point) sampling.
     """
 
     @classmethod
@@ -43,7 +46,8 @@ class PrepSelect(OP):
                 "numb_cluster_upper": Parameter(Optional[float], default=None),
                 "numb_cluster_lower": Parameter(Optional[float], default=None),
                 "max_selection": int,
-                "if_make_threshold": Parameter(bool, default=False)
+                "if_make_threshold": Parameter(bool, default=False),
+                "cluster_config": Parameter(Optional[Dict], default={})
             }
         )
 
@@ -80,9 +84,15 @@ class PrepSelect(OP):
             - `numb_cluster_upper`: (`Optional[float]`) Upper limit of cluster number to make cluster threshold.
             - `numb_cluster_lower`: (`Optional[float]`) Lower limit of cluster number to make cluster threshold.
             - `max_selection`: (`int`) Max selection number of clusters in Selection steps for each parallel walker.
-                For each cluster, one representive frame will be randomly chosen from cluster members.
+                For each cluster, one representive frame will be chosen from cluster members, the medoid by default.
             - `if_make_threshold`: (`bool`) whether to make threshold to fit the cluster number interval. Usually `True` in the 1st 
                 iteration and `False` in the further iterations. 
+            - `cluster_config`: (`Dict`) Options of the clustering algorithm. `cluster_mode` is `agglomerative` (default), `landmark` or `kcenter`.
+                In `landmark` mode, `numb_landmarks` frames are picked by `landmark_mode` (`kcenter` or `stride`) and clustered, the other 
+                frames are assigned to landmarks in chunks of `chunk_size` frames. `center_mode` chooses the representative frame of each 
+                cluster, either the medoid (`medoid`, default) or the member closest to the periodic centroid (`centroid`).
+                In `kcenter` mode, up to `max_selection` frames are picked by farthest point sampling without clustering, `cluster_threshold` 
+                is then the covering radius at which picking stops.
 
         Returns
         -------
@@ -97,9 +107,15 @@ class PrepSelect(OP):
         task_path.mkdir(exist_ok=True, parents=True)
         # the first column of plm_out is time index, the second columnn is biased potential
         data = np.loadtxt(op_in["plm_out"])[:,2:]
+        cluster_config = op_in["cluster_config"] if op_in["cluster_config"] is not None else {}
         cv_cluster = Cluster(
             data, op_in["cluster_threshold"], op_in["task_name"], angular_mask=op_in["angular_mask"], 
-            weights=op_in["weights"], max_selection=op_in["max_selection"])
+            weights=op_in["weights"], max_selection=op_in["max_selection"],
+            cluster_mode=cluster_config.get("cluster_mode", "agglomerative"),
+            numb_landmarks=cluster_config.get("numb_landmarks", 2000),
+            landmark_mode=cluster_config.get("landmark_mode", "kcenter"),
+            chunk_size=cluster_config.get("chunk_size", 2000),
+            center_mode=cluster_config.get("center_mode", "medoid"))
         if op_in["if_make_threshold"]:
             assert (op_in["numb_cluster_lower"] is not None) and (op_in["numb_cluster_upper"] is not None), \
                 "Please provide a number interval to make cluster thresholds."
@@ -123,4 +139,135 @@ class PrepSelect(OP):
             })
         return op_out
 
-    
\ No newline at end of file
+    
+
+class PrepSelectGlobal(OP):
+
+    """PrepSelectGlobal OP clusters CV outputs of all parallel walkers together and prepares representative frames of 
+    the pooled clusters for further selection steps.
+    Walkers sampling the same region would send near-identical representatives to the label steps if clustered one by one. 
+    Here the `plm_out` of all walkers are concatenated and clustered once (with the same algorithms as `PrepSelect`), 
+    then every representative frame is mapped back to its walker and frame index, so that `RunSelect` can slice the 
+    trajectory of each walker as usual. The number of label tasks then scales with the number of distinct states instead 
+    of the number of walkers.
+    """
+
+    @classmethod
+    def get_input_sign(cls):
+        return OPIOSign(
+            {
+                "task_name": List[str],
+                "plm_out": Artifact(List[Path]),
+                "cluster_threshold": List[float],
+                "angular_mask": Optional[Union[np.ndarray, List]],
+                "weights": Optional[Union[np.ndarray, List]],
+                "numb_cluster_upper": Parameter(Optional[float], default=None),
+                "numb_cluster_lower": Parameter(Optional[float], default=None),
+                "max_selection": int,
+                "if_make_threshold": Parameter(bool, default=False),
+                "cluster_config": Parameter(Optional[Dict], default={})
+            }
+        )
+
+    @classmethod
+    def get_output_sign(cls):
+        return OPIOSign(
+            {
+                "numb_cluster": List[int],
+                "cluster_threshold": List[float],
+                "cluster_fig": Artifact(Path, archive = None),
+                "cluster_selection_index": Artifact(List[Path], archive = None),
+                "cluster_selection_data": Artifact(List[Path], archive = None)
+            }
+        )
+
+    @OP.exec_sign_check
+    def execute(
+        self,
+        op_in: OPIO,
+    ) -> OPIO:
+        
+        r"""Execute the OP.
+        
+        Parameters
+        ----------
+        op_in : dict
+            Input dict with components:
+
+            - `task_name`: (`List[str]`) Task names of all parallel walkers.
+            - `plm_out`: (`Artifact(List[Path])`) Outputs of CV values of all parallel walkers from exploration steps.
+            - `cluster_threshold`: (`List[float]`) Cluster thresholds of walkers, the first one is used for the pooled clustering.
+            - `angular_mask`: (`array_like`) Mask for periodic collective variables. 1 represents periodic, 0 represents non-periodic.
+            - `weights`: (`array_like`) Weights to cluster collective variables. see details in cluster parts.
+            - `numb_cluster_upper`: (`Optional[float]`) Upper limit of the number of pooled clusters to make cluster threshold.
+            - `numb_cluster_lower`: (`Optional[float]`) Lower limit of the number of pooled clusters to make cluster threshold.
+            - `max_selection`: (`int`) Max selection number for each parallel walker. At most `max_selection` times the number 
+                of walkers representatives are selected from the pooled clusters.
+            - `if_make_threshold`: (`bool`) whether to make threshold to fit the cluster number interval.
+            - `cluster_config`: (`Dict`) Options of the clustering algorithm, see `PrepSelect`.
+
+        Returns
+        -------
+            Output dict with components:
+        
+            - `numb_cluster`: (`List[int]`) Number of representatives of pooled clusters in each walker.
+            - `cluster_threshold`: (`List[float]`) Cluster threshold of the pooled clustering, repeated for each walker.
+            - `cluster_fig`: (`Artifact(Path)`) Cluster distributions along the concatenated trajectories.
+            - `cluster_selection_index`: (`Artifact(List[Path])`) Indice of representive frames in the trajectory of each walker.
+            - `cluster_selection_data`: (`Artifact(List[Path])`) Collective variable values of representive frames of each walker.
+        """
+        task_names = op_in["task_name"]
+        numb_walkers = len(task_names)
+        # match CV outputs to walkers by their task directories if possible
+        plm_dict = {Path(plm).parent.name: plm for plm in op_in["plm_out"]}
+        plm_outs = []
+        for idx, task_name in enumerate(task_names):
+            plm_outs.append(plm_dict[task_name] if task_name in plm_dict else op_in["plm_out"][idx])
+        # the first column of plm_out is time index, the second columnn is biased potential
+        data_list = [np.loadtxt(plm, ndmin=2)[:,2:] for plm in plm_outs]
+        nframes = np.array([len(data) for data in data_list], dtype=int)
+        offsets = np.concatenate([[0], np.cumsum(nframes)[:-1]])
+        walker_index = np.repeat(np.arange(numb_walkers), nframes)
+        data = np.concatenate(data_list, axis=0)
+
+        global_path = Path("global")
+        global_path.mkdir(exist_ok=True, parents=True)
+        cluster_config = op_in["cluster_config"] if op_in["cluster_config"] is not None else {}
+        cv_cluster = Cluster(
+            data, op_in["cluster_threshold"][0], str(global_path), angular_mask=op_in["angular_mask"], 
+            weights=op_in["weights"], max_selection=op_in["max_selection"] * numb_walkers,
+            cluster_mode=cluster_config.get("cluster_mode", "agglomerative"),
+            numb_landmarks=cluster_config.get("numb_landmarks", 2000),
+            landmark_mode=cluster_config.get("landmark_mode", "kcenter"),
+            chunk_size=cluster_config.get("chunk_size", 2000),
+            center_mode=cluster_config.get("center_mode", "medoid"))
+        if op_in["if_make_threshold"]:
+            assert (op_in["numb_cluster_lower"] is not None) and (op_in["numb_cluster_upper"] is not None), \
+                "Please provide a number interval to make cluster thresholds."
+            threshold = cv_cluster.make_threshold(op_in["numb_cluster_lower"], op_in["numb_cluster_upper"])
+        else:
+            threshold = op_in["cluster_threshold"][0]
+        cls_sel_idx = np.array(cv_cluster.get_cluster_selection(), dtype=int)
+
+        numb_cluster = []
+        index_list = []
+        data_list = []
+        for idx, task_name in enumerate(task_names):
+            task_path = Path(task_name)
+            task_path.mkdir(exist_ok=True, parents=True)
+            walker_sel = cls_sel_idx[walker_index[cls_sel_idx] == idx]
+            with set_directory(task_path):
+                np.save(cluster_selection_index_name, walker_sel - offsets[idx])
+                np.save(cluster_selection_data_name, data[walker_sel])
+            numb_cluster.append(len(walker_sel))
+            index_list.append(task_path.joinpath(cluster_selection_index_name))
+            data_list.append(task_path.joinpath(cluster_selection_data_name))
+        
+        op_out = OPIO({
+                "cluster_threshold": [threshold for _ in range(numb_walkers)],
+                "numb_cluster": numb_cluster,
+                "cluster_fig": global_path.joinpath(cluster_fig),
+                "cluster_selection_index": index_list,
+                "cluster_selection_data": data_list
+            })
+        return op_out
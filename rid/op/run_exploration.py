@@ -25,6 +25,7 @@ from rid.constants import (
         lmp_conf_out,
         bias_fig,
         model_devi_fig,
+        model_devi_cache_name,
         dp_model_devi_fig,
         dp_sel_ndx,
         sel_lmp_name,
@@ -34,7 +35,7 @@ from rid.utils import run_command, set_directory, list_to_string
 from rid.common.lammps.command import final_dump
 from rid.common.sampler.command import get_grompp_cmd, get_mdrun_cmd
 from rid.common.mol_dpdata import slice_dump
-from rid.select.model_devi import make_std
+from rid.select.model_devi import make_std, DeviCache
 from rid.mcmc.walker import s,z
 
 
@@ -63,6 +64,7 @@ class RunExplore(OP):
                 "forcefield": Artifact(Path, optional=True),
                 "exploration_config": BigParameter(Dict),
                 "models": Artifact(List[Path], optional=True),
+                "bias_models": Artifact(List[Path], optional=True),
                 "index_file": Artifact(Path, optional=True),
                 "dp_files": Artifact(List[Path], optional=True),
                 "cv_file": Artifact(List[Path], optional=True),
@@ -77,6 +79,7 @@ class RunExplore(OP):
                 "plm_out": Artifact(Path, archive = None),
                 "bias_fig": Artifact(Path, optional=True, archive = None),
                 "model_devi_fig": Artifact(Path,optional=True, archive = None),
+                "model_devi_cache": Artifact(Path,optional=True, archive = None),
                 "dp_model_devi_fig": Artifact(Path,optional=True, archive = None),
                 "dp_model_devi": Artifact(Path,optional=True, archive = None),
                 "dp_selected_indices": Artifact(Path,optional=True, archive = None),
@@ -105,6 +108,8 @@ class RunExplore(OP):
             - `exploration_config`: (`Dict`) Configuration of Gromacs/Lammps simulations in exploration steps.
             - `models`: (`Artifact(List[Path])`) Optional. Neural network model files (`.pb`) used to bias the simulation. 
                 Run brute force MD simulations if not provided.
+            - `bias_models`: (`Artifact(List[Path])`) Optional. Model files biasing the simulation instead of `models`, 
+                `models` are still used for model deviations.
           
         Returns
         -------
@@ -114,6 +119,7 @@ class RunExplore(OP):
             - `md_log`: (`Artifact(Path)`) Log files of Gromacs/lammps `mdrun` commands.
             - `trajectory`: (`Artifact(Path)`) Trajectory files (`.xtc`). The output frequency is defined in `exploration_config`.
             - `conf_out`: (`Artifact(Path)`) Final frames of conformations in simulations.
+            - `model_devi_cache`: (`Artifact(Path)`) Optional. Model deviations of the frames in `plm_out`, reused by `RunSelect`.
         """
         if op_in["index_file"] is None:
             index = None
@@ -162,10 +168,11 @@ class RunExplore(OP):
             if op_in["forcefield"] is not None:
                 if not os.path.islink(op_in["forcefield"].name):
                     os.symlink(op_in["forcefield"], op_in["forcefield"].name)
-            if op_in["models"] is not None:
-                for model in op_in["models"]:
-                    if not os.path.islink(model.name):
-                        os.symlink(model, model.name)
+            for models in [op_in["models"], op_in["bias_models"]]:
+                if models is not None:
+                    for model in models:
+                        if not os.path.islink(model.name):
+                            os.symlink(model, model.name)
             if op_in["dp_files"] is not None:
                 for file in op_in["dp_files"]:
                     if not os.path.islink(file.name):
@@ -208,6 +215,7 @@ class RunExplore(OP):
             
             bias_fig_file = None
             model_devi_fig_file = None
+            model_devi_cache_file = None
             
             dp_model_devi_fig_file = None
             dp_model_devi_file = None
@@ -292,7 +300,9 @@ class RunExplore(OP):
                 plt.savefig(op_in["task_path"].joinpath(bias_fig))
                 # plot model deviation during simulation
                 cv_list = np.loadtxt(plumed_output_name)[:,2:]
-                stds = make_std(cv_list, op_in["models"])
+                cache = DeviCache(op_in["models"])
+                stds = make_std(cv_list, op_in["models"], cache=cache)
+                cache.save(op_in["task_path"].joinpath(model_devi_cache_name))
                 plt.figure(figsize=(10, 8), dpi=100)
                 plt.scatter(xlist,stds)
                 plt.xlabel("simulation time (ps)")
@@ -302,6 +312,7 @@ class RunExplore(OP):
                 
                 bias_fig_file = op_in["task_path"].joinpath(bias_fig)
                 model_devi_fig_file = op_in["task_path"].joinpath(model_devi_fig)
+                model_devi_cache_file = op_in["task_path"].joinpath(model_devi_cache_name)
                 
                         
         if op_in["exploration_config"]["type"] == "gmx":
@@ -320,6 +331,7 @@ class RunExplore(OP):
                 "plm_out": op_in["task_path"].joinpath(plumed_output_name),
                 "bias_fig": bias_fig_file,
                 "model_devi_fig": model_devi_fig_file,
+                "model_devi_cache": model_devi_cache_file,
                 "dp_model_devi_fig": dp_model_devi_fig_file,
                 "dp_model_devi": dp_model_devi_file,
                 "dp_selected_indices": dp_sel_ndx_file,
@@ -1,4 +1,5 @@
-from typing import List, Optional, Dict
+import os, sys, logging
+from typing import List, Optional, Dict, Union
 from pathlib import Path
 import numpy as np
 from dflow.python import (
@@ -11,13 +12,39 @@ from dflow.python import (
 )
 from rid.utils import save_txt, set_directory
 from rid.constants import sel_gro_name, sel_lmp_name, cv_init_label, model_devi_name, model_devi_precision, sel_ndx_name
-from rid.select.conf_select import select_from_devi
+from rid.select.conf_select import select_from_devi, PeriodicCVIndex
 from rid.common.mol import slice_xtc
 from rid.common.mol_dpdata import slice_dump
-from rid.select.model_devi import make_std
+from rid.select.model_devi import make_std, DeviCache
 import json
 
 
+logging.basicConfig(
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+    level=os.environ.get("LOGLEVEL", "INFO").upper(),
+    stream=sys.stdout,
+)
+logger = logging.getLogger(__name__)
+
+
+def skip_labeled(sel_idx, sel_data, data_old, radius, angular_mask=None, weights=None):
+    """Drop selected frames closer than `radius` to CVs of labeled data in `data_old`."""
+    if data_old is None or radius is None or len(sel_idx) == 0:
+        return sel_idx, sel_data
+    if os.stat(data_old).st_size == 0:
+        return sel_idx, sel_data
+    data = np.load(data_old)
+    if data.ndim != 2 or len(data) == 0:
+        return sel_idx, sel_data
+    # rows of training data are CVs followed by mean forces
+    cv_dim = sel_data.shape[1]
+    index = PeriodicCVIndex(data[:, :cv_dim], angular_mask=angular_mask, weights=weights)
+    novel = index.select_novel(sel_data, radius)
+    logger.info(f"skip {len(sel_idx) - len(novel)} label tasks within {radius} of labeled data.")
+    return sel_idx[novel], sel_data[novel]
+
+
 class RunSelect(OP):
 
     """
@@ -28,6 +55,8 @@ class RunSelect(OP):
     Warning: We highly recommend use `slice_mode = "gmx"` due to the inconsistent format convention of `mdtraj` that may lead to topology
     mismatch of next label steps. If you use `mdtraj` mode, please make sure the name conventions of molecules in Gromacs topology 
     files satisfy PDB standards. This could happen in some old Gromcas version.
+    If `dedup_radius` is set, selected frames closer than `dedup_radius` to any already labeled CV point in `data_old` are 
+    dropped before slicing, saving their label simulations.
     """
 
     @classmethod
@@ -46,7 +75,12 @@ class RunSelect(OP):
                 "type_map": Parameter(Optional[List], default=[]),
                 "dt": Parameter(Optional[float], default=None),
                 "output_freq": Parameter(Optional[float], default=None),
-                "slice_mode": Parameter(str, default="gmx")
+                "slice_mode": Parameter(str, default="gmx"),
+                "data_old": Artifact(Path, optional=True),
+                "angular_mask": Parameter(Optional[Union[np.ndarray, List]], default=None),
+                "weights": Parameter(Optional[Union[np.ndarray, List]], default=None),
+                "dedup_radius": Parameter(Optional[float], default=None),
+                "model_devi_cache": Artifact(List[Path], optional=True)
             }
         )
 
@@ -85,6 +119,11 @@ class RunSelect(OP):
             - `topology`: Artifact(Path),
             - `dt`: Parameter(Optional[float], default=None),
             - `slice_mode`: Parameter(str, default=`gmx`)
+            - `data_old`: Artifact(Path, optional=True), labeled training data of previous iterations.
+            - `angular_mask`: Parameter(Optional[Union[np.ndarray, List]], default=None),
+            - `weights`: Parameter(Optional[Union[np.ndarray, List]], default=None),
+            - `dedup_radius`: Parameter(Optional[float], default=None), frames within this distance of `data_old` are not labeled again.
+            - `model_devi_cache`: Artifact(List[Path], optional=True), model deviations saved by `RunExplore` with the same models.
           
         Returns
         -------
@@ -107,13 +146,23 @@ class RunSelect(OP):
             if op_in["models"] is None:
                 save_txt("cls_"+model_devi_name, [], fmt=model_devi_precision)
                 _selected_idx = np.array([ii for ii in range(len(cls_sel_idx))], dtype=int)
+            elif len(cls_sel_idx) == 0:
+                # no representative of pooled clusters falls in this walker
+                save_txt("cls_"+model_devi_name, [], fmt=model_devi_precision)
+                _selected_idx = np.array([], dtype=int)
             else:
-                stds = make_std(cls_sel_data, models=op_in["models"])
+                cache = None
+                if op_in["model_devi_cache"] is not None:
+                    cache = DeviCache.load(op_in["model_devi_cache"], op_in["models"])
+                stds = make_std(cls_sel_data, models=op_in["models"], cache=cache)
                 save_txt("cls_"+model_devi_name, stds, fmt=model_devi_precision)
                 _selected_idx = select_from_devi(stds, op_in["trust_lvl_1"])
             sel_idx = cls_sel_idx[_selected_idx]
-            np.save(sel_ndx_name, sel_idx)
             sel_data = cls_sel_data[_selected_idx]
+            sel_idx, sel_data = skip_labeled(
+                sel_idx, sel_data, op_in["data_old"], op_in["dedup_radius"], 
+                angular_mask=op_in["angular_mask"], weights=op_in["weights"])
+            np.save(sel_ndx_name, sel_idx)
             if op_in["slice_mode"] == "gmx":
                 assert op_in["dt"] is not None, "Please provide time step to slice trajectory."
                 for ii, sel in enumerate(sel_idx):
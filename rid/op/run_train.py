@@ -1,5 +1,6 @@
+import os, sys, logging
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Optional
 from pathlib import Path
 from dflow.python import (
     OP,
@@ -9,13 +10,64 @@ from dflow.python import (
     Parameter,
     BigParameter
 )
-from rid.constants import tf_model_name, train_fig, train_log
-from rid.nn.train_net import train
-from rid.nn.freeze import freeze_model
+from rid.constants import tf_model_name, train_fig, train_log, train_metrics, distill_tag, distill_data_name
+from rid.nn.train_net import train, train_ensemble
+from rid.nn.distill import distill_data
+from rid.nn.metrics import load_metrics
 from matplotlib import pyplot as plt
 from rid.utils import set_directory
 
 
+logging.basicConfig(
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+    level=os.environ.get("LOGLEVEL", "INFO").upper(),
+    stream=sys.stdout,
+)
+logger = logging.getLogger(__name__)
+
+
+def _is_empty(data):
+    return data is None or os.stat(data).st_size == 0 or len(np.load(data)) == 0
+
+
+def mix_data(op_in, train_config):
+    """Paths of new and old data to mix in batches, `(None, None)` if `use_mix` is off or either is missing."""
+    if not train_config["use_mix"]:
+        return None, None
+    if _is_empty(op_in["data_new"]) or _is_empty(op_in["data_old"]):
+        logger.info("new or old data is missing, train on all data without mixing.")
+        return None, None
+    return str(op_in["data_new"]), str(op_in["data_old"])
+
+
+def warm_start_model(init_models, model_tag, train_config):
+    """Model of the previous iteration with the same tag to initialize `model_tag` from, if `warm_start` is set."""
+    if not train_config.get("warm_start", False) or init_models is None:
+        return None
+    name = tf_model_name.format(tag=model_tag)
+    for model in init_models:
+        if Path(model).name == name:
+            return str(Path(model).absolute())
+    logger.info(f"no initial model {name} is found, train from scratch.")
+    return None
+
+
+def warm_start_epoches(train_config):
+    return train_config.get("warm_start_epoches", max(train_config["epoches"] // 5, 1))
+
+
+def plot_train_metrics(train_metrics_name, train_fig_name):
+    # plot loglog loss png
+    metrics = load_metrics(train_metrics_name)
+    plt.figure(figsize=(10, 8), dpi=100)
+    plt.loglog(metrics["epoch"], metrics["train_rel_err"])
+    plt.xlabel("log of training epoches")
+    plt.ylabel("log of relative error")
+    plt.title("loglog fig of training")
+    plt.savefig(train_fig_name)
+
+
 class TrainModel(OP):
 
     """`TrainModel` trains a set of neural network models (set by `numb_model` in `train_config`). 
@@ -29,7 +81,10 @@ class TrainModel(OP):
                 "model_tag": str,
                 "angular_mask": List,
                 "data": Artifact(Path),
-                "train_config": BigParameter(Dict)
+                "train_config": BigParameter(Dict),
+                "data_new": Artifact(Path, optional=True),
+                "data_old": Artifact(Path, optional=True),
+                "init_models": Artifact(List[Path], optional=True)
             }
         )
 
@@ -39,7 +94,8 @@ class TrainModel(OP):
             {
                 "model": Artifact(Path),
                 "train_log": Artifact(Path),
-                "train_fig": Artifact(Path)
+                "train_fig": Artifact(Path),
+                "train_metrics": Artifact(Path)
             }
         )
 
@@ -61,12 +117,17 @@ class TrainModel(OP):
             - `data`: (`Artifact(Path)`) Data files for training. Prepared by `rid.op.prep_data`.
                 `data` has the shape of `[number_conf, 2 * dimension_cv]` and contains the CV values and corresponding mean forces.
             - `train_config`: (`Dict`) Configuration to train neural networks, including training strategy and network structures.
+            - `data_new`: (`Artifact(Path)`) Data labeled in this iteration, optional. Used with `data_old` if `use_mix` is set.
+            - `data_old`: (`Artifact(Path)`) Data of previous iterations, optional. Batches draw `old_ratio` old frames per new frame.
+            - `init_models`: (`Artifact(List[Path])`) Models of the previous iteration, optional. With `warm_start`, each model is 
+                initialized from the one of the same tag and trained for `warm_start_epoches` epoches.
           
         Returns
         -------
             Output dict with components:
         
             - `model`: (`Artifact(Path)`) Neural network models in `.pb` formats.
+            - `train_metrics`: (`Artifact(Path)`) Training metrics in JSON lines, see `rid.nn.metrics`.
         """
 
         data_shape = np.load(op_in["data"]).shape
@@ -75,6 +136,11 @@ class TrainModel(OP):
         task_path = Path(op_in["model_tag"])
         task_path.mkdir(exist_ok=True, parents=True)
         train_log_name = train_log.format(tag=op_in["model_tag"])
+        train_metrics_name = train_metrics.format(tag=op_in["model_tag"])
+        out_put_name = tf_model_name.format(tag=op_in["model_tag"])
+        data_new, data_old = mix_data(op_in, train_config)
+        init_model = warm_start_model(op_in["init_models"], op_in["model_tag"], train_config)
+        epoches = train_config["epoches"] if init_model is None else warm_start_epoches(train_config)
         with set_directory(task_path):
             train(
                 cv_dim=cv_dim,
@@ -82,51 +148,276 @@ class TrainModel(OP):
                 angular_mask=op_in["angular_mask"],
                 numb_threads=train_config.get("numb_threads", 8),
                 resnet=train_config["resnet"],
-                use_mix=train_config["use_mix"],
+                use_mix=data_new is not None,
+                old_ratio=train_config.get("old_ratio", 7.0),
                 restart=train_config.get("restart", False),
                 batch_size=train_config["batch_size"],
-                epoches=train_config["epoches"],
+                epoches=epoches,
                 lr=train_config["init_lr"],
                 decay_steps=train_config["decay_steps"],
                 decay_rate=train_config["decay_rate"],
                 drop_out_rate=train_config["drop_out_rate"],
                 data_path=str(op_in["data"]),
-                log_name = train_log_name
+                log_name = train_log_name,
+                metrics_name = train_metrics_name,
+                model_name = out_put_name,
+                optimize_graph = train_config.get("optimize_graph", False),
+                valid_ratio=train_config.get("valid_ratio", 0.),
+                patience=train_config.get("patience", 0),
+                data_new_path=data_new,
+                data_old_path=data_old,
+                init_model=init_model
             )
-            out_put_name = tf_model_name.format(tag=op_in["model_tag"])
             train_fig_name = train_fig.format(tag=op_in["model_tag"])
-            # plot loglog loss png
-            loss_list = []
-            epoch_list = []
-            with open(train_log_name, "r") as f:
-                while True:
-                    line = f.readline()
-                    if "running time" in line:
-                        break
-                    if "rid.nn.model" in line:
-                        data = line.split(" ")
-                        if len(loss_list) == 0:
-                            epoch_list.append(int(data[10][:-1]))
-                            loss_list.append(float(data[14][:-1]))
-                        else:
-                            epoch_list.append(int(data[8][:-1]))
-                            loss_list.append(float(data[12][:-1]))
-
-            plt.figure(figsize=(10, 8), dpi=100)
-            plt.loglog(epoch_list,loss_list)
-            plt.xlabel("log of training epoches")
-            plt.ylabel("log of relative error")
-            plt.title("loglog fig of training")
-            plt.savefig(train_fig_name)
-            
-            freeze_model(
-                model_folder=".",
-                output=out_put_name
+            plot_train_metrics(train_metrics_name, train_fig_name)
+        op_out = OPIO(
+            {
+                "model": task_path.joinpath(out_put_name),
+                "train_log": task_path.joinpath(train_log_name),
+                "train_metrics": task_path.joinpath(train_metrics_name),
+                "train_fig": task_path.joinpath(train_fig_name)
+            }
+        )
+        return op_out
+
+
+class TrainModels(OP):
+
+    """`TrainModels` trains all neural network models of `model_tags` together in one graph (see 
+    `rid.nn.ensemble.EnsembleModel`), instead of one `TrainModel` step per model. Outputs are the same 
+    as those of `TrainModel` steps, gathered in lists ordered by `model_tags`.
+    """
+
+    @classmethod
+    def get_input_sign(cls):
+        return OPIOSign(
+            {
+                "model_tag": List[str],
+                "angular_mask": List,
+                "data": Artifact(Path),
+                "train_config": BigParameter(Dict),
+                "data_new": Artifact(Path, optional=True),
+                "data_old": Artifact(Path, optional=True),
+                "init_models": Artifact(List[Path], optional=True)
+            }
+        )
+
+    @classmethod
+    def get_output_sign(cls):
+        return OPIOSign(
+            {
+                "model": Artifact(List[Path]),
+                "train_log": Artifact(List[Path]),
+                "train_fig": Artifact(List[Path]),
+                "train_metrics": Artifact(List[Path])
+            }
+        )
+
+    @OP.exec_sign_check
+    def execute(
+        self,
+        op_in: OPIO,
+    ) -> OPIO:
+
+        r"""Execute the OP.
+        
+        Parameters
+        ----------
+        op_in : dict
+            Input dict with components:
+
+            - `model_tag`: (`List[str]`) Tags for neural network model files. In formats of `model_{model_tag}.pb`.
+            - `angular_mask`: (`List`) Angular mask for periodic collective variables. 1 represents periodic, 0 represents non-periodic.
+            - `data`: (`Artifact(Path)`) Data files for training. Prepared by `rid.op.prep_data`.
+            - `train_config`: (`Dict`) Configuration to train neural networks, including training strategy and network structures.
+            - `data_new`: (`Artifact(Path)`) Data labeled in this iteration, optional. Used with `data_old` if `use_mix` is set.
+            - `data_old`: (`Artifact(Path)`) Data of previous iterations, optional. Batches draw `old_ratio` old frames per new frame.
+            - `init_models`: (`Artifact(List[Path])`) Models of the previous iteration, optional. With `warm_start`, each model is 
+                initialized from the one of the same tag and trained for `warm_start_epoches` epoches.
+          
+        Returns
+        -------
+            Output dict with components:
+        
+            - `model`: (`Artifact(List[Path])`) Neural network models in `.pb` formats.
+            - `train_metrics`: (`Artifact(List[Path])`) Training metrics in JSON lines, see `rid.nn.metrics`.
+        """
+
+        data_shape = np.load(op_in["data"]).shape
+        cv_dim = int(data_shape[1] // 2)
+        train_config = op_in["train_config"]
+        task_paths = [Path(tag) for tag in op_in["model_tag"]]
+        for task_path in task_paths:
+            task_path.mkdir(exist_ok=True, parents=True)
+        train_log_names = [task_path.joinpath(train_log.format(tag=tag)) for task_path, tag in zip(task_paths, op_in["model_tag"])]
+        model_names = [task_path.joinpath(tf_model_name.format(tag=tag)) for task_path, tag in zip(task_paths, op_in["model_tag"])]
+        train_fig_names = [task_path.joinpath(train_fig.format(tag=tag)) for task_path, tag in zip(task_paths, op_in["model_tag"])]
+        train_metrics_names = [task_path.joinpath(train_metrics.format(tag=tag)) for task_path, tag in zip(task_paths, op_in["model_tag"])]
+        if train_config.get("restart", False):
+            raise RuntimeError("ensemble training does not support restart")
+        data_new, data_old = mix_data(op_in, train_config)
+        init_models = [warm_start_model(op_in["init_models"], tag, train_config) for tag in op_in["model_tag"]]
+        if None in init_models:
+            init_models = None
+        epoches = train_config["epoches"] if init_models is None else warm_start_epoches(train_config)
+        train_ensemble(
+            cv_dim=cv_dim,
+            angular_mask=op_in["angular_mask"],
+            log_names=[str(name) for name in train_log_names],
+            metrics_names=[str(name) for name in train_metrics_names],
+            model_names=[str(name) for name in model_names],
+            neurons=train_config["neurons"],
+            numb_threads=train_config.get("numb_threads", 8),
+            resnet=train_config["resnet"],
+            use_mix=data_new is not None,
+            old_ratio=train_config.get("old_ratio", 7.0),
+            batch_size=train_config["batch_size"],
+            epoches=epoches,
+            lr=train_config["init_lr"],
+            decay_steps=train_config["decay_steps"],
+            decay_rate=train_config["decay_rate"],
+            drop_out_rate=train_config["drop_out_rate"],
+            data_path=str(op_in["data"]),
+            valid_ratio=train_config.get("valid_ratio", 0.),
+            patience=train_config.get("patience", 0),
+            data_new_path=data_new,
+            data_old_path=data_old,
+            init_models=init_models,
+            optimize_graph=train_config.get("optimize_graph", False)
+        )
+        for train_metrics_name, train_fig_name in zip(train_metrics_names, train_fig_names):
+            plot_train_metrics(train_metrics_name, train_fig_name)
+        op_out = OPIO(
+            {
+                "model": model_names,
+                "train_log": train_log_names,
+                "train_metrics": train_metrics_names,
+                "train_fig": train_fig_names
+            }
+        )
+        return op_out
+
+
+class DistillModel(OP):
+
+    """`DistillModel` trains one student network on the mean forces of the ensemble `models`, at the CVs
+    of the training data and of the exploration trajectories (`plm_out`). The student replaces the 
+    ensemble as the bias of the next exploration, so PLUMED evaluates one network per MD step instead 
+    of `numb_models`, while model deviations are still computed with the ensemble.
+    As the deviation of a single network is zero, the trust levels of the ensemble are applied to the
+    targets instead, i.e. mean forces are scaled by the switching function of the ensemble deviation
+    (see `PrepExplore`), with the lowest trust levels of all walkers.
+    Settings are read from `distill` of `train_config`, other training parameters from `train_config`.
+    """
+
+    @classmethod
+    def get_input_sign(cls):
+        return OPIOSign(
+            {
+                "models": Artifact(List[Path]),
+                "angular_mask": List,
+                "data": Artifact(Path),
+                "plm_out": Artifact(List[Path], optional=True),
+                "train_config": BigParameter(Dict),
+                "trust_lvl_1": Parameter(Optional[List[float]], default=None),
+                "trust_lvl_2": Parameter(Optional[List[float]], default=None)
+            }
+        )
+
+    @classmethod
+    def get_output_sign(cls):
+        return OPIOSign(
+            {
+                "model": Artifact(Path),
+                "train_log": Artifact(Path),
+                "train_fig": Artifact(Path),
+                "train_metrics": Artifact(Path)
+            }
+        )
+
+    @OP.exec_sign_check
+    def execute(
+        self,
+        op_in: OPIO,
+    ) -> OPIO:
+
+        r"""Execute the OP.
+        
+        Parameters
+        ----------
+        op_in : dict
+            Input dict with components:
+
+            - `models`: (`Artifact(List[Path])`) Ensemble of trained models to distill.
+            - `angular_mask`: (`List`) Angular mask for periodic collective variables. 1 represents periodic, 0 represents non-periodic.
+            - `data`: (`Artifact(Path)`) Training data of the ensemble, its CVs are used as distillation points.
+            - `plm_out`: (`Artifact(List[Path])`) CV outputs of exploration steps, optional. Up to `max_frames` of their frames 
+                are used as distillation points.
+            - `train_config`: (`Dict`) Configuration to train neural networks, with distillation settings in `distill`.
+            - `trust_lvl_1`: (`List[float]`) Trust levels 1 of the walkers, optional. Targets are not switched if not given.
+            - `trust_lvl_2`: (`List[float]`) Trust levels 2 of the walkers, optional.
+          
+        Returns
+        -------
+            Output dict with components:
+        
+            - `model`: (`Artifact(Path)`) Student network in `.pb` format, named `model_distill.pb`.
+            - `train_metrics`: (`Artifact(Path)`) Training metrics in JSON lines, see `rid.nn.metrics`.
+        """
+
+        train_config = op_in["train_config"]
+        distill_config = train_config.get("distill", {})
+        data = np.load(op_in["data"])
+        cv_dim = int(data.shape[1] // 2)
+        cvs = data[:, :cv_dim]
+        if op_in["plm_out"] is not None:
+            # the first two columns of plm_out are time and bias
+            explored = np.concatenate([np.loadtxt(plm, ndmin=2)[:, 2:] for plm in op_in["plm_out"]], axis=0)
+            max_frames = distill_config.get("max_frames", 20000)
+            if len(explored) > max_frames:
+                rng = np.random.default_rng(distill_config.get("seed", 0))
+                explored = explored[rng.choice(len(explored), max_frames, replace=False)]
+            cvs = np.concatenate([cvs, explored], axis=0)
+        trust_lvl_1 = trust_lvl_2 = None
+        if distill_config.get("switching", True) and op_in["trust_lvl_1"] is not None:
+            trust_lvl_1, trust_lvl_2 = min(op_in["trust_lvl_1"]), min(op_in["trust_lvl_2"])
+        models = [str(Path(model).absolute()) for model in op_in["models"]]
+
+        task_path = Path(distill_tag)
+        task_path.mkdir(exist_ok=True, parents=True)
+        train_log_name = train_log.format(tag=distill_tag)
+        train_metrics_name = train_metrics.format(tag=distill_tag)
+        out_put_name = tf_model_name.format(tag=distill_tag)
+        with set_directory(task_path):
+            np.save(distill_data_name, distill_data(cvs, models, trust_lvl_1, trust_lvl_2))
+            logger.info(f"distill {len(models)} models at {len(cvs)} CV points.")
+            train(
+                cv_dim=cv_dim,
+                neurons=distill_config.get("neurons", [max(nn // 2, 1) for nn in train_config["neurons"]]),
+                angular_mask=op_in["angular_mask"],
+                numb_threads=train_config.get("numb_threads", 8),
+                resnet=train_config["resnet"],
+                batch_size=train_config["batch_size"],
+                epoches=distill_config.get("epoches", train_config["epoches"]),
+                lr=train_config["init_lr"],
+                decay_steps=train_config["decay_steps"],
+                decay_rate=train_config["decay_rate"],
+                drop_out_rate=distill_config.get("drop_out_rate", train_config["drop_out_rate"]),
+                data_path=distill_data_name,
+                log_name = train_log_name,
+                metrics_name = train_metrics_name,
+                model_name = out_put_name,
+                valid_ratio=distill_config.get("valid_ratio", 0.),
+                patience=distill_config.get("patience", 0),
+                optimize_graph = train_config.get("optimize_graph", False)
             )
+            train_fig_name = train_fig.format(tag=distill_tag)
+            plot_train_metrics(train_metrics_name, train_fig_name)
         op_out = OPIO(
             {
                 "model": task_path.joinpath(out_put_name),
                 "train_log": task_path.joinpath(train_log_name),
+                "train_metrics": task_path.joinpath(train_metrics_name),
                 "train_fig": task_path.joinpath(train_fig_name)
             }
         )
@@ -3,6 +3,8 @@ from typing import Union, List, Optional
 import logging
 import numpy as np
 import sklearn.cluster as skcluster
+from scipy.cluster.hierarchy import linkage, fcluster
+from scipy.spatial.distance import squareform
 from matplotlib import pyplot as plt
 from rid.constants import cluster_fig
 from pathlib import Path
@@ -26,51 +28,109 @@ class Cluster:
         angular_mask: Optional[Union[np.ndarray, List]] = None, 
         weights: Optional[Union[np.ndarray, List]] = None,
         max_search_step: int = 500,
-        max_selection: int = 1000
+        max_selection: int = 1000,
+        cluster_mode: str = "agglomerative",
+        numb_landmarks: int = 2000,
+        landmark_mode: str = "kcenter",
+        chunk_size: int = 2000,
+        center_mode: str = "medoid"
     ):
+        if cluster_mode not in ["agglomerative", "landmark", "kcenter"]:
+            raise ValueError(f"Unknown cluster mode {cluster_mode}, only support `agglomerative`, `landmark` and `kcenter`.")
         if angular_mask is None:
-            angular_mask = np.zeros(shape=(cvs[1],))
+            angular_mask = np.zeros(shape=(np.shape(cvs)[1],))
         if weights is None:
-            weights = np.ones(shape=(cvs[1],))
+            weights = np.ones(shape=(np.shape(cvs)[1],))
         self.angular_mask = angular_mask
         self.weights = weights
         self.task_name = task_name
         self.max_search_step = max_search_step
         self.threshold = threshold
         self.cvs = cvs
-        self.enlarge_coeff = 1.05
-        self.reduce_coeff = 0.95
         self.cls_sel = None
         self.max_selection = max_selection
-    
+        self.cluster_mode = cluster_mode
+        self.numb_landmarks = numb_landmarks
+        self.landmark_mode = landmark_mode
+        self.chunk_size = chunk_size
+        self.center_mode = center_mode
+        self.landmark_idx = None
+        self.dist = None
+        self.tree = None
+
+    def get_tree(self):
+        # the distance matrix and the linkage tree do not depend on the threshold,
+        # build them once and cut the same tree for every threshold.
+        if self.tree is None:
+            cvs = np.asarray(self.cvs)
+            if self.cluster_mode == "landmark":
+                self.landmark_idx = select_landmarks(
+                    cvs, self.numb_landmarks, angular_mask=self.angular_mask, 
+                    weights=self.weights, landmark_mode=self.landmark_mode)
+                logger.info(f"select {len(self.landmark_idx)} landmarks from {len(cvs)} frames.")
+                cvs = cvs[self.landmark_idx]
+            self.dist = mk_dist(cvs, self.angular_mask, np.array(self.weights))
+            self.tree = mk_linkage(self.dist)
+        return self.tree
+
     def make_threshold(self, numb_cluster_lower, numb_cluster_upper):
         current_iter = 0
         logger.info(f"set numb_cluster_upper to {numb_cluster_upper}")
         logger.info(f"set numb_cluster_lower to {numb_cluster_lower}")
         assert numb_cluster_lower < numb_cluster_upper, f"expect numb_cluster_upper > numb_cluster_lower, "
         "got {numb_cluster_upper} < {numb_cluster_lower}"
+        if len(self.cvs) <= 1:
+            return self.threshold
+        if self.cluster_mode == "kcenter":
+            return self.make_kcenter_threshold(numb_cluster_lower, numb_cluster_upper)
+        tree = self.get_tree()
+        # the number of clusters decreases monotonically with the threshold,
+        # bisect within [0, height of the root merge].
+        lower_bound, upper_bound = 0., tree[-1, 2] * (1 + 1e-6)
         while current_iter < self.max_search_step:
             logger.info(f"making threshold attempt {current_iter}")
-            cls_sel = sel_from_cluster(
-                self.cvs, self.threshold, Path(self.task_name),angular_mask=self.angular_mask, 
-                weights=self.weights, max_selection=self.max_selection)
-            test_numb_cluster = len(set(cls_sel))
+            # selections are truncated to `max_selection`, so are the counted clusters
+            test_numb_cluster = min(len(set(cut_linkage(tree, self.threshold))), self.max_selection)
             if test_numb_cluster < numb_cluster_lower:
-                self.threshold = self.threshold * self.reduce_coeff
+                upper_bound = min(upper_bound, self.threshold)
             elif test_numb_cluster > numb_cluster_upper:
-                self.threshold = self.threshold * self.enlarge_coeff
+                lower_bound = max(lower_bound, self.threshold)
             else:
                 break
+            self.threshold = (lower_bound + upper_bound) / 2
             logger.info(f"set threshold to {self.threshold}, get {test_numb_cluster} clusters.")
             current_iter += 1
-        self.cls_sel = cls_sel
+        return self.threshold
+
+    def make_kcenter_threshold(self, numb_cluster_lower, numb_cluster_upper):
+        # in k-center mode the threshold is the covering radius, which decreases with every picked center.
+        # one greedy run gives the radius of every center number, take the one in the middle of the interval.
+        numb_target = min(int((numb_cluster_lower + numb_cluster_upper) // 2), self.max_selection)
+        _, radius = kcenter_greedy(
+            self.cvs, numb_target, angular_mask=self.angular_mask, weights=self.weights, return_radius=True)
+        self.threshold = float(radius[-1])
+        logger.info(f"set threshold to {self.threshold}, get {len(radius)} clusters.")
         return self.threshold
     
     def get_cluster_selection(self):
         if self.cls_sel is None:
-            self.cls_sel = sel_from_cluster(
-                self.cvs, self.threshold, Path(self.task_name),angular_mask=self.angular_mask, 
-                weights=self.weights, max_selection=self.max_selection)
+            if self.cluster_mode == "kcenter":
+                self.cls_sel = sel_from_kcenter(
+                    self.cvs, self.threshold, Path(self.task_name), angular_mask=self.angular_mask, 
+                    weights=self.weights, max_selection=self.max_selection, chunk_size=self.chunk_size)
+                return self.cls_sel
+            if len(self.cvs) > 1:
+                self.get_tree()
+            if self.cluster_mode == "landmark" and len(self.cvs) > 1:
+                self.cls_sel = sel_from_landmarks(
+                    self.cvs, self.threshold, Path(self.task_name), self.landmark_idx, angular_mask=self.angular_mask, 
+                    weights=self.weights, max_selection=self.max_selection, dist=self.dist, tree=self.tree,
+                    chunk_size=self.chunk_size, center_mode=self.center_mode)
+            else:
+                self.cls_sel = sel_from_cluster(
+                    self.cvs, self.threshold, Path(self.task_name),angular_mask=self.angular_mask, 
+                    weights=self.weights, max_selection=self.max_selection, dist=self.dist, tree=self.tree,
+                    center_mode=self.center_mode)
         return self.cls_sel
         
 
@@ -85,13 +145,52 @@ def cv_dist(cv1, cv2, angular_mask, weights):
     return np.linalg.norm(diff * weights)
 
 
-def mk_dist(cv, angular_mask, weights):
+def mk_pair_dist(cv_a, cv_b, angular_mask=None, weights=None, dtype=np.float64):
+    """Weighted distances between every row of `cv_a` and every row of `cv_b`.
+    
+    Periodic components (`angular_mask == 1`) are wrapped into [-pi, pi] as in `cv_dist`.
+    The squared distance is accumulated one CV component at a time, so the temporary memory is
+    that of the output block, i.e. `len(cv_a) * len(cv_b)`, independent of the CV dimension.
+    """
+    cv_a = np.asarray(cv_a, dtype=dtype)
+    cv_b = np.asarray(cv_b, dtype=dtype)
+    ncv = cv_a.shape[1]
+    if angular_mask is None:
+        angular_mask = np.zeros(ncv)
+    if weights is None:
+        weights = np.ones(ncv)
+    angular_mask = np.asarray(angular_mask)
+    weights = np.asarray(weights, dtype=dtype)
+    dist = np.zeros([cv_a.shape[0], cv_b.shape[0]], dtype=dtype)
+    for kk in range(ncv):
+        diff = np.subtract.outer(cv_a[:, kk], cv_b[:, kk])
+        if angular_mask[kk] == 1:
+            diff -= 2 * np.pi * np.rint(diff / (2 * np.pi))
+        diff *= weights[kk]
+        diff *= diff
+        dist += diff
+    np.sqrt(dist, out=dist)
+    return dist
+
+
+def mk_dist(cv, angular_mask, weights, dtype=np.float64, block_size=None, max_block_memory=2**28):
+    """Pairwise distance matrix of CVs, computed block by block with `mk_pair_dist`.
+    
+    Rows are processed in blocks of `block_size` frames and only the upper triangle is evaluated.
+    If `block_size` is not given, it is chosen so that the temporaries of one block take at most
+    `max_block_memory` bytes. Pass `dtype=np.float32` to halve the memory of the returned matrix.
+    """
+    cv = np.asarray(cv, dtype=dtype)
     nframe = cv.shape[0]
-    dist = np.zeros([nframe, nframe])
-    for ii in range(nframe):
-        for jj in range(ii+1, nframe):
-            dist[ii][jj] = cv_dist(cv[ii], cv[jj], angular_mask, weights)
-            dist[jj][ii] = dist[ii][jj]
+    if block_size is None:
+        itemsize = np.dtype(dtype).itemsize
+        block_size = max(1, int(max_block_memory // (2 * itemsize * max(nframe, 1))))
+    dist = np.zeros([nframe, nframe], dtype=dtype)
+    for start in range(0, nframe, block_size):
+        end = min(start + block_size, nframe)
+        block = mk_pair_dist(cv[start:end], cv[start:], angular_mask, weights, dtype=dtype)
+        dist[start:end, start:] = block
+        dist[start:, start:end] = block.T
     return dist
 
 
@@ -105,33 +204,89 @@ def mk_cluster(dist, distance_threshold):
     return cluster.labels_
 
 
+def mk_linkage(dist):
+    logger.info("building average linkage tree ...")
+    return linkage(squareform(dist, checks=False), method='average')
+
+
+def cut_linkage(tree, distance_threshold):
+    """Cut an average linkage tree at `distance_threshold`, giving the same partition as 
+    `mk_cluster` with the same threshold. Labels start from 0."""
+    return fcluster(tree, t=distance_threshold, criterion='distance') - 1
+
+
 def chooseClusterCenter(dist:np.ndarray, conf_ids:list):
-    id_min = conf_ids[0]
-    min_loss = None
-    # n_tot_frame = dist.shape[0]
-    for id in conf_ids:
-        rmsd = dist[id]
-        loss = 0
-        for i, conf in enumerate(conf_ids):
-            rms = rmsd[conf]
-            loss += rms * rms
-        loss = np.sqrt(loss)
-        if min_loss == None:
-            min_loss = loss
+    conf_ids = np.asarray(conf_ids, dtype=int)
+    sub_dist = dist[np.ix_(conf_ids, conf_ids)]
+    loss = np.sum(sub_dist * sub_dist, axis=1)
+    return [conf_ids[np.argmin(loss)]]
+
+
+def _first_min_per_label(loss, labels):
+    # index of the smallest loss of each label, ties broken by the smaller index
+    order = np.lexsort((np.arange(len(labels)), loss, labels))
+    sorted_labels = labels[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sorted_labels[1:] != sorted_labels[:-1]
+    return order[first]
+
+
+def choose_cluster_medoids(dist, labels, max_block_memory=2**28):
+    """Medoids of all clusters in one pass over the distance matrix.
+
+    For every frame the sum of squared distances to the members of its own cluster is reduced
+    row block by row block, the member with the smallest sum is the center of the cluster, which is
+    the same choice as `chooseClusterCenter`. Returns centers indexed by cluster label.
+    """
+    labels = np.asarray(labels, dtype=int)
+    nframe = len(labels)
+    order = np.argsort(labels, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(labels[order]) != 0])
+    block_size = max(1, int(max_block_memory // (dist.itemsize * max(nframe, 1))))
+    loss = np.zeros(nframe)
+    for start in range(0, nframe, block_size):
+        end = min(start + block_size, nframe)
+        block = dist[start:end][:, order]
+        block *= block
+        block_loss = np.add.reduceat(block, starts, axis=1)
+        loss[start:end] = block_loss[np.arange(end - start), labels[start:end]]
+    return _first_min_per_label(loss, labels)
+
+
+def choose_cluster_centroids(cvs, labels, angular_mask=None, weights=None):
+    """For all clusters in one pass, the member closest to the cluster centroid in CV space.
+
+    Periodic components (`angular_mask == 1`) are averaged as circular means. Costs `O(nframe)`
+    and needs no distance matrix, which is cheaper than medoids for very large clusters.
+    Returns centers indexed by cluster label.
+    """
+    cvs = np.asarray(cvs, dtype=float)
+    labels = np.asarray(labels, dtype=int)
+    ncv = cvs.shape[1]
+    if angular_mask is None:
+        angular_mask = np.zeros(ncv)
+    if weights is None:
+        weights = np.ones(ncv)
+    angular_mask = np.asarray(angular_mask)
+    weights = np.asarray(weights, dtype=float)
+    numb_cluster = labels.max() + 1
+    sizes = np.bincount(labels, minlength=numb_cluster)
+    loss = np.zeros(len(labels))
+    for kk in range(ncv):
+        if angular_mask[kk] == 1:
+            sin_sum = np.bincount(labels, weights=np.sin(cvs[:, kk]), minlength=numb_cluster)
+            cos_sum = np.bincount(labels, weights=np.cos(cvs[:, kk]), minlength=numb_cluster)
+            centroid = np.arctan2(sin_sum, cos_sum)
+            diff = cvs[:, kk] - centroid[labels]
+            diff -= 2 * np.pi * np.rint(diff / (2 * np.pi))
         else:
-            if loss < min_loss:
-                id_min = id
-                min_loss = loss
-    return [id_min]
+            centroid = np.bincount(labels, weights=cvs[:, kk], minlength=numb_cluster) / sizes
+            diff = cvs[:, kk] - centroid[labels]
+        loss += (weights[kk] * diff) ** 2
+    return _first_min_per_label(loss, labels)
 
 
-def sel_from_cluster(cvs, threshold, task_path, angular_mask=None, weights=None, max_selection=1000):
-    if len(cvs) <= 1:
-        return cvs
-    weights = np.array(weights)
-    dist = mk_dist(cvs, angular_mask, weights) 
-    labels = mk_cluster(dist, threshold)
-    # plot clustering distributions
+def plot_cluster(labels, task_path):
     xlist = [i for i in range(len(labels))]
     plt.figure(figsize=(10, 8), dpi=100)
     plt.xlabel("trajectory frames")
@@ -139,24 +294,147 @@ def sel_from_cluster(cvs, threshold, task_path, angular_mask=None, weights=None,
     plt.title("cluster distributions along trajectories")
     plt.scatter(xlist, labels, s = 5)
     plt.savefig(task_path.joinpath(cluster_fig))
-    # make cluster map
-    _cls_map = []
-    for _ in range(len(set(labels))):
-        _cls_map.append([])
-    for idx, label in enumerate(labels):
-        _cls_map[label].append(idx)
-    cls_map = []
-    for clust in _cls_map:
-        cls_map.append((clust, len(clust)))
-    cls_map = sorted(cls_map, key=lambda x: x[1], reverse=True)
-    # randomly select from clusters
-    cls_sel = []
-    np.random.seed(seed=None)
-    for cluster, _ in cls_map:
-        # _ret = np.random.choice(cluster, 1)
-        _ret = chooseClusterCenter(dist, cluster)
-        cls_sel.append(_ret[0])
+    plt.close()
+
+
+def order_cluster_centers(centers, labels, max_selection):
+    """Centers of larger clusters first. Clusters of equal size are ordered by their first frame
+    in the trajectory, so the order, and what is kept within `max_selection`, does not depend on
+    how the clustering numbers its labels."""
+    labels = np.asarray(labels, dtype=int)
+    sizes = np.bincount(labels, minlength=len(centers))
+    first_frames = np.full(len(centers), len(labels))
+    np.minimum.at(first_frames, labels, np.arange(len(labels)))
+    cls_sel = np.asarray(centers, dtype=int)[np.lexsort((first_frames, -sizes))]
     if len(cls_sel) > max_selection:
         cls_sel = cls_sel[:max_selection]
         logger.info("selection number is beyond max selection, adjust to the max number.")
-    return np.array(cls_sel, dtype=int)
+    return cls_sel
+
+
+def sel_from_cluster(
+        cvs, threshold, task_path, angular_mask=None, weights=None, max_selection=1000, 
+        dist=None, tree=None, center_mode="medoid"
+    ):
+    if len(cvs) <= 1:
+        return cvs
+    weights = np.array(weights)
+    if dist is None:
+        dist = mk_dist(cvs, angular_mask, weights)
+    if tree is None:
+        tree = mk_linkage(dist)
+    labels = cut_linkage(tree, threshold)
+    # plot clustering distributions
+    plot_cluster(labels, task_path)
+    # choose one representative frame of each cluster
+    if center_mode == "medoid":
+        centers = choose_cluster_medoids(dist, labels)
+    elif center_mode == "centroid":
+        centers = choose_cluster_centroids(cvs, labels, angular_mask, weights)
+    else:
+        raise ValueError(f"Unknown center mode {center_mode}, only support `medoid` and `centroid`.")
+    return order_cluster_centers(centers, labels, max_selection)
+
+
+def kcenter_greedy(cvs, numb_centers, angular_mask=None, weights=None, start=0, radius=0., return_radius=False):
+    """Greedy farthest point sampling in CV space.
+
+    Starting from frame `start`, repeatedly pick the frame farthest from all frames picked so far,
+    until `numb_centers` frames are picked or every frame is within `radius` of a picked one.
+    Costs `O(nframe * numb_centers)` distance evaluations. Returns the indices of picked frames in
+    picking order and, if `return_radius`, the covering radius after each pick.
+    """
+    cvs = np.asarray(cvs)
+    nframe = cvs.shape[0]
+    numb_centers = min(numb_centers, nframe)
+    centers = [start]
+    min_dist = mk_pair_dist(cvs[[start]], cvs, angular_mask, weights)[0]
+    next_center = int(np.argmax(min_dist))
+    radii = [min_dist[next_center]]
+    while len(centers) < numb_centers and radii[-1] > radius:
+        centers.append(next_center)
+        np.minimum(min_dist, mk_pair_dist(cvs[[next_center]], cvs, angular_mask, weights)[0], out=min_dist)
+        next_center = int(np.argmax(min_dist))
+        radii.append(min_dist[next_center])
+    centers = np.array(centers, dtype=int)
+    if return_radius:
+        return centers, np.array(radii)
+    return centers
+
+
+def sel_from_kcenter(
+        cvs, threshold, task_path, angular_mask=None, weights=None, max_selection=1000, chunk_size=2000
+    ):
+    """Select frames by k-center greedy instead of clustering.
+
+    At most `max_selection` frames are picked, fewer if all frames are already within `threshold` of a
+    picked one. Selected frames are spread evenly in CV space and returned in picking order. Frames are
+    assigned to their nearest picked frame only to plot the cluster distribution.
+    """
+    cvs = np.asarray(cvs)
+    if len(cvs) <= 1:
+        return np.arange(len(cvs), dtype=int)
+    cls_sel = kcenter_greedy(cvs, max_selection, angular_mask=angular_mask, weights=weights, radius=threshold)
+    logger.info(f"select {len(cls_sel)} frames by k-center greedy with radius {threshold}.")
+    labels = assign_to_landmarks(
+        cvs, cvs[cls_sel], np.arange(len(cls_sel)), angular_mask, weights, chunk_size=chunk_size)
+    plot_cluster(labels, task_path)
+    return cls_sel
+
+
+def select_landmarks(cvs, numb_landmarks, angular_mask=None, weights=None, landmark_mode="kcenter"):
+    nframe = len(cvs)
+    if numb_landmarks >= nframe:
+        return np.arange(nframe, dtype=int)
+    if landmark_mode == "stride":
+        return np.unique(np.linspace(0, nframe - 1, numb_landmarks).astype(int))
+    elif landmark_mode == "kcenter":
+        return np.sort(kcenter_greedy(cvs, numb_landmarks, angular_mask, weights))
+    else:
+        raise ValueError(f"Unknown landmark mode {landmark_mode}, only support `stride` and `kcenter`.")
+
+
+def assign_to_landmarks(cvs, landmark_cvs, landmark_labels, angular_mask=None, weights=None, chunk_size=2000):
+    """Give every frame the cluster label of its nearest landmark. Frames are processed in chunks
+    of `chunk_size`, so the memory is bounded by `chunk_size * len(landmark_cvs)`."""
+    nframe = len(cvs)
+    labels = np.zeros(nframe, dtype=int)
+    for start in range(0, nframe, chunk_size):
+        end = min(start + chunk_size, nframe)
+        dist = mk_pair_dist(cvs[start:end], landmark_cvs, angular_mask, weights)
+        labels[start:end] = landmark_labels[np.argmin(dist, axis=1)]
+    return labels
+
+
+def sel_from_landmarks(
+        cvs, threshold, task_path, landmark_idx, angular_mask=None, weights=None, max_selection=1000,
+        dist=None, tree=None, chunk_size=2000, center_mode="medoid"
+    ):
+    """Landmark version of `sel_from_cluster` for long trajectories.
+
+    Only the frames in `landmark_idx` are clustered (`dist` and `tree` refer to landmarks), the other
+    frames are assigned to the cluster of their nearest landmark. Medoids are chosen among the landmarks
+    of each cluster, centroids among all frames. Representatives are returned as frame indices of `cvs`,
+    ordered by full cluster sizes.
+    """
+    cvs = np.asarray(cvs)
+    landmark_idx = np.asarray(landmark_idx, dtype=int)
+    if len(landmark_idx) <= 1:
+        return landmark_idx
+    weights = np.array(weights)
+    landmark_cvs = cvs[landmark_idx]
+    if dist is None:
+        dist = mk_dist(landmark_cvs, angular_mask, weights)
+    if tree is None:
+        tree = mk_linkage(dist)
+    landmark_labels = cut_linkage(tree, threshold)
+    logger.info(f"assigning {len(cvs)} frames to {len(landmark_idx)} landmarks ...")
+    labels = assign_to_landmarks(cvs, landmark_cvs, landmark_labels, angular_mask, weights, chunk_size=chunk_size)
+    plot_cluster(labels, task_path)
+    if center_mode == "medoid":
+        centers = landmark_idx[choose_cluster_medoids(dist, landmark_labels)]
+    elif center_mode == "centroid":
+        centers = choose_cluster_centroids(cvs, labels, angular_mask, weights)
+    else:
+        raise ValueError(f"Unknown center mode {center_mode}, only support `medoid` and `centroid`.")
+    return order_cluster_centers(centers, labels, max_selection)
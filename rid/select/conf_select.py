@@ -1,7 +1,8 @@
 import os, sys
 import numpy as np
 import logging
-from typing import List, Union, Sequence
+from typing import List, Optional, Union, Sequence
+from scipy.spatial import cKDTree
 from rid.select.model_devi import make_std
 from rid.constants import sel_gro_name
 import mdtraj as md
@@ -45,3 +46,48 @@ def select_from_devi(model_devi, threshold):
         np.max(model_devi), np.min(model_devi), np.average(model_devi)))
     logger.info("number of angles than %f is %d" % (threshold, len(selected_idx)))
     return selected_idx
+
+
+class PeriodicCVIndex:
+
+    """KD-tree index of CV points, e.g. CVs of labeled training data.
+
+    Distances are the weighted Euclidean distances of `cv_dist`. Periodic components (`angular_mask == 1`) 
+    are wrapped into a box of length `2 * pi * weight`, where the KD-tree applies the minimum image convention.
+    """
+
+    def __init__(
+            self,
+            cvs: Union[np.ndarray, List],
+            angular_mask: Optional[Union[np.ndarray, List]] = None,
+            weights: Optional[Union[np.ndarray, List]] = None
+        ):
+        cvs = np.asarray(cvs, dtype=float)
+        ncv = cvs.shape[1]
+        if angular_mask is None:
+            angular_mask = np.zeros(ncv)
+        if weights is None:
+            weights = np.ones(ncv)
+        self.angular_mask = (np.asarray(angular_mask) == 1)
+        self.weights = np.abs(np.asarray(weights, dtype=float))
+        # box size 0 disables periodicity of the component
+        self.boxsize = np.where(self.angular_mask, 2 * np.pi * self.weights, 0.)
+        self.tree = cKDTree(self._transform(cvs), boxsize=self.boxsize)
+
+    def _transform(self, cvs):
+        scaled = np.asarray(cvs, dtype=float) * self.weights
+        periodic = self.boxsize > 0
+        scaled[:, periodic] = np.mod(scaled[:, periodic], self.boxsize[periodic])
+        # np.mod may round up to exactly the box size
+        scaled[:, periodic] = np.where(scaled[:, periodic] >= self.boxsize[periodic], 0., scaled[:, periodic])
+        return scaled
+
+    def nearest_distance(self, cvs):
+        dist, _ = self.tree.query(self._transform(cvs), k=1)
+        return dist
+
+    def select_novel(self, cvs, radius):
+        """Indices of `cvs` whose nearest indexed point is not closer than `radius`."""
+        if len(cvs) == 0:
+            return np.array([], dtype=int)
+        return np.flatnonzero(self.nearest_distance(cvs) >= radius)
@@ -5,14 +5,18 @@ import os
 import sys
 import argparse
 import logging
+import hashlib
 import numpy as np
+from collections import OrderedDict
 from typing import Union, List
 try:
     import tensorflow.compat.v1 as tf
     tf.disable_v2_behavior()
 except ImportError:
     import tensorflow as tf
-from rid.common.tensorflow.graph import load_graph
+from rid.common.tensorflow.graph import load_ensemble_graph
+from rid.nn.numpy_model import NumpyModel
+from rid.select.model_server import query_server
 from rid.constants import kbT, beta, f_cvt
 
 
@@ -24,6 +28,48 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# max number of warm sessions kept by `load_session`
+model_cache_size = int(os.environ.get("RID_MODEL_CACHE_SIZE", 8))
+_session_cache = OrderedDict()
+# number of frames evaluated at once by `make_std`
+model_devi_chunk_size = int(os.environ.get("RID_MODEL_DEVI_CHUNK_SIZE", 10000))
+
+
+def load_session(models):
+    """Return a session of the frozen graph(s) `models` fused into one ensemble graph by
+    `load_ensemble_graph`, reusing the cached one when the files are unchanged.
+
+    Sessions are kept in a process-level LRU cache keyed by the absolute model paths and the
+    sha1 of their contents, so a model overwritten in place is reloaded.
+    """
+    if isinstance(models, (str, os.PathLike)):
+        models = [models]
+    key, contents = [], []
+    for model in models:
+        model = os.path.abspath(str(model))
+        with open(model, "rb") as f:
+            content = f.read()
+        key.append((model, hashlib.sha1(content).hexdigest()))
+        contents.append(content)
+    key = tuple(key)
+    if key in _session_cache:
+        _session_cache.move_to_end(key)
+        return _session_cache[key]
+    graph = load_ensemble_graph(contents)
+    sess = tf.Session(graph=graph)
+    _session_cache[key] = sess
+    while len(_session_cache) > model_cache_size:
+        _, old_sess = _session_cache.popitem(last=False)
+        old_sess.close()
+    return sess
+
+
+def clear_model_cache():
+    """Close and drop all cached sessions."""
+    while _session_cache:
+        _, sess = _session_cache.popitem()
+        sess.close()
+
 
 def test_ef(sess, data_in):
     graph = sess.graph
@@ -41,29 +87,138 @@ def test_ef(sess, data_in):
     return data_ret[0], data_ret[1]
 
 
+def test_ef_ensemble(sess, data_in, buffer=None):
+    """Energies and forces of every member of an ensemble session from `load_session`,
+    with shapes `[n_models, n_frames]` and `[n_models, n_frames, cv_dim]`.
+
+    If given, `buffer` is a zero-initialized `[n, 2 * cv_dim]` array (n >= n_frames) reused
+    as network inputs instead of allocating a padded copy of `data_in`.
+    """
+    graph = sess.graph
+
+    inputs = graph.get_tensor_by_name('load/inputs:0')
+    o_energy_all = graph.get_tensor_by_name('load/o_energy_all:0')
+    o_forces_all = graph.get_tensor_by_name('load/o_forces_all:0')
+    drop_out_rate = graph.get_tensor_by_name('load/drop_out_rate:0')
+
+    if buffer is None:
+        zero4 = np.zeros([data_in.shape[0], data_in.shape[1]])
+        data_inputs = np.concatenate((data_in, zero4), axis=1)
+    else:
+        data_inputs = buffer[:data_in.shape[0]]
+        data_inputs[:, :data_in.shape[1]] = data_in
+    feed_dict_test = {inputs: data_inputs, drop_out_rate: 0.0}
+
+    data_ret = sess.run([o_energy_all, o_forces_all], feed_dict=feed_dict_test)
+    return data_ret[0], data_ret[1]
+
+
 def compute_std(forces):
     stds = np.mean( np.std(forces, axis=0) ** 2, axis=-1 ) ** 0.5
     return stds
 
 
+def models_hash(models):
+    """sha1 of the contents of a model set, independent of where the files are."""
+    digest = hashlib.sha1()
+    for model in models:
+        with open(str(model), "rb") as f:
+            digest.update(hashlib.sha1(f.read()).digest())
+    return digest.hexdigest()
+
+
+class DeviCache(object):
+    """Model deviations keyed by the hash of the model set and of each CV row.
+
+    The cache is stored as a small `.npz` sidecar (see `model_devi_cache_name`) so that
+    later steps evaluating the same frames with the same models reuse the values.
+    """
+    def __init__(self, models):
+        self.models_key = models_hash(models)
+        self.values = {}
+
+    @staticmethod
+    def row_keys(data):
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        return [hashlib.blake2b(row.tobytes(), digest_size=16).digest() for row in data]
+
+    @classmethod
+    def load(cls, files, models):
+        """Merge the sidecars in `files` computed with the same `models`, others are ignored."""
+        cache = cls(models)
+        for file in files:
+            if file is None or not os.path.isfile(file):
+                continue
+            with np.load(file) as sidecar:
+                if str(sidecar["models"]) != cache.models_key:
+                    continue
+                cache.values.update(zip(sidecar["keys"].tolist(), sidecar["stds"].tolist()))
+        return cache
+
+    def save(self, file):
+        with open(file, "wb") as f:
+            np.savez(
+                f,
+                models=self.models_key,
+                keys=np.array(list(self.values.keys()), dtype="S16"),
+                stds=np.array(list(self.values.values()), dtype=np.float64)
+            )
+
+    def lookup(self, keys):
+        return np.array([self.values.get(key, np.nan) for key in keys], dtype=np.float64)
+
+    def update(self, keys, stds):
+        self.values.update(zip(keys, np.asarray(stds, dtype=np.float64).tolist()))
+
+
 def make_std(
         data: Union[List, np.ndarray], 
-        models: List = ["graph.000.pb"]
+        models: List = ["graph.000.pb"],
+        cache: DeviCache = None,
+        chunk_size: int = None
         # threshold: float = 1.0
     ):
-
+    """Model deviations (force std over the ensemble) of CV frames `data`.
+
+    Frames are evaluated `chunk_size` (`model_devi_chunk_size` by default) at a time through
+    reused float32 input buffers, so the extra memory does not grow with the number of frames.
+    """
+    data = np.asarray(data)
+    if cache is not None:
+        keys = DeviCache.row_keys(data)
+        stds = cache.lookup(keys)
+        miss = np.isnan(stds)
+        logger.debug(f"model deviation cache hit {np.sum(~miss)} of {len(stds)} frames.")
+        if np.any(miss):
+            stds[miss] = make_std(data[miss], models, chunk_size=chunk_size)
+            cache.update([key for key, mm in zip(keys, miss) if mm], stds[miss])
+        return stds
+
+    if chunk_size is None:
+        chunk_size = model_devi_chunk_size
     nframes = data.shape[0]
-
-    forces = []
-    for model in models:
-        graph = load_graph(str(model))
-        with tf.Session(graph=graph) as sess:
-            _, force = test_ef(sess, data)
-            forces = np.append(forces, force)
-
-    forces = np.reshape(forces, [len(models), nframes, -1])
-    forces *= f_cvt
-
-    avg_std = compute_std(forces)
-    return avg_std
-
+    stds = np.empty(nframes)
+    if nframes == 0:
+        return stds
+    if all(str(model).endswith(".npz") for model in models):
+        # weights exported by `rid.nn.numpy_model`, no TensorFlow session needed
+        np_models = [NumpyModel.load(model) for model in models]
+        def ensemble_forces(chunk):
+            return np.stack([model.evaluate(chunk)[1] for model in np_models])
+    else:
+        sess = None
+        buffer = np.zeros([min(chunk_size, nframes), 2 * data.shape[1]], dtype=np.float32)
+        def ensemble_forces(chunk):
+            nonlocal sess
+            if sess is None:
+                # use the model server of this pod if one is running
+                ret = query_server(models, chunk)
+                if ret is not None:
+                    return ret[1]
+                sess = load_session(models)
+            return test_ef_ensemble(sess, chunk, buffer=buffer)[1]
+
+    for start in range(0, nframes, chunk_size):
+        forces = ensemble_forces(data[start:start+chunk_size])
+        stds[start:start+chunk_size] = compute_std(forces * f_cvt)
+    return stds
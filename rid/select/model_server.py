@@ -0,0 +1,196 @@
+import os
+import sys
+import queue
+import argparse
+import logging
+import secrets
+import threading
+import numpy as np
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+
+logging.basicConfig(
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+    level=os.environ.get("LOGLEVEL", "INFO").upper(),
+    stream=sys.stdout,
+)
+logger = logging.getLogger(__name__)
+
+# path of the Unix socket of a running `ModelServer`
+server_env = "RID_MODEL_SERVER"
+# hex secret shared by the server and its clients, see `new_server_key`
+server_key_env = "RID_MODEL_SERVER_KEY"
+
+
+def new_server_key():
+    return secrets.token_hex(32)
+
+
+def get_server_key():
+    """Authentication key from `$RID_MODEL_SERVER_KEY`, None if it is not set."""
+    key = os.environ.get(server_key_env)
+    if not key:
+        return None
+    return bytes.fromhex(key)
+
+
+class ModelServer(object):
+    """Long-lived process serving ensemble energies/forces over a Unix socket.
+
+    Ensembles are loaded once through `load_session` and kept warm. Requests of
+    concurrent callers for the same ensemble are concatenated and evaluated in
+    one `sess.run` (micro-batching), results are split back to the callers.
+
+    Messages are pickled, so only clients holding `authkey` (by default the key in
+    `$RID_MODEL_SERVER_KEY`) are accepted, and the socket is readable and writable by
+    its owner only.
+    """
+    def __init__(self, address, authkey=None, max_batch_frames=100000):
+        if authkey is None:
+            authkey = get_server_key()
+        if authkey is None:
+            raise RuntimeError(f"the model server needs an authentication key, set ${server_key_env}.")
+        self.address = address
+        self.authkey = authkey
+        self.max_batch_frames = max_batch_frames
+        self.requests = queue.Queue()
+        self.ready = threading.Event()
+        self._listener = None
+        self._closed = False
+
+    def serve(self):
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        from rid.select.model_devi import load_session, test_ef_ensemble
+        worker = threading.Thread(target=self._evaluate_loop, args=(load_session, test_ef_ensemble), daemon=True)
+        worker.start()
+        # create the socket as 0600
+        umask = os.umask(0o177)
+        try:
+            self._listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        with self._listener as listener:
+            logger.info(f"model server listening on {self.address}")
+            self.ready.set()
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, EOFError, OSError) as err:
+                    if self._closed:
+                        return
+                    logger.warning(f"model server rejected a client: {err!r}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def close(self):
+        self._closed = True
+        if self._listener is not None:
+            self._listener.close()
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except EOFError:
+                    return
+                done = threading.Event()
+                item = {"request": request, "done": done}
+                self.requests.put(item)
+                done.wait()
+                conn.send(item["reply"])
+
+    def _evaluate_loop(self, load_session, test_ef_ensemble):
+        while True:
+            items = [self.requests.get()]
+            # gather the requests queued meanwhile
+            while True:
+                try:
+                    items.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            batches = {}
+            for item in items:
+                key = tuple(str(model) for model in item["request"]["models"])
+                batches.setdefault(key, []).append(item)
+            for models, group in batches.items():
+                start = 0
+                while start < len(group):
+                    # split groups exceeding max_batch_frames
+                    end, nframes = start, 0
+                    while end < len(group) and (end == start or nframes + len(group[end]["request"]["data"]) <= self.max_batch_frames):
+                        nframes += len(group[end]["request"]["data"])
+                        end += 1
+                    chunk = group[start:end]
+                    try:
+                        sess = load_session(list(models))
+                        data = np.concatenate([item["request"]["data"] for item in chunk], axis=0)
+                        energies, forces = test_ef_ensemble(sess, data)
+                        offset = 0
+                        for item in chunk:
+                            size = len(item["request"]["data"])
+                            item["reply"] = {"energy": energies[:, offset:offset+size], "forces": forces[:, offset:offset+size]}
+                            offset += size
+                    except Exception as err:
+                        for item in chunk:
+                            item["reply"] = {"error": repr(err)}
+                    for item in chunk:
+                        item["done"].set()
+                    start = end
+
+
+# one connection per thread, so concurrent callers are batched by the server
+_clients = threading.local()
+
+
+def query_server(models, data):
+    """Energies and forces of every ensemble member from the server at `$RID_MODEL_SERVER`.
+
+    Returns None if no server is available or it does not accept the key in
+    `$RID_MODEL_SERVER_KEY`, so callers can fall back to local inference.
+    """
+    address = os.environ.get(server_env)
+    if not address or not os.path.exists(address):
+        return None
+    authkey = get_server_key()
+    if authkey is None:
+        logger.warning(f"${server_key_env} is not set, use local inference.")
+        return None
+    models = [os.path.abspath(str(model)) for model in models]
+    for _ in range(2):
+        try:
+            if getattr(_clients, "target", None) != (address, authkey):
+                if getattr(_clients, "conn", None) is not None:
+                    _clients.conn.close()
+                    _clients.conn = None
+                _clients.conn = Client(address, family="AF_UNIX", authkey=authkey)
+                _clients.target = (address, authkey)
+            _clients.conn.send({"models": models, "data": np.asarray(data)})
+            reply = _clients.conn.recv()
+            break
+        except AuthenticationError:
+            _clients.target = None
+            logger.warning(f"model server {address} rejected the key, use local inference.")
+            return None
+        except (OSError, EOFError):
+            # stale connection, retry once with a new one
+            _clients.target = None
+    else:
+        logger.warning(f"model server {address} is not reachable, use local inference.")
+        return None
+    if "error" in reply:
+        raise RuntimeError(f"model server failed: {reply['error']}")
+    return reply["energy"], reply["forces"]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=f"Serve model ensembles to the ops sharing ${server_env} and ${server_key_env}.")
+    parser.add_argument("-s", "--socket", type=str, default=os.environ.get(server_env, "rid_model_server.sock"),
+                        help="path of the Unix socket to listen on")
+    args = parser.parse_args()
+
+    ModelServer(args.socket).serve()
@@ -44,7 +44,9 @@ class InitBlock(Steps):
         train_config: Dict,
         model_devi_config: Dict,
         upload_python_package = None,
-        retry_times = None
+        retry_times = None,
+        ensemble_train = False,
+        distill_op: OP = None
     ):
 
         self._input_parameters = {
@@ -61,6 +63,8 @@ class InitBlock(Steps):
             "numb_cluster_upper": InputParameter(type=float),
             "numb_cluster_lower": InputParameter(type=float),
             "max_selection": InputParameter(type=int),
+            "cluster_config": InputParameter(type=Dict, value={}),
+            "dedup_radius": InputParameter(type=Optional[float], value=None),
             "std_threshold": InputParameter(type=float, value=5.0),
             "dt": InputParameter(type=float, value=0.02),
             "output_freq": InputParameter(type=float, value=2500),
@@ -72,6 +76,7 @@ class InitBlock(Steps):
         }        
         self._input_artifacts = {
             "models" : InputArtifact(optional=True),
+            "bias_models" : InputArtifact(optional=True),
             "forcefield" : InputArtifact(optional=True),
             "topology" : InputArtifact(optional=True),
             "inputfile": InputArtifact(optional=True),
@@ -92,6 +97,8 @@ class InitBlock(Steps):
             "data": OutputArtifact(),
             "conf_outs": OutputArtifact()
         }
+        if distill_op is not None:
+            self._output_artifacts["bias_models"] = OutputArtifact()
 
         super().__init__(        
                 name=name,
@@ -115,7 +122,9 @@ class InitBlock(Steps):
             train_config,
             model_devi_config,
             upload_python_package = upload_python_package,
-            retry_times = retry_times
+            retry_times = retry_times,
+            ensemble_train = ensemble_train,
+            distill_op = distill_op
         )            
     
     @property
@@ -150,7 +159,9 @@ def _first_run_block(
         train_config : Dict,
         model_devi_config: Dict,
         upload_python_package : str = None,
-        retry_times: int = None
+        retry_times: int = None,
+        ensemble_train: bool = False,
+        distill_op: OP = None
     ):
     exploration = Step(
         "Exploration",
@@ -165,6 +176,7 @@ def _first_run_block(
         },
         artifacts={
             "models" : block_steps.inputs.artifacts['models'],
+            "bias_models" : block_steps.inputs.artifacts['bias_models'],
             "forcefield" : block_steps.inputs.artifacts['forcefield'],
             "topology" : block_steps.inputs.artifacts['topology'],
             "inputfile": block_steps.inputs.artifacts['inputfile'],
@@ -190,6 +202,8 @@ def _first_run_block(
             "numb_cluster_upper": block_steps.inputs.parameters["numb_cluster_upper"],
             "numb_cluster_lower": block_steps.inputs.parameters["numb_cluster_lower"],
             "max_selection": block_steps.inputs.parameters["max_selection"],
+            "cluster_config": block_steps.inputs.parameters["cluster_config"],
+            "dedup_radius": block_steps.inputs.parameters["dedup_radius"],
             "dt": block_steps.inputs.parameters["dt"],
             "output_freq": block_steps.inputs.parameters["output_freq"],
             "slice_mode": block_steps.inputs.parameters["slice_mode"],
@@ -202,7 +216,9 @@ def _first_run_block(
             "models" : block_steps.inputs.artifacts["models"],
             "plm_out": exploration.outputs.artifacts["plm_out"],
             "xtc_traj": exploration.outputs.artifacts["trajectory"],
-            "topology": block_steps.inputs.artifacts["confs"]
+            "topology": block_steps.inputs.artifacts["confs"],
+            "data_old": block_steps.inputs.artifacts["data_old"],
+            "model_devi_cache": exploration.outputs.artifacts["model_devi_cache"]
         },
         key = '{}-selection'.format(block_steps.inputs.parameters['block_tag']),
     )
@@ -248,31 +264,72 @@ def _first_run_block(
     train_config = deepcopy(train_config)
     train_template_config = train_config.pop('template_config')
     train_executor = init_executor(train_config.pop('executor'))
-    train = Step(
-        "train",
-        template=PythonOPTemplate(
-            train_op,
-            python_packages = upload_python_package,
-            retry_on_transient_error = retry_times,
-            slices=Slices("{{item}}",
-                input_parameter=["model_tag"],
-                output_artifact=["model","train_fig"]),
-            **train_template_config,
-        ),
-        parameters={
-            "model_tag": block_steps.inputs.parameters["model_tags"],
-            "angular_mask": block_steps.inputs.parameters["angular_mask"],
-            "train_config": block_steps.inputs.parameters["train_config"],
-        },
-        artifacts={
-            "data": gen_data.outputs.artifacts["data"],
-        },
-        executor = train_executor,
-        with_param=argo_range(argo_len(block_steps.inputs.parameters["model_tags"])),
-        key = "{}-train".format(block_steps.inputs.parameters["block_tag"])+"-{{item}}",
-        **train_config,
-    )
+    if ensemble_train:
+        # all models are trained together in one step
+        train = Step(
+            "train",
+            template=PythonOPTemplate(
+                train_op,
+                python_packages = upload_python_package,
+                retry_on_transient_error = retry_times,
+                **train_template_config,
+            ),
+            parameters={
+                "model_tag": block_steps.inputs.parameters["model_tags"],
+                "angular_mask": block_steps.inputs.parameters["angular_mask"],
+                "train_config": block_steps.inputs.parameters["train_config"],
+            },
+            artifacts={
+                "data": gen_data.outputs.artifacts["data"],
+                "data_new": gen_data.outputs.artifacts["data_new"],
+                "data_old": block_steps.inputs.artifacts["data_old"],
+                "init_models": block_steps.inputs.artifacts["models"],
+            },
+            executor = train_executor,
+            key = "{}-train".format(block_steps.inputs.parameters["block_tag"]),
+            **train_config,
+        )
+    else:
+        train = Step(
+            "train",
+            template=PythonOPTemplate(
+                train_op,
+                python_packages = upload_python_package,
+                retry_on_transient_error = retry_times,
+                slices=Slices("{{item}}",
+                    input_parameter=["model_tag"],
+                    output_artifact=["model","train_fig"]),
+                **train_template_config,
+            ),
+            parameters={
+                "model_tag": block_steps.inputs.parameters["model_tags"],
+                "angular_mask": block_steps.inputs.parameters["angular_mask"],
+                "train_config": block_steps.inputs.parameters["train_config"],
+            },
+            artifacts={
+                "data": gen_data.outputs.artifacts["data"],
+                "data_new": gen_data.outputs.artifacts["data_new"],
+                "data_old": block_steps.inputs.artifacts["data_old"],
+                "init_models": block_steps.inputs.artifacts["models"],
+            },
+            executor = train_executor,
+            with_param=argo_range(argo_len(block_steps.inputs.parameters["model_tags"])),
+            key = "{}-train".format(block_steps.inputs.parameters["block_tag"])+"-{{item}}",
+            **train_config,
+        )
     block_steps.add(train)
+
+    if distill_op is not None:
+        distill = _distill_step(
+            block_steps, distill_op, train, gen_data, exploration,
+            block_steps.inputs.parameters["trust_lvl_1"],
+            block_steps.inputs.parameters["trust_lvl_2"],
+            train_template_config, train_executor, train_config,
+            upload_python_package = upload_python_package,
+            retry_times = retry_times
+        )
+        block_steps.add(distill)
+        block_steps.outputs.artifacts["bias_models"]._from = distill.outputs.artifacts["model"]
     
     model_devi_config = deepcopy(model_devi_config)
     model_devi_template_config = model_devi_config.pop('template_config')
@@ -336,7 +393,9 @@ class IterBlock(Steps):
         train_config: Dict,
         model_devi_config: Dict,
         upload_python_package = None,
-        retry_times = None
+        retry_times = None,
+        ensemble_train = False,
+        distill_op: OP = None
     ):
 
         self._input_parameters = {
@@ -353,6 +412,8 @@ class IterBlock(Steps):
             "angular_mask": InputParameter(type=Optional[Union[np.ndarray, List]]),
             "weights": InputParameter(type=Optional[Union[np.ndarray, List]]),
             "max_selection": InputParameter(type=int),
+            "cluster_config": InputParameter(type=Dict, value={}),
+            "dedup_radius": InputParameter(type=Optional[float], value=None),
             "numb_cluster_threshold": InputParameter(type=float, value=30),
             "std_threshold": InputParameter(type=float, value=5.0),
             "dt": InputParameter(type=float, value=0.02),
@@ -367,6 +428,7 @@ class IterBlock(Steps):
         }        
         self._input_artifacts = {
             "models" : InputArtifact(optional=True),
+            "bias_models" : InputArtifact(optional=True),
             "forcefield" : InputArtifact(optional=True),
             "topology" : InputArtifact(optional=True),
             "inputfile": InputArtifact(optional=True),
@@ -389,6 +451,8 @@ class IterBlock(Steps):
             "data": OutputArtifact(),
             "conf_outs": OutputArtifact()
         }
+        if distill_op is not None:
+            self._output_artifacts["bias_models"] = OutputArtifact()
 
         super().__init__(        
                 name=name,
@@ -415,7 +479,9 @@ class IterBlock(Steps):
             train_config,
             model_devi_config,
             upload_python_package = upload_python_package,
-            retry_times = retry_times
+            retry_times = retry_times,
+            ensemble_train = ensemble_train,
+            distill_op = distill_op
         )            
     
     @property
@@ -452,7 +518,9 @@ def _iter_block(
         train_config : Dict,
         model_devi_config: Dict,
         upload_python_package : str = None,
-        retry_times: int = None
+        retry_times: int = None,
+        ensemble_train: bool = False,
+        distill_op: OP = None
     ):
 
     exploration = Step(
@@ -468,6 +536,7 @@ def _iter_block(
         },
         artifacts={
             "models" : block_steps.inputs.artifacts['models'],
+            "bias_models" : block_steps.inputs.artifacts['bias_models'],
             "forcefield" : block_steps.inputs.artifacts['forcefield'],
             "topology" : block_steps.inputs.artifacts['topology'],
             "inputfile": block_steps.inputs.artifacts['inputfile'],
@@ -491,6 +560,8 @@ def _iter_block(
             "angular_mask": block_steps.inputs.parameters["angular_mask"],
             "weights": block_steps.inputs.parameters["weights"],
             "max_selection": block_steps.inputs.parameters["max_selection"],
+            "cluster_config": block_steps.inputs.parameters["cluster_config"],
+            "dedup_radius": block_steps.inputs.parameters["dedup_radius"],
             "dt": block_steps.inputs.parameters["dt"],
             "output_freq": block_steps.inputs.parameters["output_freq"],
             "slice_mode": block_steps.inputs.parameters["slice_mode"],
@@ -503,7 +574,9 @@ def _iter_block(
             "models" : block_steps.inputs.artifacts["models"],
             "plm_out": exploration.outputs.artifacts["plm_out"],
             "xtc_traj": exploration.outputs.artifacts["trajectory"],
-            "topology": block_steps.inputs.artifacts["confs"]
+            "topology": block_steps.inputs.artifacts["confs"],
+            "data_old": block_steps.inputs.artifacts["data_old"],
+            "model_devi_cache": exploration.outputs.artifacts["model_devi_cache"]
         },
         key = '{}-selection'.format(block_steps.inputs.parameters['block_tag']),
     )
@@ -583,31 +656,72 @@ def _iter_block(
     train_config = deepcopy(train_config)
     train_template_config = train_config.pop('template_config')
     train_executor = init_executor(train_config.pop('executor'))
-    train = Step(
-        "train",
-        template=PythonOPTemplate(
-            train_op,
-            python_packages = upload_python_package,
-            retry_on_transient_error = retry_times,
-            slices=Slices("{{item}}",
-                input_parameter=["model_tag"],
-                output_artifact=["model","train_fig"]),
-            **train_template_config,
-        ),
-        parameters={
-            "model_tag": block_steps.inputs.parameters["model_tags"],
-            "angular_mask": block_steps.inputs.parameters["angular_mask"],
-            "train_config": block_steps.inputs.parameters["train_config"],
-        },
-        artifacts={
-            "data": gen_data.outputs.artifacts["data"],
-        },
-        executor = train_executor,
-        with_param=argo_range(argo_len(block_steps.inputs.parameters["model_tags"])),
-        key = "{}-train".format(block_steps.inputs.parameters["block_tag"])+"-{{item}}",
-        **train_config,
-    )
+    if ensemble_train:
+        # all models are trained together in one step
+        train = Step(
+            "train",
+            template=PythonOPTemplate(
+                train_op,
+                python_packages = upload_python_package,
+                retry_on_transient_error = retry_times,
+                **train_template_config,
+            ),
+            parameters={
+                "model_tag": block_steps.inputs.parameters["model_tags"],
+                "angular_mask": block_steps.inputs.parameters["angular_mask"],
+                "train_config": block_steps.inputs.parameters["train_config"],
+            },
+            artifacts={
+                "data": gen_data.outputs.artifacts["data"],
+                "data_new": gen_data.outputs.artifacts["data_new"],
+                "data_old": block_steps.inputs.artifacts["data_old"],
+                "init_models": block_steps.inputs.artifacts["models"],
+            },
+            executor = train_executor,
+            key = "{}-train".format(block_steps.inputs.parameters["block_tag"]),
+            **train_config,
+        )
+    else:
+        train = Step(
+            "train",
+            template=PythonOPTemplate(
+                train_op,
+                python_packages = upload_python_package,
+                retry_on_transient_error = retry_times,
+                slices=Slices("{{item}}",
+                    input_parameter=["model_tag"],
+                    output_artifact=["model","train_fig"]),
+                **train_template_config,
+            ),
+            parameters={
+                "model_tag": block_steps.inputs.parameters["model_tags"],
+                "angular_mask": block_steps.inputs.parameters["angular_mask"],
+                "train_config": block_steps.inputs.parameters["train_config"],
+            },
+            artifacts={
+                "data": gen_data.outputs.artifacts["data"],
+                "data_new": gen_data.outputs.artifacts["data_new"],
+                "data_old": block_steps.inputs.artifacts["data_old"],
+                "init_models": block_steps.inputs.artifacts["models"],
+            },
+            executor = train_executor,
+            with_param=argo_range(argo_len(block_steps.inputs.parameters["model_tags"])),
+            key = "{}-train".format(block_steps.inputs.parameters["block_tag"])+"-{{item}}",
+            **train_config,
+        )
     block_steps.add(train)
+
+    if distill_op is not None:
+        distill = _distill_step(
+            block_steps, distill_op, train, gen_data, exploration,
+            adjust_lvl.outputs.parameters["adjust_trust_lvl_1"],
+            adjust_lvl.outputs.parameters["adjust_trust_lvl_2"],
+            train_template_config, train_executor, train_config,
+            upload_python_package = upload_python_package,
+            retry_times = retry_times
+        )
+        block_steps.add(distill)
+        block_steps.outputs.artifacts["bias_models"]._from = distill.outputs.artifacts["model"]
     
     model_devi_config = deepcopy(model_devi_config)
     model_devi_template_config = model_devi_config.pop('template_config')
@@ -652,3 +766,43 @@ def _iter_block(
     block_steps.outputs.parameters["adjust_trust_lvl_2"].value_from_parameter = adjust_lvl.outputs.parameters["adjust_trust_lvl_2"]
     
     return block_steps
+
+
+def _distill_step(
+        block_steps,
+        distill_op: OP,
+        train: Step,
+        gen_data: Step,
+        exploration: Step,
+        trust_lvl_1,
+        trust_lvl_2,
+        train_template_config: Dict,
+        train_executor,
+        train_config: Dict,
+        upload_python_package : str = None,
+        retry_times: int = None
+    ):
+    # the distilled network biases the next exploration with the trust levels it will run with
+    return Step(
+        "distill",
+        template=PythonOPTemplate(
+            distill_op,
+            python_packages = upload_python_package,
+            retry_on_transient_error = retry_times,
+            **train_template_config,
+        ),
+        parameters={
+            "angular_mask": block_steps.inputs.parameters["angular_mask"],
+            "train_config": block_steps.inputs.parameters["train_config"],
+            "trust_lvl_1": trust_lvl_1,
+            "trust_lvl_2": trust_lvl_2,
+        },
+        artifacts={
+            "models": train.outputs.artifacts["model"],
+            "data": gen_data.outputs.artifacts["data"],
+            "plm_out": exploration.outputs.artifacts["plm_out"],
+        },
+        executor = train_executor,
+        key = "{}-distill".format(block_steps.inputs.parameters["block_tag"]),
+        **train_config,
+    )
@@ -39,7 +39,8 @@ class DataGenerator(Steps):
         }
         self._output_parameters = {}
         self._output_artifacts = {
-            "data": OutputArtifact()
+            "data": OutputArtifact(),
+            "data_new": OutputArtifact()
         }
 
         super().__init__(        
@@ -134,5 +135,6 @@ def _gen_data(
     data_steps.add(merge_data)
 
     data_steps.outputs.artifacts["data"]._from = merge_data.outputs.artifacts["data_raw"]
+    data_steps.outputs.artifacts["data_new"]._from = collect_data.outputs.artifacts["data_new"]
    
     return data_steps
@@ -45,6 +45,7 @@ class Exploration(Steps):
         }        
         self._input_artifacts = {
             "models" : InputArtifact(optional=True),
+            "bias_models" : InputArtifact(optional=True),
             "forcefield": InputArtifact(optional=True),
             "topology" : InputArtifact(optional=True),
             "inputfile": InputArtifact(optional=True),
@@ -58,6 +59,7 @@ class Exploration(Steps):
         }
         self._output_artifacts = {
             "plm_out": OutputArtifact(),
+            "model_devi_cache": OutputArtifact(),
             "md_log": OutputArtifact(),
             "trajectory": OutputArtifact(),
             "conf_outs": OutputArtifact()
@@ -156,6 +158,7 @@ def _exploration(
         },
         artifacts={
             "models" : exploration_steps.inputs.artifacts['models'],
+            "bias_models" : exploration_steps.inputs.artifacts['bias_models'],
             "topology" :exploration_steps.inputs.artifacts['topology'],
             "conf" : exploration_steps.inputs.artifacts['confs'],
             "cv_file": exploration_steps.inputs.artifacts['cv_file']
@@ -190,6 +193,7 @@ def _exploration(
             },
             artifacts={
                 "models" : exploration_steps.inputs.artifacts['models'],
+                "bias_models" : exploration_steps.inputs.artifacts['bias_models'],
                 "topology" :exploration_steps.inputs.artifacts['topology'],
                 "conf" : exploration_steps.inputs.artifacts['confs'],
                 "cv_file": exploration_steps.inputs.artifacts['cv_file']
@@ -212,7 +216,7 @@ def _exploration(
             retry_on_transient_error = retry_times,
             slices=Slices("{{item}}",
                 input_artifact=["task_path"],
-                output_artifact=["plm_out", "bias_fig","model_devi_fig", "dp_model_devi_fig", "dp_model_devi", "dp_selected_indices","dp_selected_confs","projected_fig","trajectory", "md_log", "conf_out"]
+                output_artifact=["plm_out", "bias_fig","model_devi_fig", "model_devi_cache", "dp_model_devi_fig", "dp_model_devi", "dp_selected_indices","dp_selected_confs","projected_fig","trajectory", "md_log", "conf_out"]
             ),
             **run_template_config,
         ),
@@ -223,6 +227,7 @@ def _exploration(
             "task_path" : prep_exploration.outputs.artifacts["task_path"],
             "forcefield": exploration_steps.inputs.artifacts['forcefield'],
             "models" : exploration_steps.inputs.artifacts['models'],
+            "bias_models" : exploration_steps.inputs.artifacts['bias_models'],
             "index_file": exploration_steps.inputs.artifacts['index_file'],
             "dp_files": exploration_steps.inputs.artifacts['dp_files'],
             "cv_file": exploration_steps.inputs.artifacts['cv_file'],
@@ -242,7 +247,7 @@ def _exploration(
                 retry_on_transient_error = retry_times,
                 slices=Slices(sub_path = True,
                     input_artifact=["task_path"],
-                    output_artifact=["plm_out", "bias_fig","model_devi_fig","dp_model_devi_fig", "dp_model_devi", "dp_selected_indices","dp_selected_confs","projected_fig","trajectory", "md_log", "conf_out"]
+                    output_artifact=["plm_out", "bias_fig","model_devi_fig", "model_devi_cache", "dp_model_devi_fig", "dp_model_devi", "dp_selected_indices","dp_selected_confs","projected_fig","trajectory", "md_log", "conf_out"]
                 ),
                 **run_template_config,
             ),
@@ -253,6 +258,7 @@ def _exploration(
                 "task_path" : prep_exploration.outputs.artifacts["task_path"],
                 "forcefield": exploration_steps.inputs.artifacts['forcefield'],
                 "models" : exploration_steps.inputs.artifacts['models'],
+                "bias_models" : exploration_steps.inputs.artifacts['bias_models'],
                 "index_file": exploration_steps.inputs.artifacts['index_file'],
                 "dp_files": exploration_steps.inputs.artifacts['dp_files'],
                 "cv_file": exploration_steps.inputs.artifacts['cv_file'],
@@ -266,6 +272,7 @@ def _exploration(
 
     exploration_steps.outputs.parameters["cv_dim"].value_from_parameter = prep_exploration.outputs.parameters["cv_dim"]
     exploration_steps.outputs.artifacts["plm_out"]._from = run_exploration.outputs.artifacts["plm_out"]
+    exploration_steps.outputs.artifacts["model_devi_cache"]._from = run_exploration.outputs.artifacts["model_devi_cache"]
     exploration_steps.outputs.artifacts["md_log"]._from = run_exploration.outputs.artifacts["md_log"]
     exploration_steps.outputs.artifacts["trajectory"]._from = run_exploration.outputs.artifacts["trajectory"]
     exploration_steps.outputs.artifacts["conf_outs"]._from = run_exploration.outputs.artifacts["conf_out"]
@@ -25,6 +25,8 @@ class Selector(Steps):
     
     r""" Selector SuperOP.
     This SuperOP combines PrepSelect OP and RunSelect OP.    
+    With `global_select`, `prep_op` is expected to be `PrepSelectGlobal`, which clusters CVs of all walkers in a single step,
+    and RunSelect is sliced over its per-walker outputs.
     """
     def __init__(
         self,
@@ -34,7 +36,8 @@ class Selector(Steps):
         prep_config: Dict,
         run_config: Dict,
         upload_python_package = None,
-        retry_times = None
+        retry_times = None,
+        global_select: bool = False
     ):
         self._input_parameters = {
             "label_config": InputParameter(type=Dict),
@@ -51,12 +54,16 @@ class Selector(Steps):
             "slice_mode": InputParameter(type=str, value="gmx"),
             "type_map": InputParameter(type=List, value=[]),
             "if_make_threshold": InputParameter(type=bool, value=False),
+            "cluster_config": InputParameter(type=Dict, value={}),
+            "dedup_radius": InputParameter(type=Optional[float], value=None),
             "task_names" : InputParameter(type=List[str]),
             "block_tag" : InputParameter(type=str, value="")
         }        
         self._input_artifacts = {
             "models" : InputArtifact(optional=True),
             "plm_out": InputArtifact(),
+            "data_old": InputArtifact(optional=True),
+            "model_devi_cache": InputArtifact(optional=True),
             "xtc_traj": InputArtifact(),
             "topology": InputArtifact()
         }
@@ -99,7 +106,8 @@ class Selector(Steps):
             prep_config = prep_config,
             run_config = run_config,
             upload_python_package = upload_python_package,
-            retry_times = retry_times
+            retry_times = retry_times,
+            global_select = global_select
         )            
     
     @property
@@ -131,7 +139,8 @@ def _select(
         prep_config : Dict,
         run_config : Dict,
         upload_python_package : str = None,
-        retry_times: int = None
+        retry_times: int = None,
+        global_select: bool = False
     ):
     prep_config = deepcopy(prep_config)
     run_config = deepcopy(run_config)
@@ -143,7 +152,34 @@ def _select(
     prep_merge = False
     if prep_executor is not None:
         prep_merge = prep_executor.merge_sliced_step
-    if prep_merge:
+    if global_select:
+        prep_select = Step(
+        'prep-select',
+        template=PythonOPTemplate(
+            prep_select_op,
+            python_packages = upload_python_package,
+            retry_on_transient_error = retry_times,
+            **prep_template_config,
+        ),
+        parameters={
+            "cluster_threshold": select_steps.inputs.parameters['cluster_threshold'],
+            "angular_mask": select_steps.inputs.parameters['angular_mask'],
+            "weights": select_steps.inputs.parameters['weights'],
+            "numb_cluster_upper": select_steps.inputs.parameters['numb_cluster_upper'],
+            "numb_cluster_lower": select_steps.inputs.parameters['numb_cluster_lower'],
+            "max_selection": select_steps.inputs.parameters['max_selection'],
+            "if_make_threshold": select_steps.inputs.parameters['if_make_threshold'],
+            "cluster_config": select_steps.inputs.parameters['cluster_config'],
+            "task_name": select_steps.inputs.parameters['task_names']
+        },
+        artifacts={
+            "plm_out": select_steps.inputs.artifacts['plm_out']
+        },
+        key = step_keys["prep_select"],
+        executor = prep_executor,
+        **prep_config
+    )
+    elif prep_merge:
         prep_select = Step(
         'prep-select',
         template=PythonOPTemplate(
@@ -168,6 +204,7 @@ def _select(
             "numb_cluster_lower": select_steps.inputs.parameters['numb_cluster_lower'],
             "max_selection": select_steps.inputs.parameters['max_selection'],
             "if_make_threshold": select_steps.inputs.parameters['if_make_threshold'],
+            "cluster_config": select_steps.inputs.parameters['cluster_config'],
             "task_name": select_steps.inputs.parameters['task_names']
         },
         artifacts={
@@ -202,6 +239,7 @@ def _select(
             "numb_cluster_lower": select_steps.inputs.parameters['numb_cluster_lower'],
             "max_selection": select_steps.inputs.parameters['max_selection'],
             "if_make_threshold": select_steps.inputs.parameters['if_make_threshold'],
+            "cluster_config": select_steps.inputs.parameters['cluster_config'],
             "task_name": select_steps.inputs.parameters['task_names']
         },
         artifacts={
@@ -216,7 +254,8 @@ def _select(
     run_merge = False
     if run_executor is not None:
         run_merge = run_executor.merge_sliced_step
-    if run_merge:
+    # outputs of the global prep step are plain lists ordered by walkers, slice them by index
+    if run_merge or global_select:
         run_select = Step(
         'run-select',
         template=PythonOPTemplate(
@@ -239,6 +278,9 @@ def _select(
             "output_freq": select_steps.inputs.parameters["output_freq"],
             "slice_mode": select_steps.inputs.parameters["slice_mode"],
             "type_map": select_steps.inputs.parameters["type_map"],
+            "angular_mask": select_steps.inputs.parameters['angular_mask'],
+            "weights": select_steps.inputs.parameters['weights'],
+            "dedup_radius": select_steps.inputs.parameters['dedup_radius'],
             "task_name": select_steps.inputs.parameters['task_names']
         },
         artifacts={
@@ -246,7 +288,9 @@ def _select(
             "cluster_selection_data": prep_select.outputs.artifacts["cluster_selection_data"],
             "models": select_steps.inputs.artifacts["models"],
             "xtc_traj": select_steps.inputs.artifacts["xtc_traj"],
-            "topology": select_steps.inputs.artifacts["topology"]
+            "topology": select_steps.inputs.artifacts["topology"],
+            "data_old": select_steps.inputs.artifacts["data_old"],
+            "model_devi_cache": select_steps.inputs.artifacts["model_devi_cache"]
         },
         key = step_keys["run_select"]+"-{{item}}",
         executor = run_executor,
@@ -275,6 +319,9 @@ def _select(
             "output_freq": select_steps.inputs.parameters["output_freq"],
             "slice_mode": select_steps.inputs.parameters["slice_mode"],
             "type_map": select_steps.inputs.parameters["type_map"],
+            "angular_mask": select_steps.inputs.parameters['angular_mask'],
+            "weights": select_steps.inputs.parameters['weights'],
+            "dedup_radius": select_steps.inputs.parameters['dedup_radius'],
             "task_name": select_steps.inputs.parameters['task_names']
         },
         artifacts={
@@ -282,7 +329,9 @@ def _select(
             "cluster_selection_data": prep_select.outputs.artifacts["cluster_selection_data"],
             "models": select_steps.inputs.artifacts["models"],
             "xtc_traj": select_steps.inputs.artifacts["xtc_traj"],
-            "topology": select_steps.inputs.artifacts["topology"]
+            "topology": select_steps.inputs.artifacts["topology"],
+            "data_old": select_steps.inputs.artifacts["data_old"],
+            "model_devi_cache": select_steps.inputs.artifacts["model_devi_cache"]
         },
         key = step_keys["run_select"]+"-{{item.order}}",
         executor = run_executor,
@@ -39,7 +39,8 @@ class EnhcMDTaskBuilder(TaskBuilder):
         plumed_output: str = "plm.out",
         cv_mode: str = "torsion",
         wall_list: Optional[List[str]] = None,
-        iteration: Optional[str] = None
+        iteration: Optional[str] = None,
+        bias_format: str = "deepfe"
     ):
         super().__init__()
         self.conf = conf
@@ -58,6 +59,7 @@ class EnhcMDTaskBuilder(TaskBuilder):
         self.cv_mode = cv_mode
         self.wall_list = wall_list
         self.iteration = iteration
+        self.bias_format = bias_format
         self.task = Task()
         self.cv_names = get_cv_name(
             conf=self.conf, cv_file=self.cv_file,
@@ -94,7 +96,8 @@ class EnhcMDTaskBuilder(TaskBuilder):
             selected_atomid=self.selected_atomid,
             trust_lvl_1=self.trust_lvl_1, trust_lvl_2=self.trust_lvl_2,
             model_list=self.model_list, stride=self.stride, output=self.plumed_output,
-            mode=self.cv_mode, wall_list = self.wall_list, iteration=self.iteration
+            mode=self.cv_mode, wall_list = self.wall_list, iteration=self.iteration,
+            bias_format=self.bias_format
         )
     
     def get_cv_dim(self):
@@ -263,7 +266,8 @@ def build_plumed_dict(
         output: str = "plm.out",
         mode: str = "torsion",
         wall_list: Optional[List[str]] = None,
-        iteration: Optional[str] = None
+        iteration: Optional[str] = None,
+        bias_format: str = "deepfe"
     ):
     plumed_task_files = {}
     plm_content = make_deepfe_plumed(
@@ -271,7 +275,8 @@ def build_plumed_dict(
         selected_atomid = selected_atomid,
         trust_lvl_1=trust_lvl_1, trust_lvl_2=trust_lvl_2,
         model_list=model_list, stride=stride,
-        output=output, mode=mode, wall_list=wall_list, iteration=iteration
+        output=output, mode=mode, wall_list=wall_list, iteration=iteration,
+        bias_format=bias_format
     )
     plumed_task_files[plumed_input_name] = (plm_content, "w")
     return plumed_task_files
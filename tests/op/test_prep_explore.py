@@ -10,7 +10,10 @@ from dflow.python import (
     )
 from context import rid
 from rid.op.prep_exploration import PrepExplore
-from rid.utils import load_txt, save_txt, set_directory
+from rid.utils import load_txt, save_txt, set_directory, read_txt
+from rid.nn.numpy_model import NumpyModel
+from rid.common.plumed.make_plumed import make_ann_bias
+from utils import write_models
 from pathlib import Path
 import shutil
 from rid.constants import (
@@ -19,7 +22,8 @@ from rid.constants import (
         gmx_top_name,
         gmx_mdp_name, 
         plumed_input_name,
-        plumed_output_name
+        plumed_output_name,
+        f_cvt
     )
 
 class Test_PrepExplore(unittest.TestCase):
@@ -102,4 +106,95 @@ class Test_PrepExplore(unittest.TestCase):
         assert gmx_conf_name in os.listdir(op_out3["task_path"]), "configuration file not in outdir"
         assert gmx_top_name in os.listdir(op_out3["task_path"]), "topology file not in outdir"
         assert plumed_input_name in os.listdir(op_out3["task_path"]), "plumed input file not in outdir"
-        assert gmx_mdp_name in os.listdir(op_out3["task_path"]), "mdp file not in outdir"
\ No newline at end of file
+        assert gmx_mdp_name in os.listdir(op_out3["task_path"]), "mdp file not in outdir"
+
+def eval_custom_actions(plm_content, values):
+    """Values of the `CUSTOM` actions in `plm_content` given the values of their input CVs."""
+    values = dict(values)
+    for line in plm_content.split("\n"):
+        if "CUSTOM" not in line:
+            continue
+        name, action = line.split(":", 1)
+        keys = dict(item.split("=", 1) for item in action.split()[1:])
+        local = dict(zip(keys["VAR"].split(","), [values[arg] for arg in keys["ARG"].split(",")]))
+        local.update({"cos": np.cos, "sin": np.sin, "tanh": np.tanh})
+        values[name] = eval(keys["FUNC"], {}, local)
+    return values
+
+
+def custom_gradient(plm_content, values, name, delta=1e-6):
+    """Central difference gradient of the `CUSTOM` action `name` w.r.t. its input CVs `values`."""
+    grad = []
+    for cv_name in values:
+        plus, minus = dict(values), dict(values)
+        plus[cv_name] = values[cv_name] + delta
+        minus[cv_name] = values[cv_name] - delta
+        grad.append((eval_custom_actions(plm_content, plus)[name]
+                     - eval_custom_actions(plm_content, minus)[name]) / (2 * delta))
+    return np.stack(grad, axis=1)
+
+
+class Test_PrepExplore_ANN(unittest.TestCase):
+    def setUp(self):
+        self.datapath = "data"
+        self.taskname = "explored_ann"
+
+    def tearDown(self):
+        shutil.rmtree(self.taskname)
+
+    def test(self):
+        op = PrepExplore()
+        data = Path(self.datapath)
+        gmx_config = {"type":"gmx","nsteps": 50, "output_freq": 1, "temperature": 300, 
+                      "dt": 0.002, "output_mode": "both", "ntmpi": 1, "nt": 8, "max_warning": 0,
+                      "bias_format": "ann"}
+        cv_config = {"mode": "torsion", "selected_resid": [1, 2], "cv_file": []}
+        op_in = OPIO(
+            {
+                "models": [data/"models"/"model_000.pb"],
+                "topology": data/"topol.top",
+                "conf": data/"conf.gro",
+                "cv_file": None,
+                "trust_lvl_1": 2.0,
+                "trust_lvl_2": 3.0,
+                "exploration_config": gmx_config,
+                "cv_config": cv_config,
+                "task_name": self.taskname,
+                "block_tag": "iter-001"
+            }
+        )
+        op_out = op.execute(op_in)
+        self.assertEqual(op_out["cv_dim"], 2)
+        plm_content = read_txt(op_out["task_path"]/plumed_input_name)
+        self.assertNotIn("DEEPFE", plm_content)
+        self.assertIn("dpfe: BIASVALUE ARG=dpfe_energy", plm_content)
+        self.assertIn("ARG=dpfe.bias", plm_content)
+
+        model = NumpyModel.from_graph(data/"models"/"model_000.pb")
+        cvs = np.random.RandomState(0).uniform(-np.pi, np.pi, size=(5, 2))
+        cv_names = [line.split(":")[0] for line in plm_content.split("\n") if "TORSION" in line]
+        values = eval_custom_actions(plm_content, dict(zip(cv_names, cvs.T)))
+        energy, forces = model.evaluate(cvs)
+        np.testing.assert_allclose(values["dpfe_energy"], -f_cvt * energy[:, 0], rtol=1e-5, atol=1e-5)
+        # PLUMED applies minus the bias gradient, DEEPFE applies -f_cvt * o_forces
+        grad = custom_gradient(plm_content, dict(zip(cv_names, cvs.T)), "dpfe_energy")
+        np.testing.assert_allclose(grad, f_cvt * forces, rtol=1e-4, atol=1e-4)
+
+    def test_dist(self):
+        Path(self.taskname).mkdir()
+        angular_mask = [1, 0, 0]
+        cv_names = ["tor", "d1", "d2"]
+        rng = np.random.RandomState(0)
+        cvs = np.concatenate([rng.uniform(-np.pi, np.pi, size=(5, 1)), rng.uniform(0, 2, size=(5, 2))], axis=1)
+        # distances are shifted, the shift is folded into layer_0
+        model = write_models(self.taskname, angular_mask, 1, scaled=False)[0]
+        plm_content = make_ann_bias(cv_names, [model])
+        values = eval_custom_actions(plm_content, dict(zip(cv_names, cvs.T)))
+        energy, forces = NumpyModel.from_graph(model).evaluate(cvs)
+        np.testing.assert_allclose(values["dpfe_energy"], -f_cvt * energy[:, 0], rtol=1e-5, atol=1e-5)
+        grad = custom_gradient(plm_content, dict(zip(cv_names, cvs.T)), "dpfe_energy")
+        np.testing.assert_allclose(grad, f_cvt * forces, rtol=1e-4, atol=1e-4)
+        # forces w.r.t. scaled distances are not the gradient of any bias of the raw distances
+        model = write_models(self.taskname, angular_mask, 1)[0]
+        with self.assertRaises(RuntimeError):
+            make_ann_bias(cv_names, [model])
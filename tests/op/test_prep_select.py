@@ -9,7 +9,12 @@ from dflow.python import (
     Parameter
     )
 from context import rid
-from rid.op.prep_select import PrepSelect
+from rid.op.prep_select import PrepSelect, PrepSelectGlobal
+from rid.select.cluster import (
+    Cluster, cv_dist, mk_dist, mk_pair_dist, mk_cluster, mk_linkage, cut_linkage,
+    chooseClusterCenter, choose_cluster_medoids, order_cluster_centers
+)
+from sklearn.metrics import adjusted_rand_score
 from rid.utils import load_txt, save_txt, set_directory
 from pathlib import Path
 import shutil
@@ -20,9 +25,9 @@ class Test_PrepSelect(unittest.TestCase):
         self.datapath = "data"
     
     def tearDown(self):
-        ii = Path(self.taskname)
-        if ii.is_dir():
-            shutil.rmtree(ii)
+        for ii in [Path(self.taskname), Path("001"), Path("global")]:
+            if ii.is_dir():
+                shutil.rmtree(ii)
     
     def test(self):
         op = PrepSelect()
@@ -61,4 +66,149 @@ class Test_PrepSelect(unittest.TestCase):
 
         self.assertEqual(op_out1["cluster_threshold"], 0.05)
         self.assertEqual(op_out1["numb_cluster"], 5)
-        self.assertEqual(op_out2["cluster_threshold"], 0.05)
\ No newline at end of file
+        self.assertEqual(op_out2["cluster_threshold"], 0.05)
+
+    def test_landmark(self):
+        op = PrepSelect()
+        data = Path(self.datapath)
+        plm_path = data/"plm.out"
+        op_in = OPIO(
+            {
+                "task_name": self.taskname,
+                "plm_out": plm_path,
+                "cluster_threshold": 0.05,
+                "angular_mask": [1,1],
+                "weights": [1,1],
+                "numb_cluster_upper": 5,
+                "numb_cluster_lower": 3,
+                "max_selection": 5,
+                "if_make_threshold": False,
+                "cluster_config": {"cluster_mode": "landmark", "numb_landmarks": 50, "chunk_size": 20}
+            }
+        )
+        op_out = op.execute(op_in)
+        cls_sel_idx = np.load(op_out["cluster_selection_index"])
+        cls_sel_data = np.load(op_out["cluster_selection_data"])
+        self.assertEqual(op_out["numb_cluster"], 5)
+        self.assertEqual(len(set(cls_sel_idx)), 5)
+        self.assertTrue(np.allclose(cls_sel_data, np.loadtxt(plm_path)[cls_sel_idx, 2:]))
+
+    def test_kcenter(self):
+        op = PrepSelect()
+        data = Path(self.datapath)
+        plm_path = data/"plm.out"
+        op_in = OPIO(
+            {
+                "task_name": self.taskname,
+                "plm_out": plm_path,
+                "cluster_threshold": 0.05,
+                "angular_mask": [1,1],
+                "weights": [1,1],
+                "numb_cluster_upper": 5,
+                "numb_cluster_lower": 3,
+                "max_selection": 5,
+                "if_make_threshold": True,
+                "cluster_config": {"cluster_mode": "kcenter"}
+            }
+        )
+        op_out = op.execute(op_in)
+        cls_sel_idx = np.load(op_out["cluster_selection_index"])
+        self.assertEqual(op_out["numb_cluster"], 4)
+        self.assertEqual(len(set(cls_sel_idx)), 4)
+        self.assertTrue(op_out["cluster_threshold"] > 0)
+
+    def test_global(self):
+        op = PrepSelectGlobal()
+        data = Path(self.datapath)
+        plm_path = data/"plm.out"
+        op_in = OPIO(
+            {
+                "task_name": [self.taskname, "001"],
+                "plm_out": [plm_path, plm_path],
+                "cluster_threshold": [0.5, 0.5],
+                "angular_mask": [1,1],
+                "weights": [1,1],
+                "numb_cluster_upper": 5,
+                "numb_cluster_lower": 3,
+                "max_selection": 5,
+                "if_make_threshold": False
+            }
+        )
+        op_out = op.execute(op_in)
+        plm_data = np.loadtxt(plm_path)[:, 2:]
+        numb_selected = 0
+        for idx in range(2):
+            cls_sel_idx = np.load(op_out["cluster_selection_index"][idx])
+            cls_sel_data = np.load(op_out["cluster_selection_data"][idx])
+            self.assertEqual(op_out["numb_cluster"][idx], len(cls_sel_idx))
+            self.assertTrue(np.allclose(cls_sel_data, plm_data[cls_sel_idx]))
+            numb_selected += len(cls_sel_idx)
+        # identical walkers are clustered together, each cluster is selected once
+        self.assertEqual(op_out["cluster_threshold"], [0.5, 0.5])
+        self.assertTrue(0 < numb_selected <= 10)
+
+
+class Test_Cluster(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.angular_mask = np.array([1, 0, 1])
+        self.weights = np.array([1., 2., 0.5])
+        self.cvs = np.concatenate([rng.uniform(-np.pi, np.pi, size=(37, 1)),
+                                   rng.uniform(0, 2, size=(37, 1)),
+                                   rng.uniform(-np.pi, np.pi, size=(37, 1))], axis=1)
+        # frames across the periodic boundary of both angles
+        self.cvs[0] = [np.pi - 0.05, 1., -np.pi + 0.02]
+        self.cvs[1] = [-np.pi + 0.05, 1., np.pi - 0.02]
+
+    def test_dist(self):
+        ref = np.array([[cv_dist(c1, c2, self.angular_mask, self.weights) for c2 in self.cvs] for c1 in self.cvs])
+        # 37 frames are not a multiple of the block size
+        dist = mk_dist(self.cvs, self.angular_mask, self.weights, block_size=5)
+        np.testing.assert_allclose(dist, ref, rtol=1e-12, atol=1e-12)
+        np.testing.assert_array_equal(dist, dist.T)
+        self.assertAlmostEqual(dist[0, 1], np.hypot(0.1, 0.5 * 0.04))
+        np.testing.assert_allclose(mk_pair_dist(self.cvs[:7], self.cvs[20:], self.angular_mask, self.weights),
+                                   ref[:7, 20:], rtol=1e-12, atol=1e-12)
+        np.testing.assert_allclose(mk_dist(self.cvs, self.angular_mask, self.weights, dtype=np.float32, block_size=8),
+                                   ref, rtol=1e-5, atol=1e-5)
+
+    def test_cut_linkage(self):
+        dist = mk_dist(self.cvs, self.angular_mask, self.weights)
+        tree = mk_linkage(dist)
+        # thresholds in the middle of consecutive merge heights, away from ties
+        heights = tree[:, 2]
+        for threshold in (heights[1:] + heights[:-1])[::4] / 2:
+            labels = cut_linkage(tree, threshold)
+            self.assertEqual(adjusted_rand_score(mk_cluster(dist, threshold), labels), 1.)
+            self.assertEqual(labels.min(), 0)
+
+    def test_make_threshold(self):
+        for lower, upper in [(5, 8), (10, 15), (20, 30)]:
+            cluster = Cluster(self.cvs, 1.0, "000", angular_mask=self.angular_mask, weights=self.weights)
+            threshold = cluster.make_threshold(lower, upper)
+            numb_cluster = len(set(cut_linkage(cluster.get_tree(), threshold)))
+            self.assertTrue(lower <= numb_cluster <= upper)
+
+
+
+    def test_medoids(self):
+        dist = mk_dist(self.cvs, self.angular_mask, self.weights)
+        labels = cut_linkage(mk_linkage(dist), 1.0)
+        ref = [chooseClusterCenter(dist, np.flatnonzero(labels == label))[0] for label in range(labels.max() + 1)]
+        # small blocks to reduce the loss over several row blocks
+        np.testing.assert_array_equal(choose_cluster_medoids(dist, labels, max_block_memory=800), ref)
+        np.testing.assert_array_equal(choose_cluster_medoids(dist, labels), ref)
+        # a tie of equal losses goes to the first member
+        self.assertEqual(choose_cluster_medoids(np.ones([3, 3]) - np.eye(3), np.zeros(3, dtype=int))[0], 0)
+
+    def test_order_centers(self):
+        # sizes 2, 3, 2 and 1; the clusters of size 2 start at frames 1 and 0
+        labels = np.array([2, 0, 1, 1, 0, 1, 2, 3])
+        centers = np.array([4, 3, 6, 7])
+        np.testing.assert_array_equal(order_cluster_centers(centers, labels, 10), [3, 6, 4, 7])
+        # renumbering the clusters does not change the order
+        perm = np.array([3, 1, 0, 2])
+        np.testing.assert_array_equal(
+            order_cluster_centers(centers[np.argsort(perm)], perm[labels], 10), [3, 6, 4, 7])
+        np.testing.assert_array_equal(order_cluster_centers(centers, labels, 2), [3, 6])
+
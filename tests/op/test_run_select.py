@@ -11,9 +11,31 @@ from dflow.python import (
     )
 from context import rid
 from rid.op.run_select import RunSelect
+from rid.select import model_devi
+from rid.select.model_devi import (
+    DeviCache, make_std, load_session, clear_model_cache, compute_std,
+    test_ef as ef_single, test_ef_ensemble as ef_ensemble
+)
+from rid.common.tensorflow.graph import load_graph
+from utils import write_models
+from rid.nn.numpy_model import NumpyModel
+from rid.select import model_server
+from rid.select.model_server import ModelServer, query_server, new_server_key, server_env, server_key_env
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+from concurrent.futures import ThreadPoolExecutor
+import stat
+import threading
+from rid.constants import f_cvt
+try:
+    import tensorflow.compat.v1 as tf
+    tf.disable_v2_behavior()
+except ImportError:
+    import tensorflow as tf
 from rid.utils import load_txt, save_txt, set_directory
 from pathlib import Path
 import shutil
+import tempfile
 
 class Test_MockedRunSelect(unittest.TestCase):
     def setUp(self):
@@ -124,4 +146,228 @@ class Test_MockedRunSelect(unittest.TestCase):
         self.assertTrue(op_out1["selected_indices"])
         self.assertTrue(op_out2["selected_indices"])
         self.assertTrue(op_out3["selected_indices"])
-        self.assertRaises(RuntimeError, op.execute, op_in4)
\ No newline at end of file
+        self.assertRaises(RuntimeError, op.execute, op_in4)
+
+    @patch('rid.op.run_select.slice_xtc')
+    def test_dedup(self, mocked_run):
+        mocked_run.return_value = None
+        op = RunSelect()
+        data = Path(self.datapath)
+        cls_data = np.load(data/"cls_sel.out.npy")
+        cls_idx = np.load(data/"cls_sel.ndx.npy")
+        data_old = (data/"data_old.npy").absolute()
+        # labeled data: CVs of the first two selected frames followed by forces
+        np.save(data_old, np.concatenate([cls_data[:2], np.zeros_like(cls_data[:2])], axis=1))
+        gmx_config = {"type":"gmx","nsteps": 50,"method":"restrained", "output_freq": 1, "temperature": 300, "kappas": [500,500],
+                      "dt": 0.002, "output_mode": "both", "ntmpi": 1, "nt": 8, "max_warning": 0}
+        op_in = OPIO(
+            {
+                "task_name": self.taskname,
+                "cluster_selection_index": data/"cls_sel.ndx.npy",
+                "cluster_selection_data": data/"cls_sel.out.npy",
+                "models": None,
+                "trust_lvl_1": 0.02,
+                "trust_lvl_2": 0.03,
+                "xtc_traj": data/"traj_comp.xtc",
+                "topology": data/"topol.top",
+                "label_config": gmx_config,
+                "dt": 0.002,
+                "output_freq": 2500,
+                "slice_mode": "gmx",
+                "data_old": data_old,
+                "angular_mask": [1, 1],
+                "weights": [1, 1],
+                "dedup_radius": 1e-3
+            }
+        )
+        try:
+            op_out = op.execute(op_in)
+        finally:
+            os.remove(data_old)
+        sel_idx = np.load(op_out["selected_indices"])
+        np.testing.assert_array_equal(sel_idx, cls_idx[2:])
+
+    @patch('rid.op.run_select.slice_xtc')
+    def test_model_devi_cache(self, mocked_run):
+        mocked_run.return_value = None
+        op = RunSelect()
+        data = Path(self.datapath)
+        models = [(data/"models"/f"model_00{ii}.pb").absolute() for ii in range(3)]
+        cls_data = np.load(data/"cls_sel.out.npy")
+        cache_file = (data/"model_devi_cache.npz").absolute()
+        # cached values are returned as they are, not recomputed
+        cache = DeviCache(models)
+        cache.update(DeviCache.row_keys(cls_data[:2]), [100., 200.])
+        cache.save(cache_file)
+        gmx_config = {"type":"gmx","nsteps": 50,"method":"restrained", "output_freq": 1, "temperature": 300, "kappas": [500,500],
+                      "dt": 0.002, "output_mode": "both", "ntmpi": 1, "nt": 8, "max_warning": 0}
+        op_in = OPIO(
+            {
+                "task_name": self.taskname,
+                "cluster_selection_index": data/"cls_sel.ndx.npy",
+                "cluster_selection_data": data/"cls_sel.out.npy",
+                "models": models,
+                "trust_lvl_1": 0.02,
+                "trust_lvl_2": 0.03,
+                "xtc_traj": data/"traj_comp.xtc",
+                "topology": data/"topol.top",
+                "label_config": gmx_config,
+                "dt": 0.002,
+                "output_freq": 2500,
+                "slice_mode": "gmx",
+                "model_devi_cache": [cache_file]
+            }
+        )
+        try:
+            op_out = op.execute(op_in)
+        finally:
+            os.remove(cache_file)
+        stds = np.loadtxt(op_out["model_devi"])
+        np.testing.assert_allclose(stds[:2], [100., 200.])
+        np.testing.assert_allclose(stds[2:], make_std(cls_data[2:], models), rtol=1e-4)
+
+
+class Test_ModelDevi(unittest.TestCase):
+    def setUp(self):
+        self.datapath = Path("data")
+        self.tmpdir = Path(tempfile.mkdtemp())
+        clear_model_cache()
+
+    def tearDown(self):
+        clear_model_cache()
+        shutil.rmtree(self.tmpdir)
+
+    def test_session_cache(self):
+        model = self.tmpdir/"model.pb"
+        shutil.copy(self.datapath/"models"/"model_000.pb", model)
+        sess = load_session(model)
+        # unchanged file, the session is reused, also by a relative path
+        self.assertIs(load_session(model), sess)
+        self.assertIs(load_session(os.path.relpath(model)), sess)
+        # a model overwritten in place is reloaded
+        shutil.copy(self.datapath/"models"/"model_001.pb", model)
+        new_sess = load_session(model)
+        self.assertIsNot(new_sess, sess)
+        shutil.copy(self.datapath/"models"/"model_000.pb", model)
+        self.assertIs(load_session(model), sess)
+
+    def test_session_cache_eviction(self):
+        models = [self.datapath/"models"/f"model_00{ii}.pb" for ii in range(3)]
+        with patch.object(model_devi, "model_cache_size", 2):
+            sess_0 = load_session(models[0])
+            sess_1 = load_session(models[1])
+            # a hit moves model_000 to the most recent end
+            self.assertIs(load_session(models[0]), sess_0)
+            load_session(models[2])
+            # the least recently used session is closed and dropped
+            self.assertTrue(sess_1._closed)
+            self.assertFalse(sess_0._closed)
+            self.assertIs(load_session(models[0]), sess_0)
+            self.assertIsNot(load_session(models[1]), sess_1)
+            self.assertEqual(len(model_devi._session_cache), 2)
+
+    def test_ensemble_graph(self):
+        angular_mask = [1, 0, 1]
+        models = write_models(self.tmpdir, angular_mask, 3)
+        rng = np.random.RandomState(1)
+        cvs = np.concatenate([rng.uniform(-np.pi, np.pi, (20, 1)), rng.uniform(0, 2, (20, 1)),
+                              rng.uniform(-np.pi, np.pi, (20, 1))], axis=1)
+        energies, forces = ef_ensemble(load_session(models), cvs)
+        self.assertEqual(energies.shape[0], 3)
+        self.assertEqual(forces.shape, (3, 20, 3))
+        # one session per model, as before fusing the ensemble
+        for ii, model in enumerate(models):
+            with tf.Session(graph=load_graph(str(model))) as sess:
+                energy, force = ef_single(sess, cvs)
+            np.testing.assert_allclose(energies[ii], energy, rtol=1e-5, atol=1e-5)
+            np.testing.assert_allclose(forces[ii], force, rtol=1e-5, atol=1e-5)
+        self.assertGreater(np.abs(forces[0] - forces[1]).max(), 1e-3)
+        # the mean outputs of the fused graph
+        sess = load_session(models)
+        mean_forces = sess.run(sess.graph.get_tensor_by_name("load/o_forces:0"), feed_dict={
+            sess.graph.get_tensor_by_name("load/inputs:0"): np.concatenate([cvs, np.zeros_like(cvs)], axis=1),
+            sess.graph.get_tensor_by_name("load/drop_out_rate:0"): 0.})
+        np.testing.assert_allclose(mean_forces, np.mean(forces, axis=0), rtol=1e-5, atol=1e-5)
+
+    def test_make_std_chunks(self):
+        angular_mask = [1, 0]
+        models = write_models(self.tmpdir, angular_mask, 3)
+        npz_models = []
+        for model in models:
+            npz_models.append(model.with_suffix(".npz"))
+            NumpyModel.from_graph(model).save(npz_models[-1])
+        rng = np.random.RandomState(2)
+        cvs = np.concatenate([rng.uniform(-np.pi, np.pi, (30, 1)), rng.uniform(0, 2, (30, 1))], axis=1)
+        # unchunked deviations of the fused graph
+        ref = compute_std(ef_ensemble(load_session(models), cvs)[1] * f_cvt)
+        # 30 frames are not a multiple of the chunk size
+        stds = make_std(cvs, models, chunk_size=7)
+        # up to the float32 rounding of TensorFlow kernels, which depends on the batch size
+        np.testing.assert_allclose(stds, make_std(cvs, models, chunk_size=100), rtol=1e-6)
+        np.testing.assert_allclose(stds, ref, rtol=1e-6)
+        np_stds = make_std(cvs, npz_models, chunk_size=7)
+        np.testing.assert_array_equal(np_stds, make_std(cvs, npz_models, chunk_size=100))
+        np.testing.assert_allclose(np_stds, ref, rtol=1e-4)
+        self.assertEqual(len(make_std(cvs[:0], models, chunk_size=7)), 0)
+
+
+class Test_ModelServer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self.models = [(Path("data")/"models"/f"model_00{ii}.pb").absolute() for ii in range(3)]
+        self.address = str(self.tmpdir/"server.sock")
+        self.key = new_server_key()
+        self.server = ModelServer(self.address, authkey=bytes.fromhex(self.key), max_batch_frames=50)
+        threading.Thread(target=self.server.serve, daemon=True).start()
+        self.assertTrue(self.server.ready.wait(10))
+        rng = np.random.RandomState(0)
+        self.cvs = rng.uniform(-np.pi, np.pi, size=(40, 2))
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.address).st_mode), 0o600)
+        chunks = [self.cvs[ii:ii+ii%7+1] for ii in range(0, 40, 3)]
+        # in-process inference
+        with patch.dict(os.environ):
+            os.environ.pop(server_env, None)
+            ref_forces = [ef_ensemble(load_session(self.models), chunk)[1] for chunk in [self.cvs] + chunks]
+            ref_stds = [make_std(chunk, self.models) for chunk in [self.cvs] + chunks]
+        with patch.dict(os.environ, {server_env: self.address, server_key_env: self.key}):
+            _, forces = query_server(self.models, self.cvs)
+            np.testing.assert_allclose(forces, ref_forces[0], rtol=1e-5, atol=1e-5)
+            with patch("rid.select.model_devi.load_session", side_effect=AssertionError("not served")):
+                np.testing.assert_allclose(make_std(self.cvs, self.models), ref_stds[0], rtol=1e-5)
+                # concurrent callers are batched by the server and the results split back,
+                # up to the float32 rounding of differently sized batches
+                with ThreadPoolExecutor(8) as pool:
+                    rets = list(pool.map(lambda chunk: query_server(self.models, chunk), chunks))
+                    stds = list(pool.map(lambda chunk: make_std(chunk, self.models), chunks))
+        for ret, ref in zip(rets, ref_forces[1:]):
+            np.testing.assert_allclose(ret[1], ref, rtol=1e-5, atol=1e-5)
+        for std, ref in zip(stds, ref_stds[1:]):
+            np.testing.assert_allclose(std, ref, rtol=1e-5)
+
+    def test_connection_reuse(self):
+        with patch.dict(os.environ, {server_env: self.address, server_key_env: self.key}):
+            with patch("rid.select.model_server.Client", wraps=Client) as mocked_client:
+                query_server(self.models, self.cvs[:5])
+                conn = model_server._clients.conn
+                query_server(self.models, self.cvs[5:10])
+                # the connection of this thread is kept open and reused
+                self.assertIs(model_server._clients.conn, conn)
+                self.assertFalse(conn.closed)
+                self.assertEqual(mocked_client.call_count, 1)
+
+    def test_authkey(self):
+        with self.assertRaises(AuthenticationError):
+            Client(self.address, family="AF_UNIX", authkey=b"wrong key")
+        # callers with a wrong key fall back to local inference
+        with patch.dict(os.environ, {server_env: self.address, server_key_env: new_server_key()}):
+            self.assertIsNone(query_server(self.models, self.cvs))
+        # the server is still serving
+        with patch.dict(os.environ, {server_env: self.address, server_key_env: self.key}):
+            self.assertIsNotNone(query_server(self.models, self.cvs))
+
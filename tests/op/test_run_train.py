@@ -1,16 +1,33 @@
 import os
 import numpy as np
 import unittest
+from unittest.mock import patch
 from pathlib import Path
 from dflow.python import (
     OPIO
     )
 from context import rid
-from rid.op.run_train import TrainModel
-from rid.constants import data_raw
+from rid.op.run_train import TrainModel, TrainModels, DistillModel
+from rid.constants import data_raw, data_new, data_old, distill_tag, distill_data_name
 from pathlib import Path
-from utils import DATA_RAW
+from utils import DATA_RAW, DATA_NEW, DATA_OLD, write_models
+from rid.nn.numpy_model import NumpyModel
+from rid.nn.model import Reader
+from rid.nn.ensemble import EnsembleModel, freeze_members
+from rid.nn.train_net import set_conf
+from rid.nn.metrics import load_metrics
+from rid.nn.freeze import optimize_model
+from rid.nn.model import load_weights
+from rid.select.model_devi import load_session, compute_std, test_ef_ensemble as ef_ensemble
+from rid.constants import f_cvt
+from rid.common.tensorflow.graph import load_graph
+from rid.select.model_devi import test_ef as ef_single
 import shutil
+try:
+    import tensorflow.compat.v1 as tf
+    tf.disable_v2_behavior()
+except ImportError:
+    import tensorflow as tf
 
 class Test_RunTrain(unittest.TestCase):
     def setUp(self):
@@ -20,9 +37,12 @@ class Test_RunTrain(unittest.TestCase):
     
     def tearDown(self):
         os.remove(Path(self.datapath)/data_raw)
-        ii = Path("000")
-        if ii.is_dir():
-            shutil.rmtree(ii)
+        for ii in [Path(self.datapath)/data_new, Path(self.datapath)/data_old]:
+            if ii.is_file():
+                os.remove(ii)
+        for ii in [Path("000"), Path("001"), Path("init"), Path(distill_tag)]:
+            if ii.is_dir():
+                shutil.rmtree(ii)
     
     def test(self):
         op = TrainModel()
@@ -40,4 +60,266 @@ class Test_RunTrain(unittest.TestCase):
             }
         )
         op_out1 = op.execute(op_in1)
-        self.assertTrue(op_out1["model"])
\ No newline at end of file
+        self.assertTrue(op_out1["model"])
+
+    def test_numpy_model(self):
+        op = TrainModel()
+        data = Path(os.path.abspath(self.datapath))
+        train_config = {"neurons": [20, 20], "resnet": True, "batch_size": 2,
+                        "epoches": 200, "init_lr": 0.0008, "decay_steps": 120,
+                        "decay_rate": 0.96, "train_thread": 8, "drop_out_rate": 0.3, 
+                        "numb_threads": 8, "use_mix": False, "restart": False, "decay_steps_inner": 120}
+        op_in = OPIO(
+            {
+                "model_tag": "000",
+                "angular_mask": [1,0],
+                "data": data/data_raw,
+                "train_config": train_config
+            }
+        )
+        op_out = op.execute(op_in)
+        model = NumpyModel.from_graph(op_out["model"])
+        # the distance is normalized, so forces w.r.t. normalized and raw CVs differ
+        self.assertNotAlmostEqual(model.input_scale[1], 1.)
+        cvs = DATA_RAW[:, :2]
+        with tf.Session(graph=load_graph(str(op_out["model"]))) as sess:
+            energy, forces = ef_single(sess, cvs)
+        np_energy, np_forces = model.evaluate(cvs)
+        np.testing.assert_allclose(np_energy, energy, rtol=1e-5, atol=1e-5)
+        np.testing.assert_allclose(np_forces, forces, rtol=1e-5, atol=1e-5)
+
+    def test_ensemble(self):
+        op = TrainModels()
+        data = Path(os.path.abspath(self.datapath))
+        train_config = {"neurons": [20, 20], "resnet": True, "batch_size": 2,
+                        "epoches": 200, "init_lr": 0.0008, "decay_steps": 120,
+                        "decay_rate": 0.96, "train_thread": 8, "drop_out_rate": 0.3, 
+                        "numb_threads": 8, "use_mix": False, "restart": False, "decay_steps_inner": 120}
+        cvs = DATA_RAW[:, :2]
+        for angular_mask in [[1,1], [1,0]]:
+            op_in = OPIO(
+                {
+                    "model_tag": ["000", "001"],
+                    "angular_mask": angular_mask,
+                    "data": data/data_raw,
+                    "train_config": train_config
+                }
+            )
+            op_out = op.execute(op_in)
+            self.assertEqual(len(op_out["model"]), 2)
+            forces = []
+            for model in op_out["model"]:
+                with tf.Session(graph=load_graph(str(model))) as sess:
+                    forces.append(ef_single(sess, cvs)[1])
+                np.testing.assert_allclose(NumpyModel.from_graph(model).evaluate(cvs)[1], forces[-1], rtol=1e-5, atol=1e-5)
+            # members are initialized and trained independently
+            self.assertGreater(np.abs(forces[0] - forces[1]).max(), 1e-6)
+
+    def test_ensemble_forces(self):
+        angular_mask = [1,0]
+        config = set_conf(2, angular_mask, neurons=[20, 20], batch_size=2, epoches=200, drop_out_rate=0.3,
+                          data_path=str(Path(self.datapath)/data_raw))
+        model_names = [Path("000")/"model_000.pb", Path("000")/"model_001.pb"]
+        Path("000").mkdir()
+        cvs = DATA_RAW[:, :2]
+        inputs = np.concatenate([cvs, np.zeros_like(cvs)], axis=1)
+        tf.reset_default_graph()
+        with tf.Session() as sess:
+            model = EnsembleModel(config, sess, 2)
+            model.train(Reader(config), [Path("000")/"train_000.log", Path("000")/"train_001.log"])
+            train_forces = sess.run(model.forces, feed_dict={
+                model.inputs_train: np.broadcast_to(inputs, (2,) + inputs.shape), model.drop_out_rate: 0.})
+            freeze_members(model, angular_mask, model_names)
+        for model_name, member_forces in zip(model_names, train_forces):
+            np_model = NumpyModel.from_graph(model_name)
+            # the distance is normalized, so forces w.r.t. normalized and raw CVs differ
+            self.assertNotAlmostEqual(np_model.input_scale[1], 1.)
+            with tf.Session(graph=load_graph(str(model_name))) as sess:
+                forces = ef_single(sess, cvs)[1]
+            np.testing.assert_allclose(forces, member_forces, rtol=1e-5, atol=1e-5)
+            np.testing.assert_allclose(np_model.evaluate(cvs)[1], member_forces, rtol=1e-5, atol=1e-5)
+
+    def test_valid(self):
+        op = TrainModel()
+        data = Path(os.path.abspath(self.datapath))
+        train_config = {"neurons": [20, 20], "resnet": True, "batch_size": 2,
+                        "epoches": 400, "init_lr": 0.0008, "decay_steps": 120,
+                        "decay_rate": 0.96, "train_thread": 8, "drop_out_rate": 0.3, 
+                        "numb_threads": 8, "use_mix": False, "restart": False, "decay_steps_inner": 120,
+                        "valid_ratio": 0.4, "patience": 200}
+        op_in = OPIO(
+            {
+                "model_tag": "000",
+                "angular_mask": [1,1],
+                "data": data/data_raw,
+                "train_config": train_config
+            }
+        )
+        op_out = op.execute(op_in)
+        self.assertTrue(op_out["model"])
+        metrics = load_metrics(op_out["train_metrics"])
+        np.testing.assert_array_equal(metrics["epoch"], [0, 200, 400])
+        self.assertEqual(len(metrics["valid_err"]), 3)
+        self.assertTrue(np.isnan(metrics["valid_err"][0]))
+
+    def test_display_batches(self):
+        # displaying the training error does not draw batches from the pipeline
+        draws = []
+        build_dataset = Reader.build_dataset
+        def counted_build_dataset(reader, *args, **kwargs):
+            batch, init, feed_dict = build_dataset(reader, *args, **kwargs)
+            counted = tf.numpy_function(lambda x: draws.append(1) or x, [batch], batch.dtype)
+            counted.set_shape(batch.shape)
+            return counted, init, feed_dict
+        data = Path(os.path.abspath(self.datapath))
+        train_config = {"neurons": [20, 20], "resnet": True, "batch_size": 2,
+                        "epoches": 400, "init_lr": 0.0008, "decay_steps": 120,
+                        "decay_rate": 0.96, "train_thread": 8, "drop_out_rate": 0.3,
+                        "numb_threads": 8, "use_mix": False, "restart": False, "decay_steps_inner": 120}
+        # 3 frames in batches of 2, the number of steps to train 400 epochs
+        numb_steps = 600
+        with patch.object(Reader, "build_dataset", counted_build_dataset):
+            op_out = TrainModel().execute(OPIO({"model_tag": "000", "angular_mask": [1,1],
+                                                "data": data/data_raw, "train_config": train_config}))
+            self.assertEqual(len(draws), numb_steps)
+            metrics = load_metrics(op_out["train_metrics"])
+            np.testing.assert_array_equal(metrics["epoch"], [0, 200, 400])
+            self.assertTrue(np.all(np.isfinite(metrics["train_err"])))
+            del draws[:]
+            op_out = TrainModels().execute(OPIO({"model_tag": ["000", "001"], "angular_mask": [1,1],
+                                                 "data": data/data_raw, "train_config": train_config}))
+            # one pipeline per member
+            self.assertEqual(len(draws), 2 * numb_steps)
+            for metrics_name in op_out["train_metrics"]:
+                metrics = load_metrics(metrics_name)
+                np.testing.assert_array_equal(metrics["epoch"], [0, 200, 400])
+                self.assertTrue(np.all(np.isfinite(metrics["train_err"])))
+
+    def test_mix(self):
+        op = TrainModel()
+        data = Path(os.path.abspath(self.datapath))
+        np.save(data/data_new, np.array(DATA_NEW))
+        np.save(data/data_old, np.array(DATA_OLD))
+        train_config = {"neurons": [20, 20], "resnet": True, "batch_size": 2,
+                        "epoches": 200, "init_lr": 0.0008, "decay_steps": 120,
+                        "decay_rate": 0.96, "train_thread": 8, "drop_out_rate": 0.3, 
+                        "numb_threads": 8, "use_mix": True, "old_ratio": 1, "restart": False, "decay_steps_inner": 120}
+        op_in = OPIO(
+            {
+                "model_tag": "000",
+                "angular_mask": [1,1],
+                "data": data/data_raw,
+                "data_new": data/data_new,
+                "data_old": data/data_old,
+                "train_config": train_config
+            }
+        )
+        op_out = op.execute(op_in)
+        self.assertTrue(op_out["model"])
+        with open(op_out["train_log"]) as f:
+            self.assertIn("ab_err_o", f.read())
+
+    def test_warm_start(self):
+        op = TrainModels()
+        data = Path(os.path.abspath(self.datapath))
+        train_config = {"neurons": [20, 20], "resnet": True, "batch_size": 2,
+                        "epoches": 200, "init_lr": 0.0008, "decay_steps": 120,
+                        "decay_rate": 0.96, "train_thread": 8, "drop_out_rate": 0.3, 
+                        "numb_threads": 8, "use_mix": False, "restart": False, "decay_steps_inner": 120}
+        op_in = OPIO(
+            {
+                "model_tag": ["000", "001"],
+                "angular_mask": [1,1],
+                "data": data/data_raw,
+                "train_config": train_config
+            }
+        )
+        op_out = op.execute(op_in)
+        Path("init").mkdir()
+        init_models = [Path(shutil.copy(model, "init")) for model in op_out["model"]]
+        for ii in ["000", "001"]:
+            shutil.rmtree(ii)
+        # no further training, the frozen models are the initial ones
+        train_config.update({"warm_start": True, "warm_start_epoches": 0})
+        op_in["init_models"] = init_models
+        op_out = op.execute(op_in)
+        cvs = DATA_RAW[:, :2]
+        for model, init_model in zip(op_out["model"], init_models):
+            np.testing.assert_allclose(NumpyModel.from_graph(model).evaluate(cvs)[1],
+                                       NumpyModel.from_graph(init_model).evaluate(cvs)[1], rtol=1e-5, atol=1e-5)
+
+    def test_optimize_graph(self):
+        op = TrainModel()
+        data = Path(os.path.abspath(self.datapath))
+        train_config = {"neurons": [20, 20], "resnet": True, "batch_size": 2,
+                        "epoches": 200, "init_lr": 0.0008, "decay_steps": 120,
+                        "decay_rate": 0.96, "train_thread": 8, "drop_out_rate": 0.3, 
+                        "numb_threads": 8, "use_mix": False, "restart": False, "decay_steps_inner": 120,
+                        "optimize_graph": False}
+        op_in = OPIO(
+            {
+                "model_tag": "000",
+                "angular_mask": [1,0],
+                "data": data/data_raw,
+                "train_config": train_config
+            }
+        )
+        op_out = op.execute(op_in)
+        optimized = Path("000")/"optimized.pb"
+        report = optimize_model(op_out["model"], optimized, repeat=10)
+        self.assertLess(report["ops_after"], report["ops_before"])
+        cvs = DATA_RAW[:, :2]
+        energy, forces = ef_ensemble(load_session(str(op_out["model"])), cvs)
+        opt_energy, opt_forces = ef_ensemble(load_session(str(optimized)), cvs)
+        np.testing.assert_allclose(opt_energy, energy, rtol=1e-5, atol=1e-5)
+        np.testing.assert_allclose(opt_forces, forces, rtol=1e-5, atol=1e-5)
+        # weights keep their names
+        weights, opt_weights = load_weights(op_out["model"]), load_weights(optimized)
+        for name in ["layer_0/matrix", "layer_1/timestep", "energy/matrix", "input_shift", "input_scale"]:
+            np.testing.assert_array_equal(opt_weights[name], weights[name])
+
+    def test_optimize_graph_masks(self):
+        Path("000").mkdir()
+        rng = np.random.RandomState(0)
+        for seed, (angular_mask, neurons) in enumerate([([1,1], [8, 8]), ([0,0], [8, 8]), ([1,0,0,1], [6, 6, 4]), ([0,1,0], [8])]):
+            cv_dim = len(angular_mask)
+            cvs = np.where(np.array(angular_mask) == 1, rng.uniform(-np.pi, np.pi, (20, cv_dim)), rng.uniform(0, 2, (20, cv_dim)))
+            for model in write_models("000", angular_mask, 2, neurons=neurons, seed=seed):
+                optimized = model.with_name("optimized.pb")
+                optimize_model(model, optimized, repeat=1)
+                energy, forces = ef_ensemble(load_session(str(model)), cvs)
+                opt_energy, opt_forces = ef_ensemble(load_session(str(optimized)), cvs)
+                np.testing.assert_allclose(opt_energy, energy, rtol=1e-5, atol=1e-5)
+                np.testing.assert_allclose(opt_forces, forces, rtol=1e-5, atol=1e-5)
+
+    def test_distill(self):
+        op = DistillModel()
+        data = Path(os.path.abspath(self.datapath))
+        models = [data/"models"/("model_%03d.pb" % ii) for ii in range(4)]
+        train_config = {"neurons": [20, 20], "resnet": True, "batch_size": 2,
+                        "epoches": 200, "init_lr": 0.0008, "decay_steps": 120,
+                        "decay_rate": 0.96, "drop_out_rate": 0.3, "numb_threads": 8,
+                        "distill": {"neurons": [10, 10], "epoches": 20, "max_frames": 50}}
+        op_in = OPIO(
+            {
+                "models": models,
+                "angular_mask": [1,1],
+                "data": data/data_raw,
+                "plm_out": [data/"plm.out"],
+                "train_config": train_config,
+                "trust_lvl_1": [2., 1.],
+                "trust_lvl_2": [3., 2.]
+            }
+        )
+        op_out = op.execute(op_in)
+        self.assertTrue(op_out["model"].is_file())
+        distill_data = np.load(Path(distill_tag)/distill_data_name)
+        # CVs of the training data and max_frames exploration frames
+        self.assertEqual(distill_data.shape, (len(DATA_RAW) + 50, 4))
+        np.testing.assert_allclose(distill_data[:len(DATA_RAW), :2], DATA_RAW[:, :2])
+        # targets are the switched ensemble mean forces
+        energy, forces = ef_ensemble(load_session([str(model) for model in models]), DATA_RAW[:, :2])
+        stds = compute_std(forces * f_cvt)
+        trusted = stds < 1.
+        np.testing.assert_allclose(distill_data[:len(DATA_RAW), 2:][trusted], np.mean(forces, axis=0)[trusted] * f_cvt, rtol=1e-5)
+        np.testing.assert_array_equal(distill_data[:len(DATA_RAW), 2:][stds > 2.], 0.)
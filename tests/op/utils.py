@@ -7,6 +7,31 @@ DATA_RAW = np.concatenate((DATA_OLD, DATA_NEW), axis=0)
 DATA_EMPTY = []
 
 
+def write_models(path, angular_mask, numb_models, neurons=[8, 8], seed=0, scaled=True):
+    """Frozen graphs of random resnet networks, with distances shifted, and scaled if `scaled`."""
+    from pathlib import Path
+    from rid.nn.ensemble import member_graph_def
+    rng = np.random.RandomState(seed)
+    angular_mask = np.array(angular_mask)
+    cv_dim = len(angular_mask)
+    models = []
+    for ii in range(numb_models):
+        weights = {"input_shift": np.where(angular_mask == 1, 0., rng.uniform(0, 1, cv_dim)),
+                   "input_scale": np.where((angular_mask == 1) | (not scaled), 1., rng.uniform(0.5, 3, cv_dim))}
+        in_size = cv_dim + np.sum(angular_mask)
+        for jj, size in enumerate(neurons):
+            weights[f"layer_{jj}/matrix"] = rng.normal(size=(in_size, size))
+            weights[f"layer_{jj}/bias"] = rng.normal(size=size)
+            if jj > 0 and size == in_size:
+                weights[f"layer_{jj}/timestep"] = rng.uniform(0, 0.2, size)
+            in_size = size
+        weights["energy/matrix"] = rng.normal(size=(in_size, 1))
+        model = Path(path)/f"model_{ii:03d}.pb"
+        with open(model, "wb") as f:
+            f.write(member_graph_def(weights, angular_mask).SerializeToString())
+        models.append(model)
+    return models
+
 
 def npy2txt(npy):
     data = np.load(npy)